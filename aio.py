@@ -0,0 +1,242 @@
+from collections import namedtuple
+import asyncio
+import multiprocessing
+import os
+import traceback
+
+from cache import diskCache
+from config import config, useConfig
+from specs import Spec, makeSpec
+
+#event is "start" or "end", depth counts the stages the stage is nested in, duration is in seconds and None on "start"
+ProgressEvent = namedtuple("ProgressEvent", ["event", "stage", "depth", "duration"])
+
+def workerMain(connection):
+	"""
+	Build parts sent over connection until it closes. Runs in the worker processes of AsyncBuilder.
+
+	Each request is a (spec, memoryLimit, settings, cacheEnabled) tuple, where settings is the caller's
+	config.settings() and cacheEnabled its diskCache.enabled. Stage events are sent back
+	as ("stage", event, name, depth, duration) while the part builds,
+	followed by ("done", BREP bytes), ("memory", traceback) or ("error", traceback).
+	"""
+	import resource
+	import gen_bin
+	from cache import shapeToBytes, workplaneShape
+	from instrument import addStageListener
+	softLimit, hardLimit = resource.getrlimit(resource.RLIMIT_AS)
+
+	def report(event, stage):
+		connection.send(("stage", event, stage.name, stage.depth, stage.duration))
+	addStageListener(report)
+
+	while True:
+		try:
+			spec, memoryLimit, settings, cacheEnabled = connection.recv()
+		except EOFError:
+			return
+		diskCache.enabled = cacheEnabled
+		try:
+			if memoryLimit is not None:
+				resource.setrlimit(resource.RLIMIT_AS, (memoryLimit, hardLimit))
+			with useConfig(**settings):
+				message = ("done", shapeToBytes(workplaneShape(spec.build())))
+		except MemoryError:
+			message = ("memory", traceback.format_exc())
+		except Exception:
+			message = ("error", traceback.format_exc())
+		finally:
+			resource.setrlimit(resource.RLIMIT_AS, (softLimit, hardLimit))
+		connection.send(message)
+
+class Worker:
+	"""
+	One worker process and the parent's end of its pipe
+	"""
+	def __init__(self, context):
+		self.connection, child = context.Pipe()
+		self.process = context.Process(target=workerMain, args=(child,), daemon=True)
+		self.process.start()
+		child.close()
+
+	def kill(self):
+		"""
+		Stop the process straight away, whatever it is doing
+		"""
+		self.process.kill()
+		self.process.join()
+		self.connection.close()
+
+class AsyncBuilder:
+	"""
+	Builds parts for asyncio code, in worker processes which can be killed part way through a build.
+	Workers are kept between builds, so only the first build on each pays for importing cadquery.
+	"""
+	def __init__(
+			self,
+			maxWorkers	= None,
+			):
+		"""
+		:param maxWorkers: Number of builds allowed to run at once. Defaults to the number of CPUs
+		"""
+		self.maxWorkers	= maxWorkers or os.cpu_count()
+		self.context	= multiprocessing.get_context("spawn")
+		self.semaphore	= None
+		self.loop		= None
+		self.idle		= []
+
+	async def build(
+			self,
+			spec,
+			timeout		= None,
+			memoryLimit	= None,
+			onProgress	= None,
+			):
+		"""
+		Build a part without blocking the event loop.
+		If the call is cancelled or times out, the worker building the part is killed.
+
+		:param spec: A BinSpec, TraySpec or PlateSpec
+		:param timeout: Seconds to wait for the part, including any wait for a free worker. None waits forever
+		:param memoryLimit: Address space limit for the worker while it builds, in bytes. None for no limit
+		:param onProgress: Function called on the event loop with a ProgressEvent as each build stage starts and ends
+
+		:return: The part as binary BREP bytes
+		"""
+		return await asyncio.wait_for(self.runWhenFree(spec, memoryLimit, onProgress), timeout)
+
+	async def runWhenFree(self, spec, memoryLimit, onProgress):
+		"""
+		Wait for a free worker, then run the build on it
+		"""
+		#a semaphore belongs to one event loop, so a builder used from a new loop needs a new one
+		loop = asyncio.get_running_loop()
+		if self.loop is not loop:
+			self.loop		= loop
+			self.semaphore	= asyncio.Semaphore(self.maxWorkers)
+		async with self.semaphore:
+			worker = self.idle.pop() if self.idle else Worker(self.context)
+			try:
+				kind, payload = await self.run(worker, spec, memoryLimit, onProgress)
+			except BaseException:
+				#cancelled or timed out, so the build is abandoned along with its worker
+				worker.kill()
+				raise
+			if (kind == "died"):
+				worker.kill()
+			else:
+				self.idle.append(worker)
+		match kind:
+			case "done":
+				return payload
+			case "memory":
+				raise MemoryError("Building {} went over the memory limit of {} bytes\n{}".format(spec, memoryLimit, payload))
+			case "died":
+				#OCCT often crashes rather than raising when an allocation fails
+				if memoryLimit is not None:
+					raise MemoryError("Worker building {} exited with code {} under a memory limit of {} bytes".format(spec, payload, memoryLimit))
+				raise Exception("Worker building {} exited with code {}".format(spec, payload))
+		raise Exception("Could not build {}\n{}".format(spec, payload))
+
+	async def run(self, worker, spec, memoryLimit, onProgress):
+		"""
+		Send one build to a worker, passing on its stage events until it finishes
+
+		:return: A tuple of the kind of reply and its payload
+		"""
+		loop = asyncio.get_running_loop()
+		#workers are spawned, so they start from the default config and cache
+		worker.connection.send((spec, memoryLimit, config.settings(), diskCache.enabled))
+		while True:
+			try:
+				message = await loop.run_in_executor(None, worker.connection.recv)
+			except (EOFError, OSError):
+				#the process died, eg. killed by the OS for running out of memory
+				worker.process.join()
+				return ("died", worker.process.exitcode)
+			if (message[0] != "stage"):
+				return message
+			if onProgress is not None:
+				onProgress(ProgressEvent(*message[1:]))
+
+	def close(self):
+		"""
+		Stop the idle workers. Builds still running keep their workers until they finish.
+		"""
+		for worker in self.idle:
+			worker.kill()
+		self.idle.clear()
+
+defaultBuilder = None
+
+async def buildAsync(
+		generator,
+		*args,
+		builder		= None,
+		timeout		= None,
+		memoryLimit	= None,
+		onProgress	= None,
+		**kwargs,
+		):
+	"""
+	Run a generator in a worker process without blocking the event loop
+
+	:param generator: Name of the generator, eg. "binCompartments"
+	:param args: Arguments for the generator, or a single spec
+	:param builder: AsyncBuilder to run on. Defaults to a shared one, started on first use
+	:param timeout: Seconds to wait for the part. None waits forever
+	:param memoryLimit: Address space limit for the worker while it builds, in bytes. None for no limit
+	:param onProgress: Function called with a ProgressEvent as each build stage starts and ends
+	:param kwargs: Keyword arguments for the generator
+
+	:return: The part as a cq.Workplane
+	"""
+	global defaultBuilder
+	from cache import shapeFromBytes
+	import cadquery as cq
+	if (len(args) == 1 and isinstance(args[0], Spec)):
+		spec = args[0]
+	else:
+		spec = makeSpec(generator, *args, **kwargs)
+	if builder is None:
+		if defaultBuilder is None:
+			defaultBuilder = AsyncBuilder()
+		builder = defaultBuilder
+	data = await builder.build(spec, timeout, memoryLimit, onProgress)
+	return cq.Workplane("XY").newObject([shapeFromBytes(data)])
+
+async def binSolid(*args, **kwargs):
+	"""
+	gen_bin.binSolid() run by buildAsync(), which also takes builder, timeout, memoryLimit and onProgress
+	"""
+	return await buildAsync("binSolid", *args, **kwargs)
+
+async def binCompartments(*args, **kwargs):
+	"""
+	gen_bin.binCompartments() run by buildAsync(), which also takes builder, timeout, memoryLimit and onProgress
+	"""
+	return await buildAsync("binCompartments", *args, **kwargs)
+
+async def binClearWindow(*args, **kwargs):
+	"""
+	gen_bin.binClearWindow() run by buildAsync(), which also takes builder, timeout, memoryLimit and onProgress
+	"""
+	return await buildAsync("binClearWindow", *args, **kwargs)
+
+async def trayClearWindow(*args, **kwargs):
+	"""
+	gen_bin.trayClearWindow() run by buildAsync(), which also takes builder, timeout, memoryLimit and onProgress
+	"""
+	return await buildAsync("trayClearWindow", *args, **kwargs)
+
+async def trayAngleAdaptor(*args, **kwargs):
+	"""
+	gen_bin.trayAngleAdaptor() run by buildAsync(), which also takes builder, timeout, memoryLimit and onProgress
+	"""
+	return await buildAsync("trayAngleAdaptor", *args, **kwargs)
+
+async def baseplate(*args, **kwargs):
+	"""
+	gen_baseplate.baseplate() run by buildAsync(), which also takes builder, timeout, memoryLimit and onProgress
+	"""
+	return await buildAsync("baseplate", *args, **kwargs)
@@ -0,0 +1,180 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import traceback
+
+from cache import shapeToBytes, workplaneShape
+from calculator import evaluateCatalog
+from specs import Spec, BinSpec, makeSpec, uniqueSpecs
+
+#index is the position of spec in the list passed to generateBatch()
+#exactly one of data and error is set
+BatchResult = namedtuple("BatchResult", ["index", "spec", "data", "error"])
+
+def buildPart(
+		spec,
+		output				= "brep",
+		tolerance			= 0.1,
+		angularTolerance	= 0.1,
+		):
+	"""
+	Build a single part from a spec. Runs inside the worker processes of generateBatch().
+
+	:param spec: A BinSpec/TraySpec/PlateSpec, or a dict with the generator name under "generator" and its keyword arguments
+	:param output: "brep" for binary BREP bytes, or "mesh" for a (vertices, triangles) tuple
+	:param tolerance: Linear deflection used when output is "mesh"
+	:param angularTolerance: Angular deflection used when output is "mesh"
+
+	:return: The serialized part
+	"""
+	if not isinstance(spec, Spec):
+		spec = makeSpec(**spec)
+	shape = workplaneShape(spec.build())
+	match output:
+		case "brep":
+			return shapeToBytes(shape)
+		case "mesh":
+			vertices, triangles = shape.tessellate(tolerance, angularTolerance)
+			return ([vertex.toTuple() for vertex in vertices], triangles)
+	raise ValueError("Unknown output {!r}".format(output))
+
+#queue each worker reports the position of the spec it starts on, set by watchStarts()
+startedQueue = None
+
+def watchStarts(queue):
+	"""
+	Worker initializer for buildRound(), keeping the queue to report starts on
+	"""
+	global startedQueue
+	startedQueue = queue
+
+def buildPartSafe(position, *args):
+	"""
+	Run buildPart(), returning (data, None) or (None, error text) so one bad spec can't break the batch
+	"""
+	startedQueue.put(position)
+	try:
+		return (buildPart(*args), None)
+	except Exception:
+		return (None, traceback.format_exc())
+
+def buildRound(
+		specs,
+		distinctSpecs,
+		sharedBy,
+		positions,
+		maxWorkers,
+		buildArguments,
+		):
+	"""
+	Build some of the distinct specs of a batch on a fresh pool, until they are all done or a worker dies and breaks the pool
+
+	:param specs: List of specs passed to generateBatch()
+	:param distinctSpecs: List of every distinct spec in the batch
+	:param sharedBy: List giving the indexes in specs of each distinct spec
+	:param positions: Positions in distinctSpecs to build
+	:param maxWorkers: Number of worker processes
+	:param buildArguments: Tuple of the output, tolerance and angularTolerance for buildPart()
+
+	:return: A generator of BatchResult, which returns a tuple of (positions left unbuilt, positions which were building when the pool broke)
+	"""
+	#SimpleQueue writes straight to the pipe, so a start is never lost when the worker dies right after it
+	started	= multiprocessing.SimpleQueue()
+	done	= set()
+	with ProcessPoolExecutor(maxWorkers, initializer=watchStarts, initargs=(started,)) as pool:
+		futures = {
+			pool.submit(buildPartSafe, position, distinctSpecs[position], *buildArguments): position
+			for position in positions
+		}
+		try:
+			for future in as_completed(futures):
+				position = futures[future]
+				try:
+					data, error = future.result()
+				except BrokenProcessPool:
+					raise
+				except Exception:
+					#eg. the result could not be sent back
+					data, error = None, traceback.format_exc()
+				done.add(position)
+				for index in sharedBy[position]:
+					yield BatchResult(index, specs[index], data, error)
+		except BrokenProcessPool:
+			pass
+	building = set()
+	while not started.empty():
+		building.add(started.get())
+	started.close()
+	unfinished = [position for position in positions if position not in done]
+	return (unfinished, [position for position in unfinished if position in building])
+
+def generateBatch(
+		specs,
+		output				= "brep",
+		maxWorkers			= None,
+		tolerance			= 0.1,
+		angularTolerance	= 0.1,
+		):
+	"""
+	Build a list of parts across a pool of worker processes
+
+	Specs are normalized first, and each distinct part is only built once -
+	equivalent specs share the result. Results are yielded as soon as each
+	part finishes, so they arrive in completion order rather than the order
+	of specs. A spec which fails yields a result with error set, and the
+	rest of the batch carries on. Bins are checked with
+	calculator.evaluateCatalog() first, so ones which cannot be built are
+	rejected before any worker starts.
+
+	:param specs: List of BinSpec/TraySpec/PlateSpec, or dicts with the generator name under "generator" and its keyword arguments
+	:param output: "brep" for binary BREP bytes, or "mesh" for a (vertices, triangles) tuple
+	:param maxWorkers: Number of worker processes. Defaults to the number of CPUs
+	:param tolerance: Linear deflection used when output is "mesh"
+	:param angularTolerance: Angular deflection used when output is "mesh"
+
+	:return: A generator of BatchResult
+	"""
+	specs = list(specs)
+	validSpecs		= []
+	validIndexes	= []
+	for index, spec in enumerate(specs):
+		try:
+			validSpecs.append(spec if isinstance(spec, Spec) else makeSpec(**spec))
+			validIndexes.append(index)
+		except Exception:
+			#reject bad specs before building anything
+			yield BatchResult(index, spec, None, traceback.format_exc())
+	#and bins which OCCT would fail to build
+	binPositions = [position for position, spec in enumerate(validSpecs) if isinstance(spec, BinSpec)]
+	if binPositions:
+		errors = evaluateCatalog([validSpecs[position] for position in binPositions])["errors"]
+		rejected = {position: messages for position, messages in zip(binPositions, errors) if messages}
+		for position, messages in rejected.items():
+			yield BatchResult(validIndexes[position], specs[validIndexes[position]], None, "\n".join(messages))
+		validSpecs		= [spec for position, spec in enumerate(validSpecs) if position not in rejected]
+		validIndexes	= [index for position, index in enumerate(validIndexes) if position not in rejected]
+	distinctSpecs, positions = uniqueSpecs(validSpecs)
+	sharedBy = [[] for _ in distinctSpecs]
+	for index, position in zip(validIndexes, positions):
+		sharedBy[position].append(index)
+
+	#a worker dying, eg. a crash inside OCCT, breaks its whole pool - so only the spec it was building is
+	#failed, and the rest are built again on a fresh pool. Several specs building at once are retried
+	#one at a time, to find which of them crashed.
+	rounds = [(list(range(len(distinctSpecs))), maxWorkers)]
+	while rounds:
+		positions, workers = rounds.pop(0)
+		unfinished, building = yield from buildRound(specs, distinctSpecs, sharedBy, positions, workers, (output, tolerance, angularTolerance))
+		#nothing reported starting means the pool broke before it built anything
+		suspects = building or unfinished
+		if (len(suspects) == 1 or workers == 1):
+			for position in suspects:
+				for index in sharedBy[position]:
+					yield BatchResult(index, specs[index], None, "The worker building this part died, eg. from a crash inside OCCT")
+		else:
+			rounds.insert(0, (suspects, 1))
+		rest = [position for position in unfinished if position not in suspects]
+		if rest:
+			rounds.append((rest, workers))
+
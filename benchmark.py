@@ -0,0 +1,257 @@
+from enum import Enum
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import platform
+import resource
+import time
+from math import ceil
+
+from cache import diskCache, stageCache, unitCache
+from config import useConfig
+from instrument import trace
+from gen_bin import *
+
+def timed(function, *args, **kwargs):
+	"""
+	Call function, measuring the wall time it takes
+
+	:return: A tuple of (result, seconds)
+	"""
+	start = time.perf_counter()
+	result = function(*args, **kwargs)
+	return (result, time.perf_counter()-start)
+
+def sequentialCut(unit, offsets, base):
+	"""
+	Cut each translated copy of unit from base one at a time - the reference tileCut() is measured against
+	"""
+	for offset in offsets:
+		base = base.cut(unit.translate(offset))
+	return base
+
+def benchCompartmentCutting(
+		quick	= False,
+		binZ	= 3,
+		):
+	"""
+	Compare cutting compartments one boolean at a time against tileCut(), over divX * divY grids up to 10x10.
+	Bins are sized to keep compartments printable.
+
+	:param quick: Only measure a small subset, for a fast check
+	:param binZ: Height of the bins, in height units
+
+	:return: A list of result dicts
+	"""
+	grids = ((2, 2), (4, 4)) if quick else ((1, 1), (2, 2), (4, 2), (4, 4), (6, 4), (6, 6), (8, 8), (10, 10))
+	results = []
+	for divX, divY in grids:
+		binX = max(1, ceil(divX/2))
+		binY = max(1, ceil(divY/2))
+		stageCache.clear()
+		returnBin = binSolid(binX, binY, binZ)
+		cutterTemplate, offsetList = compartmentCutters(binX, binY, binZ, divX, divY)
+		sequential, sequentialTime	= timed(sequentialCut, cutterTemplate, offsetList, returnBin)
+		batched, batchedTime		= timed(tileCut, cutterTemplate, offsetList, returnBin)
+		results.append({
+			"benchmark":		"compartmentCutting",
+			"binX":				binX,
+			"binY":				binY,
+			"divX":				divX,
+			"divY":				divY,
+			"sequentialTime":	sequentialTime,
+			"batchedTime":		batchedTime,
+			"speedup":			sequentialTime/batchedTime,
+			"volumeDifference":	abs(sequential.val().Volume()-batched.val().Volume()),
+		})
+	return results
+
+def generatorCases(quick=False):
+	"""
+	List the generator calls to measure, sweeping sizes, heights and divisions
+
+	:param quick: Only measure a small subset, for a fast check
+
+	:return: A list of (generator name, kwargs) tuples
+	"""
+	sizes		= (1, 2, 3) if quick else (1, 2, 3, 4, 6, 8, 10)
+	heights		= (1, 6) if quick else (1, 2, 3, 4, 6, 8, 10, 12)
+	divGrids	= ((1, 1), (2, 2)) if quick else ((1, 1), (2, 1), (2, 2), (3, 3), (4, 4), (6, 6), (8, 8), (10, 10))
+	cases = []
+	for size in sizes:
+		cases.append(("baseplate", {"plateX": size, "plateY": size}))
+		cases.append(("binSolid", {"binX": size, "binY": size, "binZ": 3}))
+		cases.append(("binSolid", {"binX": size, "binY": size, "binZ": 3, "topStyle": TopStyle.INT_DIV}))
+		cases.append(("binClearWindow", {"binX": size, "binY": size, "binZ": 3}))
+		if size <= 8:
+			cases.append(("trayClearWindow", {"trayX": size, "trayY": size}))
+	for height in heights:
+		cases.append(("binSolid", {"binX": 1, "binY": 1, "binZ": height}))
+		cases.append(("trayAngleAdaptor", {"binHeight": height}))
+	for divX, divY in divGrids:
+		cases.append(("binCompartments", {"binX": max(1, ceil(divX/2)), "binY": max(1, ceil(divY/2)), "binZ": 3, "divX": divX, "divY": divY}))
+	for topX in ((1, 2) if quick else (1, 2, 3, 4, 6, 8)):
+		cases.append(("trayAngleAdaptor", {"topX": topX}))
+	for type in CrossSection:
+		cases.append(("crossSection", {"item": ("binCompartments", {"binX": 2, "binY": 2, "binZ": 6, "divX": 2, "divY": 2}), "type": type}))
+	for axis in ("X", "Y", "Z"):
+		cases.append(("section", {"item": ("binCompartments", {"binX": 2, "binY": 2, "binZ": 6, "divX": 2, "divY": 2}), "axis": axis}))
+	return cases
+
+def measureCase(name, kwargs, connection):
+	"""
+	Build one case and send its measurements down connection. Runs in its own process so peak RSS is per case.
+	"""
+	try:
+		generator = globals()[name]
+		if "item" in kwargs:
+			itemName, itemKwargs = kwargs["item"]
+			kwargs = dict(kwargs, item=globals()[itemName](**itemKwargs))
+		#the case is forked from a process which may have built the same cells and stages already, so time it cold
+		unitCache.clear()
+		stageCache.clear()
+		startRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		#keep the report clean of anything the generators print
+		with contextlib.redirect_stdout(io.StringIO()):
+			result, seconds = timed(generator, **kwargs)
+		shape = result.val()
+		connection.send({
+			"time":			seconds,
+			"peakRSS":		resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024,
+			"startRSS":		startRSS*1024,
+			"faces":		len(shape.Faces()),
+			"edges":		len(shape.Edges()),
+			"volume":		shape.Volume(),
+		})
+	except Exception as e:
+		connection.send({"error": repr(e)})
+	finally:
+		connection.close()
+
+def benchGenerators(quick=False):
+	"""
+	Measure wall time, peak RSS and face/edge counts for every generator over a sweep of sizes
+
+	:param quick: Only measure a small subset, for a fast check
+
+	:return: A list of result dicts
+	"""
+	context = multiprocessing.get_context("fork")
+	results = []
+	for name, kwargs in generatorCases(quick):
+		receiver, sender = context.Pipe(False)
+		process = context.Process(target=measureCase, args=(name, kwargs, sender))
+		process.start()
+		sender.close()
+		try:
+			measured = receiver.recv()
+		except EOFError:
+			measured = {"error": "worker exited with code {}".format(process.exitcode)}
+		process.join()
+		arguments = {
+			key: (value.name if isinstance(value, Enum) else value)
+			for key, value in kwargs.items()
+		}
+		results.append(dict(benchmark="generator", generator=name, arguments=arguments, **measured))
+	return results
+
+def benchBooleanOptions(quick = False):
+	"""
+	Compare config's boolean settings on the tiling heavy parts - baseplates, and bins with divided bottoms.
+	Unit cells are built before timing, so only the tiling is measured.
+
+	:param quick: Only measure a small subset, for a fast check
+
+	:return: A list of result dicts
+	"""
+	settingsList = (
+		{},
+		{"parallel": False},
+		{"glue": Glue.SHIFT},
+		{"glue": Glue.FULL},
+		{"fuzzyValue": 1e-5},
+	)
+	cases = [("baseplate", {"plateX": size, "plateY": size}) for size in ((2, 4) if quick else (2, 4, 6, 8, 10))]
+	cases += [("binSolid", {"binX": size, "binY": size, "binZ": 3, "bottomDivX": 2, "bottomDivY": 2}) for size in ((2,) if quick else (2, 4, 6))]
+	results = []
+	for name, kwargs in cases:
+		generator = globals()[name]
+		for settings in settingsList:
+			with useConfig(**settings):
+				#build the cells outside the timing, but not the stages being measured
+				generator(**kwargs)
+				stageCache.clear()
+				with contextlib.redirect_stdout(io.StringIO()):
+					result, seconds = timed(generator, **kwargs)
+			shape = result.val()
+			results.append({
+				"benchmark":	"booleanOptions",
+				"generator":	name,
+				"arguments":	kwargs,
+				"settings":		{key: (value.name if isinstance(value, Enum) else value) for key, value in settings.items()},
+				"time":			seconds,
+				"faces":		len(shape.Faces()),
+				"volume":		shape.Volume(),
+				"valid":		shape.isValid(),
+			})
+	return results
+
+def benchTrayWindows(quick = False):
+	"""
+	Measure trayClearWindow() over square trays up to 8x8, with the time and boolean count of its window cutting on their own
+
+	:param quick: Only measure a small subset, for a fast check
+
+	:return: A list of result dicts
+	"""
+	results = []
+	for size in ((1, 2, 4) if quick else (1, 2, 3, 4, 6, 8)):
+		stageCache.clear()
+		with trace("trayClearWindow") as partTrace:
+			with contextlib.redirect_stdout(io.StringIO()):
+				result, seconds = timed(trayClearWindow, size, size)
+		windows = [stage for stage in partTrace.stages if stage.name == "windows"][0]
+		results.append({
+			"benchmark":		"trayWindows",
+			"trayX":			size,
+			"trayY":			size,
+			"time":				seconds,
+			"booleans":			partTrace.booleans,
+			"windowTime":		windows.duration,
+			"windowBooleans":	windows.booleans,
+			"faces":			len(result.val().Faces()),
+		})
+	return results
+
+suites = {
+	"generators":			benchGenerators,
+	"compartmentCutting":	benchCompartmentCutting,
+	"booleanOptions":		benchBooleanOptions,
+	"trayWindows":			benchTrayWindows,
+}
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark the gridfinity generators")
+	parser.add_argument("--output", help="write the results to this JSON file instead of stdout")
+	parser.add_argument("--suite", action="append", choices=sorted(suites), help="suite to run, may be repeated (default: all)")
+	parser.add_argument("--quick", action="store_true", help="only measure a small subset of each sweep")
+	args = parser.parse_args()
+
+	#always measure the real build
+	diskCache.enabled = False
+	report = {
+		"created":		time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+		"python":		platform.python_version(),
+		"cadquery":		cq.__version__,
+		"machine":		platform.platform(),
+		"results":		[],
+	}
+	for name in (args.suite or sorted(suites)):
+		report["results"] += suites[name](args.quick)
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=1)
+	else:
+		print(json.dumps(report, indent=1))
@@ -0,0 +1,427 @@
+from collections import OrderedDict
+from functools import wraps
+from enum import Enum
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+
+import standards
+from config import config
+
+class CachedWorkplane:
+	"""
+	The shapes and plane of a cached workplane, without its context
+	"""
+	def __init__(self, workplane):
+		plane = workplane.plane
+		self.origin	= plane.origin
+		self.xDir	= plane.xDir
+		self.zDir	= plane.zDir
+		self.shapes	= tuple(workplane.vals())
+
+	def workplane(self):
+		"""
+		:return: A new cq.Workplane holding the stored shapes
+		"""
+		import cadquery as cq
+		return cq.Workplane(cq.Plane(self.origin, self.xDir, self.zDir)).newObject(list(self.shapes))
+
+def freezeValue(value):
+	"""
+	Replace every workplane in a value, including those inside tuples, with its CachedWorkplane
+	"""
+	if isinstance(value, tuple):
+		return tuple(freezeValue(item) for item in value)
+	if hasattr(value, "vals") and hasattr(value, "plane"):
+		return CachedWorkplane(value)
+	return value
+
+def thawValue(value):
+	"""
+	Undo freezeValue(), giving every caller its own workplanes
+	"""
+	if isinstance(value, tuple):
+		return tuple(thawValue(item) for item in value)
+	if isinstance(value, CachedWorkplane):
+		return value.workplane()
+	if isinstance(value, list):
+		return list(value)
+	return value
+
+class LRUCache:
+	"""
+	A small in-process least-recently-used cache
+
+	Workplanes are stored as their shapes and rebuilt on every get(), since
+	a cq.Workplane shares a mutable context with every workplane made from
+	it, and some methods, eg. add(), change the workplane in place.
+	"""
+	def __init__(
+			self,
+			maxSize	= 64,
+			):
+		"""
+		:param maxSize: Maximum number of entries kept before the least recently used is dropped
+		"""
+		if (maxSize <= 0):
+			raise ValueError("maxSize cannot be less than 1")
+		self.maxSize	= maxSize
+		self.hits		= 0
+		self.misses		= 0
+		self.entries	= OrderedDict()
+
+	def get(self, key, builder):
+		"""
+		Return the cached value for key, calling builder() to create it if missing
+
+		:param key: Hashable key for the value
+		:param builder: Function taking no arguments that builds the value
+
+		:return: The cached or newly built value, with new workplanes each call
+		"""
+		if key in self.entries:
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return thawValue(self.entries[key])
+		self.misses += 1
+		value = freezeValue(builder())
+		self.entries[key] = value
+		if len(self.entries) > self.maxSize:
+			self.entries.popitem(last=False)
+		return thawValue(value)
+
+	def clear(self):
+		"""
+		Drop every entry and reset the hit/miss counters
+		"""
+		self.entries.clear()
+		self.hits	= 0
+		self.misses	= 0
+
+	def info(self):
+		"""
+		:return: A dict of hits, misses, current size and maxSize
+		"""
+		return {
+			"hits":		self.hits,
+			"misses":	self.misses,
+			"size":		len(self.entries),
+			"maxSize":	self.maxSize,
+		}
+
+def standardsKey():
+	"""
+	Collect every numeric constant in standards, so cached geometry is rebuilt if any of them change
+
+	:return: A sorted tuple of (name, value) pairs
+	"""
+	return tuple(
+		(name, value)
+		for name, value in sorted(vars(standards).items())
+		if isinstance(value, (int, float)) and not name.startswith("_")
+	)
+
+#unit cells shared by baseplate() and binSolid()
+unitCache = LRUCache(64)
+
+def shapeToBytes(shape):
+	"""
+	Serialize a shape as binary BREP
+
+	:param shape: The cq.Shape to serialize
+
+	:return: The binary BREP data
+	"""
+	from OCP.BinTools import BinTools
+	#BinTools is given a real file - writing through a python stream corrupts some shapes
+	handle, path = tempfile.mkstemp(suffix=".brep")
+	os.close(handle)
+	try:
+		BinTools.Write_s(shape.wrapped, path)
+		with open(path, "rb") as f:
+			return f.read()
+	finally:
+		os.remove(path)
+
+def shapeFromBytes(data):
+	"""
+	Deserialize a shape written by shapeToBytes()
+
+	:param data: Binary BREP data
+
+	:return: The cq.Shape
+	"""
+	import cadquery as cq
+	from OCP.BinTools import BinTools
+	from OCP.TopoDS import TopoDS_Shape
+	handle, path = tempfile.mkstemp(suffix=".brep")
+	try:
+		with os.fdopen(handle, "wb") as f:
+			f.write(data)
+		shape = TopoDS_Shape()
+		BinTools.Read_s(shape, path)
+	finally:
+		os.remove(path)
+	return cq.Shape.cast(shape)
+
+def workplaneShape(workplane):
+	"""
+	Collapse the shapes on a workplane's stack into one shape
+
+	:param workplane: The cq.Workplane returned by a generator
+
+	:return: The only shape on the stack, or a compound of all of them
+	"""
+	import cadquery as cq
+	shapes = [item for item in workplane.vals() if isinstance(item, cq.Shape)]
+	if (len(shapes) == 1):
+		return shapes[0]
+	return cq.Compound.makeCompound(shapes)
+
+def normalizeArgument(value):
+	"""
+	Convert an argument to a canonical string, so equivalent spellings (1 and 1.0) share a key
+
+	:param value: The argument value
+
+	:return: A string representation of the value
+	"""
+	if isinstance(value, Enum):
+		return type(value).__name__ + "." + value.name
+	if isinstance(value, bool) or value is None:
+		return repr(value)
+	if isinstance(value, (int, float)):
+		return repr(float(value))
+	return repr(value)
+
+#modules besides the gen_*.py generators which change the geometry - sizes, divisions, defaults and boolean settings
+geometryModules = ("calculator.py", "config.py", "specs.py", "standards.py")
+
+_codeVersion = None
+
+def codeVersion():
+	"""
+	Hash the sources of the generators and every module they build with, so cached parts are dropped whenever the code changes
+
+	:return: A short hex digest
+	"""
+	global _codeVersion
+	if _codeVersion is None:
+		digest = hashlib.sha256()
+		folder = os.path.dirname(os.path.abspath(__file__))
+		for name in sorted(os.listdir(folder)):
+			if (name.startswith("gen_") and name.endswith(".py")) or name in geometryModules:
+				with open(os.path.join(folder, name), "rb") as f:
+					digest.update(name.encode())
+					digest.update(f.read())
+		_codeVersion = digest.hexdigest()[:16]
+	return _codeVersion
+
+def defaultCacheDirectory():
+	"""
+	:return: $GRIDFINITY_CACHE_DIR, or cq-gridfinity inside the user cache directory
+	"""
+	if os.environ.get("GRIDFINITY_CACHE_DIR"):
+		return os.environ["GRIDFINITY_CACHE_DIR"]
+	base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+	return os.path.join(base, "cq-gridfinity")
+
+class DiskCache:
+	"""
+	A content-addressed cache of finished parts, stored as binary BREP files
+
+	Each file holds a one line JSON header with the workplane the part was
+	built on, followed by the BREP data. Files are evicted least recently
+	used first once the directory grows past maxBytes.
+	"""
+	def __init__(
+			self,
+			directory	= None,
+			maxBytes	= 512*1024*1024,
+			enabled		= None,
+			):
+		"""
+		:param directory: Folder to store parts in. Defaults to defaultCacheDirectory()
+		:param maxBytes: Size cap for the folder, in bytes
+		:param enabled: Whether to use the cache. Defaults to on unless $GRIDFINITY_NO_CACHE is set
+		"""
+		if enabled is None:
+			enabled = not os.environ.get("GRIDFINITY_NO_CACHE")
+		self.directory	= directory or defaultCacheDirectory()
+		self.maxBytes	= maxBytes
+		self.enabled	= enabled
+
+	def key(self, name, arguments):
+		"""
+		:param name: Name of the generator
+		:param arguments: Dict of every argument the generator was called with, defaults included
+
+		:return: The hex digest identifying the part
+		"""
+		normalized = [name, codeVersion(), standardsKey(), config.key()]
+		normalized += [(argName, normalizeArgument(value)) for argName, value in sorted(arguments.items())]
+		return hashlib.sha256(repr(normalized).encode()).hexdigest()
+
+	def path(self, key):
+		"""
+		:return: Location of the file for key
+		"""
+		return os.path.join(self.directory, key + ".brep")
+
+	def load(self, key):
+		"""
+		:param key: Key from key()
+
+		:return: The cached cq.Workplane, or None on a miss
+		"""
+		import cadquery as cq
+		path = self.path(key)
+		try:
+			with open(path, "rb") as f:
+				header = json.loads(f.readline())
+				shape = shapeFromBytes(f.read())
+			#another process may evict the file once it has been read
+			os.utime(path)
+		except (OSError, ValueError):
+			return None
+		plane = cq.Plane(header["origin"], header["xDir"], header["zDir"])
+		return cq.Workplane(plane).newObject([shape])
+
+	def store(self, key, workplane):
+		"""
+		Save a generated part, then evict old parts if the folder is over maxBytes
+
+		:param key: Key from key()
+		:param workplane: The cq.Workplane returned by the generator
+		"""
+		os.makedirs(self.directory, exist_ok=True)
+		plane = workplane.plane
+		header = {
+			"origin":	plane.origin.toTuple(),
+			"xDir":		plane.xDir.toTuple(),
+			"zDir":		plane.zDir.toTuple(),
+		}
+		path = self.path(key)
+		tempPath = "{}.{}.tmp".format(path, os.getpid())
+		with open(tempPath, "wb") as f:
+			f.write(json.dumps(header).encode() + b"\n")
+			f.write(shapeToBytes(workplaneShape(workplane)))
+		os.replace(tempPath, path)
+		self.evict()
+
+	def files(self):
+		"""
+		:return: A list of (mtime, size, path) for every cached part, oldest first
+		"""
+		if not os.path.isdir(self.directory):
+			return []
+		found = []
+		for name in os.listdir(self.directory):
+			if name.endswith(".brep"):
+				path = os.path.join(self.directory, name)
+				try:
+					stat = os.stat(path)
+				except OSError:
+					continue
+				found.append((stat.st_mtime, stat.st_size, path))
+		return sorted(found)
+
+	def evict(self):
+		"""
+		Delete the least recently used parts until the folder fits in maxBytes
+		"""
+		found = self.files()
+		total = sum(size for _, size, _ in found)
+		for _, size, path in found:
+			if total <= self.maxBytes:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			total -= size
+
+	def invalidate(self):
+		"""
+		Delete every cached part
+		"""
+		for _, _, path in self.files():
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+
+	def info(self):
+		"""
+		:return: A dict of directory, number of files, total bytes, maxBytes and enabled
+		"""
+		found = self.files()
+		return {
+			"directory":	self.directory,
+			"files":		len(found),
+			"bytes":		sum(size for _, size, _ in found),
+			"maxBytes":		self.maxBytes,
+			"enabled":		self.enabled,
+		}
+
+#finished parts from the public generators
+diskCache = DiskCache()
+
+#intermediate results of the staged generators, so changing one argument only rebuilds the stages after it
+stageCache = LRUCache(32)
+
+def cachedStage(name, inputs, builder):
+	"""
+	Return the output of one stage of a build from stageCache, calling builder() to create it if missing
+
+	:param name: Name of the stage
+	:param inputs: Tuple of every argument the stage depends on, including the ones of the stages before it
+	:param builder: Function taking no arguments that builds the output
+
+	:return: The cached or newly built output
+	"""
+	key = (name, tuple(normalizeArgument(value) for value in inputs), standardsKey(), config.key())
+	return stageCache.get(key, builder)
+
+#names of the diskCached generators running, outermost first
+cachedCalls = []
+
+def diskCached(generator):
+	"""
+	Decorator which stores the result of a generator in diskCache.
+	Only the outermost call is stored - the parts built inside another generator, eg. the binSolid inside binCompartments, are only loaded if already there.
+	"""
+	signature = inspect.signature(generator)
+
+	@wraps(generator)
+	def wrapper(*args, **kwargs):
+		if not diskCache.enabled:
+			return generator(*args, **kwargs)
+		bound = signature.bind(*args, **kwargs)
+		bound.apply_defaults()
+		key = diskCache.key(generator.__name__, bound.arguments)
+		cached = diskCache.load(key)
+		if cached is not None:
+			return cached
+		outermost = not cachedCalls
+		cachedCalls.append(generator.__name__)
+		try:
+			result = generator(*args, **kwargs)
+		finally:
+			cachedCalls.pop()
+		#assemblies are only placements of cached cells, so there is nothing to gain from storing them
+		if outermost and hasattr(result, "vals"):
+			diskCache.store(key, result)
+		return result
+	return wrapper
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description="Manage the on-disk part cache")
+	parser.add_argument("--invalidate", action="store_true", help="delete every cached part")
+	args = parser.parse_args()
+	if args.invalidate:
+		diskCache.invalidate()
+	print(json.dumps(diskCache.info(), indent=1))
@@ -0,0 +1,429 @@
+from fractions import Fraction
+from math import floor
+import numpy as np
+
+from standards import *
+
+def exactFraction(value, maxDenominator = 10000):
+	"""
+	Convert a number to the simplest fraction it stands for, so 0.66 is 33/50 and 2/3 typed as a float is 2/3 again
+
+	:param value: An int, float or Fraction
+	:param maxDenominator: Largest denominator considered
+
+	:return: A Fraction
+	"""
+	return Fraction(value).limit_denominator(maxDenominator)
+
+class RationalArray:
+	"""
+	An array of exact fractions, held as int64 numerators and denominators so a whole catalog is evaluated with numpy at once
+	"""
+	def __init__(self, numerator, denominator = 1):
+		numerator	= np.asarray(numerator, dtype=np.int64)
+		denominator	= np.asarray(denominator, dtype=np.int64)
+		numerator, denominator = np.broadcast_arrays(numerator*np.sign(denominator), np.abs(denominator))
+		divisor = np.gcd(numerator, denominator)
+		divisor = np.where(divisor == 0, 1, divisor)
+		self.numerator		= numerator//divisor
+		self.denominator	= denominator//divisor
+
+	@classmethod
+	def fromValues(cls, values):
+		"""
+		:param values: Iterable of numbers, converted with exactFraction()
+		"""
+		#catalogs repeat a handful of values, so only convert each distinct one
+		distinct, positions = np.unique(np.asarray(values, dtype=float), return_inverse=True)
+		fractions = [exactFraction(value) for value in distinct]
+		numerators		= np.array([value.numerator for value in fractions], dtype=np.int64)
+		denominators	= np.array([value.denominator for value in fractions], dtype=np.int64)
+		return cls(numerators[positions], denominators[positions])
+
+	@staticmethod
+	def coerce(value):
+		if isinstance(value, RationalArray):
+			return value
+		value = exactFraction(value)
+		return RationalArray(value.numerator, value.denominator)
+
+	def __add__(self, other):
+		other = RationalArray.coerce(other)
+		return RationalArray(self.numerator*other.denominator + other.numerator*self.denominator, self.denominator*other.denominator)
+
+	__radd__ = __add__
+
+	def __neg__(self):
+		return RationalArray(-self.numerator, self.denominator)
+
+	def __sub__(self, other):
+		return self + -RationalArray.coerce(other)
+
+	def __rsub__(self, other):
+		return RationalArray.coerce(other) - self
+
+	def __mul__(self, other):
+		other = RationalArray.coerce(other)
+		return RationalArray(self.numerator*other.numerator, self.denominator*other.denominator)
+
+	__rmul__ = __mul__
+
+	def __truediv__(self, other):
+		other = RationalArray.coerce(other)
+		return RationalArray(self.numerator*other.denominator, self.denominator*other.numerator)
+
+	def __rtruediv__(self, other):
+		return RationalArray.coerce(other)/self
+
+	def compare(self, other):
+		"""
+		:return: An int64 array of -1, 0 or 1 as each entry is below, equal to or above other
+		"""
+		other = RationalArray.coerce(other)
+		return np.sign(self.numerator*other.denominator - other.numerator*self.denominator)
+
+	def __lt__(self, other):
+		return self.compare(other) < 0
+
+	def __le__(self, other):
+		return self.compare(other) <= 0
+
+	def __gt__(self, other):
+		return self.compare(other) > 0
+
+	def __ge__(self, other):
+		return self.compare(other) >= 0
+
+	def floor(self):
+		"""
+		:return: An int64 array of each entry rounded down
+		"""
+		return self.numerator//np.maximum(self.denominator, 1)
+
+	def round(self):
+		"""
+		:return: An int64 array of each entry rounded to the nearest int, halves to even like round()
+		"""
+		down = self.floor()
+		twiceRemainder = 2*(self.numerator - down*self.denominator)
+		up = (twiceRemainder > self.denominator) | ((twiceRemainder == self.denominator) & (down%2 == 1))
+		return down + up
+
+	def __mod__(self, other):
+		other = RationalArray.coerce(other)
+		return self - other*RationalArray((self/other).floor())
+
+	def where(self, condition, other):
+		"""
+		:return: A RationalArray taking self where condition is set, and other elsewhere
+		"""
+		other = RationalArray.coerce(other)
+		return RationalArray(
+			np.where(condition, self.numerator*other.denominator, other.numerator*self.denominator),
+			self.denominator*other.denominator,
+		)
+
+	def toFloat(self):
+		"""
+		:return: A float64 array of the values
+		"""
+		return self.numerator/self.denominator
+
+#standards as exact fractions
+printableThreshold	= exactFraction(wallThickness)*4
+maxDivisions		= floor(exactFraction(gridUnit)/(printableThreshold+exactFraction(insideTop)*2))
+#narrowest compartment binCutter() can fillet - the top chamfer and fillets meet in the middle
+minCompartmentWidth	= (exactFraction(outsideTop)-exactFraction(wallThickness)+exactFraction(outsideFillet))*2
+#shortest compartment binCutter() can fillet
+minCompartmentHeight= exactFraction(outsideFillet)
+
+def autoDivisions(size, axis = "X"):
+	"""
+	Calculate bottom divisions from the fractional part of bin sizes, as resolveBottomDivisions() does for None
+
+	X accepts multiples which are nearly whole to one decimal place, so 0.66 is treated as 2/3.
+	Y needs a whole multiple to two decimal places.
+
+	:param size: RationalArray of bin sizes, in gridfinity units
+	:param axis: "X" or "Y"
+
+	:return: RationalArray of divisions per gridfinity unit
+	"""
+	fraction = size % 1
+	whole = fraction.numerator == 0
+	#avoid dividing by zero for whole sizes, they are replaced with 1 at the end
+	safeFraction = fraction.where(~whole, 1)
+	divisions = 1/safeFraction
+	found = np.zeros(fraction.numerator.shape, dtype=bool)
+	for i in range(1, maxDivisions+1):
+		if (axis == "X"):
+			tenths = (safeFraction*i*10).round()
+			accept = (tenths%10 == 0) & ~found
+			divisions = (1/safeFraction*RationalArray(tenths, 10)).where(accept, divisions)
+		else:
+			remainder = safeFraction % Fraction(1, i)
+			accept = (remainder*200 <= 1) & ~found
+			divisions = RationalArray(np.full(accept.shape, i)).where(accept, divisions)
+		found |= accept
+	return RationalArray(np.ones(whole.shape, dtype=np.int64)).where(whole, divisions)
+
+def interlockWidths(divisions):
+	"""
+	:param divisions: RationalArray of bottom divisions per gridfinity unit
+
+	:return: RationalArray of the width of the interlock's vertical section, in mm
+	"""
+	return gridUnit/divisions - exactFraction(insideTop)*2
+
+def resolveDivisions(size, requested, axis = "X"):
+	"""
+	Check requested bottom divisions are printable, and calculate any left as None
+
+	:param size: RationalArray of bin sizes, in gridfinity units
+	:param requested: List of divisions per gridfinity unit, None to calculate from size
+	:param axis: "X" or "Y", see autoDivisions()
+
+	:return: A tuple of (RationalArray of divisions, RationalArray of interlock widths,
+	bool array of requested divisions which are too big to print, bool array of sizes too close to whole to divide)
+	"""
+	given = np.array([value is not None for value in requested])
+	requested = RationalArray.fromValues([1 if value is None else value for value in requested])
+	#only requested divisions are checked for printability
+	requested = requested.where(requested > 0, 1)
+	widths = interlockWidths(requested)
+	tooBig = given & (widths < printableThreshold)
+	divisions = requested.where(given, autoDivisions(size, axis))
+	#X accepts a multiple which rounds to zero, eg. 1.05
+	indivisible = divisions <= 0
+	return (divisions.where(~indivisible, 1), widths, tooBig, indivisible)
+
+def outerSize(binX, binY, binZ):
+	"""
+	:param binX: RationalArray of X dimensions, in gridfinity units
+	:param binY: RationalArray of Y dimensions, in gridfinity units
+	:param binZ: RationalArray of Z dimensions, in height units
+
+	:return: A tuple of RationalArrays of the width, depth and body height of each bin, in mm
+	"""
+	return (
+		binX*gridUnit - exactFraction(tolerance)*2,
+		binY*gridUnit - exactFraction(tolerance)*2,
+		binZ*heightUnit,
+	)
+
+def compartmentSpace(binX, binY, binZ, divX, divY, addX, addY):
+	"""
+	Calculate the space left for the compartments of each bin, once the walls are taken out
+
+	:param binX: RationalArray of X dimensions, in gridfinity units
+	:param binY: RationalArray of Y dimensions, in gridfinity units
+	:param binZ: RationalArray of Z dimensions, in height units
+	:param divX: RationalArray of compartments in X
+	:param divY: RationalArray of compartments in Y
+	:param addX: RationalArray of extra wall thickness taken from the X side, eg. for a clear window
+	:param addY: RationalArray of extra wall thickness taken from the Y side
+
+	:return: A tuple of RationalArrays of the width, depth and height available, in mm
+	"""
+	width, depth, binHeight = outerSize(binX, binY, binZ)
+	wall = exactFraction(wallThickness)
+	return (
+		width - wall*2 - wall*(divX-1) - addX,
+		depth - wall*2 - wall*(divY-1) - addY,
+		binHeight - exactFraction(insideDepth) - wall,
+	)
+
+def windowSpace(binX, binY, binZ, sideX, sideY, clearWidth, clearHeight):
+	"""
+	Calculate the size of each clear window, filling in any given as 0
+
+	:param binX: RationalArray of X dimensions, in gridfinity units
+	:param binY: RationalArray of Y dimensions, in gridfinity units
+	:param binZ: RationalArray of Z dimensions, in height units
+	:param sideX: Bool array of windows in the X side
+	:param sideY: Bool array of windows in the Y side, which win over X
+	:param clearWidth: RationalArray of requested widths, 0 for the widest which fits
+	:param clearHeight: RationalArray of requested heights, 0 for the tallest which fits
+
+	:return: A tuple of RationalArrays of the window width and height, in mm
+	"""
+	width, depth, binHeight = outerSize(binX, binY, binZ)
+	wall = exactFraction(wallThickness)
+	fillet = exactFraction(extFilletRadius)
+	autoWidth = (width - wall*2 - fillet*2).where(sideX, 0)
+	autoWidth = (depth - wall*2 - fillet*2).where(sideY, autoWidth)
+	autoHeight = binHeight - exactFraction(insideDepth) - wall + exactFraction(tolerance)*2
+	return (
+		clearWidth.where(clearWidth.numerator != 0, autoWidth),
+		clearHeight.where(clearHeight.numerator != 0, autoHeight),
+	)
+
+def compartmentSize(
+		binX: float	= 1,
+		binY: float	= 1,
+		binZ: float	= 6,
+		divX: float	= 1,
+		divY: float	= 1,
+		addX: float	= 0,
+		addY: float	= 0,
+		):
+	"""
+	Size the compartments of a single bin, with the arithmetic evaluateCatalog() checks
+
+	:return: A tuple of (width available, depth available, height available, width of each compartment, depth of each compartment), in mm
+	"""
+	binX, binY, binZ, divX, divY, addX, addY = (RationalArray.fromValues([value]) for value in (binX, binY, binZ, divX, divY, addX, addY))
+	widthAvail, depthAvail, heightAvail = compartmentSpace(binX, binY, binZ, divX, divY, addX, addY)
+	sizes = (widthAvail, depthAvail, heightAvail, widthAvail/divX, depthAvail/divY)
+	return tuple(float(size.toFloat()[0]) for size in sizes)
+
+def windowSize(
+		binX: float	= 1,
+		binY: float	= 1,
+		binZ: float	= 6,
+		clearSide	= "X",
+		clearWidth	= 0,
+		clearHeight	= 0,
+		):
+	"""
+	Size the clear window of a single bin, with the arithmetic evaluateCatalog() checks
+
+	:return: A tuple of (window width, window height), in mm
+	"""
+	binX, binY, binZ, clearWidth, clearHeight = (RationalArray.fromValues([value]) for value in (binX, binY, binZ, clearWidth, clearHeight))
+	sizes = windowSpace(binX, binY, binZ, np.array(["X" in clearSide]), np.array(["Y" in clearSide]), clearWidth, clearHeight)
+	return tuple(float(size.toFloat()[0]) for size in sizes)
+
+#defaults for columns left out of a catalog, matching BinSpec
+catalogDefaults = {
+	"generator":	"binCompartments",
+	"binX":			1,
+	"binY":			1,
+	"binZ":			6,
+	"divX":			1,
+	"divY":			1,
+	"topStyle":		TopStyle.STACKING,
+	"bottomStyle":	BottomStyle.MAGNET_ONLY,
+	"bottomDivX":	1,
+	"bottomDivY":	1,
+	"clearSide":	"X",
+	"clearDepth":	1,
+	"clearWidth":	0,
+	"clearHeight":	0,
+}
+
+def catalogColumns(catalog):
+	"""
+	Gather a catalog into one list per argument
+
+	:param catalog: List of BinSpec, or dicts with the generator name under "generator" and its keyword arguments
+
+	:return: A dict of lists, with defaults filled in
+	"""
+	columns = {name: [] for name in catalogDefaults}
+	for entry in catalog:
+		if not isinstance(entry, dict):
+			entry = {name: getattr(entry, name) for name in catalogDefaults}
+		for name, default in catalogDefaults.items():
+			columns[name].append(entry.get(name, default))
+	return columns
+
+def evaluateCatalog(catalog):
+	"""
+	Calculate the dimensions of a catalog of bins and check every bin can be built, without any geometry
+
+	Sizes are worked out with exact fractions, so thresholds are compared exactly rather than through float rounding.
+
+	:param catalog: List of BinSpec, or dicts with the generator name under "generator" and its keyword arguments
+
+	:return: A dict of float arrays (width, depth, height, compartmentWidth, compartmentDepth, compartmentHeight,
+	windowWidth, windowHeight, bottomDivX, bottomDivY), a bool array "valid", and "errors" - a list of error messages per bin
+	"""
+	columns = catalogColumns(catalog)
+	count = len(columns["binX"])
+	errors = [[] for _ in range(count)]
+
+	def report(mask, message, *values):
+		for index in np.nonzero(mask)[0]:
+			errors[index].append(message.format(*(value[index] for value in values)))
+
+	generator = np.array(columns["generator"], dtype=object)
+	isBin = np.isin(generator, ("binSolid", "binCompartments", "binClearWindow"))
+	report(~isBin, "{} is not a bin generator", generator)
+	hasCompartments = generator != "binSolid"
+	hasWindow = generator == "binClearWindow"
+
+	binX = RationalArray.fromValues(columns["binX"])
+	binY = RationalArray.fromValues(columns["binY"])
+	binZ = RationalArray.fromValues(columns["binZ"])
+	divX = RationalArray.fromValues(columns["divX"])
+	divY = RationalArray.fromValues(columns["divY"])
+	for name, value in (("binX", binX), ("binY", binY), ("binZ", binZ)):
+		report(value <= 0, name+" cannot be less than 0")
+	for name, value in (("divX", divX), ("divY", divY)):
+		report(hasCompartments & (value < 1), name+" cannot be less than 1")
+	#keep later divisions by zero out of the way of bins which are already rejected
+	binX = binX.where(binX > 0, 1)
+	binY = binY.where(binY > 0, 1)
+	binZ = binZ.where(binZ > 0, 1)
+	divX = divX.where(divX >= 1, 1)
+	divY = divY.where(divY >= 1, 1)
+
+	#bottom divisions - also used by resolveBottomDivisions() to build the bin
+	hasBottom = np.array([style is not BottomStyle.NONE for style in columns["bottomStyle"]])
+	bottomDivisions = {}
+	for axis, size in (("X", binX), ("Y", binY)):
+		name = "bottomDiv"+axis
+		report(np.array([value is not None and value <= 0 for value in columns[name]]), name+" cannot be less than 0")
+		divisions, widths, tooBig, indivisible = resolveDivisions(size, columns[name], axis)
+		report(hasBottom & tooBig, name+" of {:.2f} is too big - would result in hard to print features of {:.2f}mm", divisions.toFloat(), widths.toFloat())
+		report(hasBottom & indivisible, "bin"+axis+" of {:.2f} is too close to a whole number to divide the bottom", size.toFloat())
+		bottomDivisions[name] = divisions.where(hasBottom, 1)
+
+	#outer size - same arithmetic as binSolid()
+	width, depth, binHeight = outerSize(binX, binY, binZ)
+	topOffset = {
+		TopStyle.STACKING:		exactFraction(outsideTop)/2,
+		TopStyle.NONE_LOW:		exactFraction(outsideDepth),
+		TopStyle.INT_DIV:		exactFraction(outsideTop)/2+exactFraction(tolerance),
+		TopStyle.INT_DIV_MAG:	exactFraction(outsideTop)/2+exactFraction(tolerance),
+	}
+	offset = RationalArray.fromValues([topOffset.get(style, 0) for style in columns["topStyle"]])
+	height = binHeight - offset + RationalArray(np.where(hasBottom, 1, 0))*exactFraction(insideDepth)
+
+	#compartments - compartmentCutters() sizes them through compartmentSize()
+	clearDepth = RationalArray.fromValues(columns["clearDepth"])
+	report(hasWindow & (clearDepth < 0), "binClearWindow only accepts clearDepth >= 0")
+	sideX = hasWindow & np.array(["X" in side for side in columns["clearSide"]])
+	sideY = hasWindow & np.array(["Y" in side for side in columns["clearSide"]])
+	addX = clearDepth.where(sideY, 0)
+	addY = clearDepth.where(sideX, 0)
+	widthAvail, depthAvail, compartmentHeight = compartmentSpace(binX, binY, binZ, divX, divY, addX, addY)
+	compartmentWidth	= widthAvail/divX
+	compartmentDepth	= depthAvail/divY
+	for name, value in (("compartmentWidth", compartmentWidth), ("compartmentDepth", compartmentDepth)):
+		report(hasCompartments & (value <= minCompartmentWidth), name+" of {:.2f}mm is too small - compartments must be over "+"{:.2f}mm".format(float(minCompartmentWidth)), value.toFloat())
+	report(hasCompartments & (compartmentHeight <= minCompartmentHeight), "binZ of {} is too low - compartments would only be {:.2f}mm deep", binZ.toFloat(), compartmentHeight.toFloat())
+
+	#window - binClearWindow() sizes it through windowSize()
+	clearWidth	= RationalArray.fromValues(columns["clearWidth"])
+	clearHeight	= RationalArray.fromValues(columns["clearHeight"])
+	windowWidth, windowHeight = windowSpace(binX, binY, binZ, sideX, sideY, clearWidth, clearHeight)
+
+	noCompartments = np.where(hasCompartments, 1.0, np.nan)
+	noWindow = np.where(hasWindow, 1.0, np.nan)
+	return {
+		"width":				width.toFloat(),
+		"depth":				depth.toFloat(),
+		"height":				height.toFloat(),
+		"compartmentWidth":		compartmentWidth.toFloat()*noCompartments,
+		"compartmentDepth":		compartmentDepth.toFloat()*noCompartments,
+		"compartmentHeight":	compartmentHeight.toFloat()*noCompartments,
+		"windowWidth":			windowWidth.toFloat()*noWindow,
+		"windowHeight":			windowHeight.toFloat()*noWindow,
+		"windowDepth":			clearDepth.toFloat()*noWindow,
+		"bottomDivX":			bottomDivisions["bottomDivX"].toFloat(),
+		"bottomDivY":			bottomDivisions["bottomDivY"].toFloat(),
+		"valid":				np.array([not messages for messages in errors], dtype=bool),
+		"errors":				errors,
+	}
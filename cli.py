@@ -0,0 +1,162 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+#only light modules here - cadquery is imported by the generators when a part is built
+from standards import *
+from specs import makeSpec, BinSpec
+from calculator import evaluateCatalog
+
+def enumArgument(enum):
+	"""
+	:return: An argparse type converting a member name, eg. "MAGNET_ONLY", to the member of enum
+	"""
+	def convert(name):
+		try:
+			return enum[name.upper()]
+		except KeyError:
+			raise argparse.ArgumentTypeError("choose from {}".format(", ".join(enum.__members__)))
+	convert.__name__ = enum.__name__
+	return convert
+
+def divisionArgument(value):
+	"""
+	argparse type for bottom divisions, where "auto" calculates them from the bin size
+	"""
+	if (value.lower() == "auto"):
+		return None
+	return float(value)
+
+def buildParser():
+	"""
+	:return: The argparse parser for the command line
+	"""
+	parser = argparse.ArgumentParser(description="Generate gridfinity bins and baseplates")
+	subparsers = parser.add_subparsers(dest="command", required=True)
+
+	common = argparse.ArgumentParser(add_help=False)
+	common.add_argument("--output", "-o", help="file to write - .step, .stl or .3mf")
+	common.add_argument("--dry-run", action="store_true", help="validate and report the dimensions without building anything")
+	common.add_argument("--no-cache", action="store_true", help="always build, without reading or writing the part cache")
+	common.add_argument("--preview", action="store_true", help="build at Fidelity.PREVIEW")
+	common.add_argument("--tolerance", type=float, default=0.1, help="linear deflection for meshed output, in mm")
+	common.add_argument("--angular-tolerance", type=float, default=0.1, help="angular deflection for meshed output, in radians")
+
+	bin = subparsers.add_parser("bin", parents=[common], help="a bin, from binSolid(), binCompartments() or binClearWindow()")
+	bin.add_argument("binX", type=float, help="X dimension, in gridfinity units")
+	bin.add_argument("binY", type=float, help="Y dimension, in gridfinity units")
+	bin.add_argument("binZ", type=float, help="Z dimension, in height units")
+	bin.add_argument("--div", type=int, nargs=2, default=(1, 1), metavar=("X", "Y"), help="number of compartments")
+	bin.add_argument("--scoop", type=float, default=0, help="scoop size, 0 for none")
+	bin.add_argument("--tab", type=enumArgument(TabStyle), default=TabStyle.FULL, help="TabStyle")
+	bin.add_argument("--tab-angle", type=float, default=60, help="tab angle, in degrees")
+	bin.add_argument("--top", type=enumArgument(TopStyle), default=TopStyle.STACKING, help="TopStyle")
+	bin.add_argument("--bottom", type=enumArgument(BottomStyle), default=BottomStyle.MAGNET_ONLY, help="BottomStyle")
+	bin.add_argument("--bottom-div", type=divisionArgument, nargs=2, default=(1, 1), metavar=("X", "Y"), help="bottom divisions per gridfinity unit, or auto")
+	bin.add_argument("--solid", action="store_true", help="build a solid bin, without compartments")
+	bin.add_argument("--window", choices=("X", "Y"), help="add a clear window on this side")
+	bin.add_argument("--window-depth", type=float, default=1, help="depth of the clear window, in mm")
+
+	plate = subparsers.add_parser("baseplate", parents=[common], help="a baseplate, from baseplate()")
+	plate.add_argument("plateX", type=float, help="X dimension, in gridfinity units")
+	plate.add_argument("plateY", type=float, help="Y dimension, in gridfinity units")
+	plate.add_argument("--height", type=float, help="Z height in mm, calculated for the style if left out")
+	plate.add_argument("--style", type=enumArgument(PlateStyle), default=PlateStyle.MAGNET_ONLY, help="PlateStyle")
+	plate.add_argument("--round-top", action="store_true", help="round the top edges")
+	return parser
+
+def specFromArguments(args):
+	"""
+	:return: The spec described by parsed command line arguments
+	"""
+	if (args.command == "baseplate"):
+		return makeSpec(
+			"baseplate",
+			plateX		= args.plateX,
+			plateY		= args.plateY,
+			plateZ		= args.height,
+			plateStyle	= args.style,
+			roundTop	= args.round_top,
+		)
+	generator = "binCompartments"
+	if args.solid:
+		generator = "binSolid"
+	if args.window:
+		generator = "binClearWindow"
+	return makeSpec(
+		generator,
+		binX		= args.binX,
+		binY		= args.binY,
+		binZ		= args.binZ,
+		divX		= args.div[0],
+		divY		= args.div[1],
+		scoop		= args.scoop,
+		tabStyle	= args.tab,
+		tabAngle	= args.tab_angle,
+		topStyle	= args.top,
+		bottomStyle	= args.bottom,
+		bottomDivX	= args.bottom_div[0],
+		bottomDivY	= args.bottom_div[1],
+		clearSide	= args.window or "X",
+		clearDepth	= args.window_depth,
+	)
+
+def main(argv = None):
+	"""
+	Run the command line
+
+	:param argv: Arguments, defaulting to sys.argv
+
+	:return: The report printed as JSON
+	"""
+	parser = buildParser()
+	args = parser.parse_args(argv)
+	if not args.dry_run and not args.output:
+		parser.error("--output is required unless --dry-run is given")
+	exportType = None
+	if args.output:
+		exportType = os.path.splitext(args.output)[1][1:].upper()
+		if exportType not in ("STEP", "STL", "3MF"):
+			parser.error("--output must end in .step, .stl or .3mf")
+	try:
+		spec = specFromArguments(args)
+	except Exception as e:
+		parser.error(str(e))
+	#reject bins OCCT would fail on, or build with nonsense sizes, before doing any work
+	if isinstance(spec, BinSpec):
+		checked = evaluateCatalog([spec])
+		if not checked["valid"][0]:
+			parser.error("; ".join(checked["errors"][0]))
+	report = {
+		"generator":	spec.generator,
+		"dimensions":	spec.dimensions(),
+	}
+	if args.dry_run:
+		return report
+
+	from cache import diskCache
+	from config import config
+	if args.no_cache:
+		diskCache.enabled = False
+	if args.preview:
+		config.fidelity = Fidelity.PREVIEW
+	start = time.perf_counter()
+	#keep stdout for the report
+	with contextlib.redirect_stdout(sys.stderr):
+		part = spec.build()
+	report["buildSeconds"] = time.perf_counter()-start
+	if (exportType == "STEP"):
+		import cadquery as cq
+		cq.exporters.export(part, args.output, "STEP")
+	else:
+		from export import exportMesh
+		exported = exportMesh(part, args.output, exportType, args.tolerance, args.angular_tolerance)
+		report.update(triangles=exported.triangles, exportSeconds=exported.seconds)
+	report["output"] = args.output
+	return report
+
+if __name__ == "__main__":
+	print(json.dumps(main(), indent=1))
@@ -0,0 +1,121 @@
+from contextlib import contextmanager
+import inspect
+
+from standards import *
+
+class Config:
+	"""
+	Project wide settings which every generator respects
+	"""
+	def __init__(self):
+		#Fidelity.PREVIEW skips fillets, chamfers, tabs, scoops and magnet holes, keeping the outer dimensions
+		self.fidelity	= Fidelity.FULL
+		#run each OCCT boolean across every core
+		self.parallel	= True
+		#extra tolerance in mm for booleans to treat nearly touching faces as touching, 0 for exact booleans
+		self.fuzzyValue	= 0
+		#gluing for tileFuse(), whose tiles only ever touch on coincident faces - Glue.(OFF|SHIFT|FULL)
+		self.glue		= Glue.OFF
+
+	@property
+	def preview(self):
+		"""
+		:return: Whether parts are being built at Fidelity.PREVIEW
+		"""
+		return self.fidelity is Fidelity.PREVIEW
+
+	def key(self):
+		"""
+		:return: A tuple of every setting which changes the generated geometry, for cache keys
+		"""
+		return (
+			("fidelity", self.fidelity.name),
+			("fuzzyValue", float(self.fuzzyValue)),
+			("glue", self.glue.name),
+		)
+
+	def settings(self):
+		"""
+		:return: A dict of every setting, which useConfig() accepts - eg. to pass to worker processes
+		"""
+		return dict(vars(self))
+
+	def configureBoolean(self, operation, tiled = False):
+		"""
+		Apply the boolean settings to an OCCT boolean before it is built
+
+		:param operation: The BRepAlgoAPI operation
+		:param tiled: Whether the arguments only touch on coincident faces, so glue can be used
+		"""
+		from OCP.BOPAlgo import BOPAlgo_GlueShift, BOPAlgo_GlueFull
+		operation.SetRunParallel(self.parallel)
+		if self.fuzzyValue:
+			operation.SetFuzzyValue(self.fuzzyValue)
+		if tiled:
+			match self.glue:
+				case Glue.SHIFT:
+					operation.SetGlue(BOPAlgo_GlueShift)
+				case Glue.FULL:
+					operation.SetGlue(BOPAlgo_GlueFull)
+
+config = Config()
+
+@contextmanager
+def useConfig(**settings):
+	"""
+	Change settings inside the with block, eg. useConfig(glue=Glue.SHIFT)
+
+	:param settings: Attributes of config to set
+	"""
+	previous = config.settings()
+	for name, value in settings.items():
+		if name not in previous:
+			raise ValueError("Unknown setting {!r}".format(name))
+		setattr(config, name, value)
+	try:
+		yield config
+	finally:
+		for name in settings:
+			setattr(config, name, previous[name])
+
+@contextmanager
+def useFidelity(fidelity):
+	"""
+	Build parts at a different fidelity inside the with block
+
+	:param fidelity: Fidelity.(PREVIEW|FULL)
+	"""
+	with useConfig(fidelity=fidelity):
+		yield config
+
+#cadquery's own boolean, while booleanOptions() has replaced it
+replacedBooleans = []
+
+@contextmanager
+def booleanOptions():
+	"""
+	Apply config to every cadquery fuse, cut and intersect inside the with block, by wrapping cq.Shape._bool_op.
+	The original is put back when the block ends, so code outside the generators sees plain cadquery. Nested blocks share the outermost wrapper.
+	"""
+	import cadquery as cq
+	if replacedBooleans:
+		yield
+		return
+	original = cq.Shape._bool_op
+	replacedBooleans.append(original)
+
+	#cadquery only takes parallel from 2.4 - before that configureBoolean() is all that sets it
+	takesParallel = "parallel" in inspect.signature(original).parameters
+
+	def configured(shape, args, tools, operation, parallel=True):
+		#keeps any glue set by tileFuse()
+		config.configureBoolean(operation)
+		if takesParallel:
+			return original(shape, args, tools, operation, parallel and config.parallel)
+		return original(shape, args, tools, operation)
+	cq.Shape._bool_op = configured
+	try:
+		yield
+	finally:
+		cq.Shape._bool_op = original
+		replacedBooleans.clear()
@@ -0,0 +1,491 @@
+from collections import namedtuple
+from xml.sax.saxutils import quoteattr
+import os
+import time
+import zipfile
+
+#triangles is None for formats which are not meshed, eg. STEP
+ExportReport = namedtuple("ExportReport", ["fileName", "triangles", "seconds"])
+
+#3MF package boilerplate
+contentTypes3MF = (
+	'<?xml version="1.0" encoding="UTF-8"?>\n'
+	'<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+	'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+	'<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>'
+	'</Types>'
+)
+relationships3MF = (
+	'<?xml version="1.0" encoding="UTF-8"?>\n'
+	'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+	'<Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>'
+	'</Relationships>'
+)
+modelHeader3MF = (
+	'<?xml version="1.0" encoding="UTF-8"?>\n'
+	'<model unit="millimeter" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">\n'
+)
+
+def exportShape(part):
+	"""
+	:return: The cq.Shape to export from a cq.Workplane or cq.Shape
+	"""
+	from cache import workplaneShape
+	if hasattr(part, "vals"):
+		return workplaneShape(part)
+	return part
+
+def meshShape(
+		shape,
+		tolerance			= 0.1,
+		angularTolerance	= 0.1,
+		parallel			= True,
+		):
+	"""
+	Triangulate every face of a shape, storing the triangulation on the faces.
+	Any earlier triangulation is dropped first - OCCT would otherwise keep a finer one.
+
+	:param shape: The cq.Shape to mesh
+	:param tolerance: Linear deflection, in mm
+	:param angularTolerance: Angular deflection, in radians
+	:param parallel: Mesh faces in parallel across every core
+	"""
+	from OCP.BRepMesh import BRepMesh_IncrementalMesh
+	from OCP.BRepTools import BRepTools
+	BRepTools.Clean_s(shape.wrapped)
+	BRepMesh_IncrementalMesh(shape.wrapped, tolerance, False, angularTolerance, parallel)
+
+def faceMeshes(shape):
+	"""
+	Read back the triangulation stored by meshShape(), one face at a time so the whole mesh is never held in memory
+
+	:param shape: The meshed cq.Shape
+
+	:return: A generator of (nodes, triangles, edges) per face - nodes as (x, y, z) tuples, triangles as 0 based node indexes wound outwards,
+	and edges as a list of FaceEdge for the edges BRepMesh discretized
+	"""
+	import cadquery as cq
+	from OCP.BRep import BRep_Tool
+	from OCP.TopAbs import TopAbs_EDGE, TopAbs_REVERSED
+	from OCP.TopExp import TopExp, TopExp_Explorer
+	from OCP.TopLoc import TopLoc_Location
+	from OCP.TopoDS import TopoDS
+	for face in shape.Faces():
+		location = TopLoc_Location()
+		triangulation = BRep_Tool.Triangulation_s(face.wrapped, location)
+		if triangulation is None:
+			continue
+		transform = location.Transformation()
+		nodes = [
+			triangulation.Node(index).Transformed(transform).Coord()
+			for index in range(1, triangulation.NbNodes()+1)
+		]
+		reversed = face.wrapped.Orientation() == TopAbs_REVERSED
+		triangles = []
+		for index in range(1, triangulation.NbTriangles()+1):
+			a, b, c = triangulation.Triangle(index).Get()
+			triangles.append((a-1, c-1, b-1) if reversed else (a-1, b-1, c-1))
+		#explored rather than face.Edges(), so both sides of a seam are found
+		edges = []
+		explorer = TopExp_Explorer(face.wrapped, TopAbs_EDGE)
+		while explorer.More():
+			edge = TopoDS.Edge_s(explorer.Current())
+			explorer.Next()
+			polygon = BRep_Tool.PolygonOnTriangulation_s(edge, triangulation, location)
+			if polygon is None:
+				continue
+			edges.append(FaceEdge(
+				cq.Edge(edge),
+				[polygon.Node(index)-1 for index in range(1, polygon.NbNodes()+1)],
+				(cq.Vertex(TopExp.FirstVertex_s(edge)), cq.Vertex(TopExp.LastVertex_s(edge))),
+				BRep_Tool.Degenerated_s(edge),
+			))
+		yield (nodes, triangles, edges)
+
+#the discretization of one edge on one face - nodes are indexes into the face's nodes, in order along the edge
+FaceEdge = namedtuple("FaceEdge", ["edge", "nodes", "vertices", "degenerated"])
+
+class MeshWelder:
+	"""
+	Numbers the nodes of a meshed shape so faces meeting on an edge share its nodes.
+	BRepMesh discretizes each edge once, and every face on the edge holds a copy of the same nodes, so only the numbers
+	given to edge and vertex nodes are kept - the nodes inside a face are numbered as they are read.
+
+	Read the faces twice, in the same order: the first pass numbers every node, the second after rewind() repeats the numbering.
+	"""
+	def __init__(self):
+		self.edges		= {}
+		self.vertices	= {}
+		self.faceStarts	= []
+		self.face		= 0
+		self.count		= 0
+
+	def rewind(self):
+		"""
+		Start again from the first face, repeating the numbers given on the first pass
+		"""
+		self.face = 0
+
+	def newIndex(self, node, added):
+		index = self.count
+		self.count += 1
+		added.append(node)
+		return index
+
+	def vertexIndex(self, vertex, node, added):
+		if vertex not in self.vertices:
+			self.vertices[vertex] = self.newIndex(node, added)
+		return self.vertices[vertex]
+
+	def number(self, nodes, edges):
+		"""
+		:param nodes: Nodes of the face, from faceMeshes()
+		:param edges: Edges of the face, from faceMeshes()
+
+		:return: A tuple of (index of each node, positions in nodes of the nodes numbered for the first time, in number order)
+		"""
+		indexes = [None]*len(nodes)
+		added = []
+		for faceEdge in edges:
+			numbers, second = self.edges.get(faceEdge.edge, (None, None))
+			if numbers is not None:
+				#the polygon may run the other way along the edge on this face, found by where its second node lies
+				if (distance(nodes[faceEdge.nodes[-2]], second) < distance(nodes[faceEdge.nodes[1]], second)):
+					numbers = numbers[::-1]
+			else:
+				first, last = faceEdge.nodes[0], faceEdge.nodes[-1]
+				startVertex, endVertex = faceEdge.vertices
+				#match the vertices to the ends of the polygon by position, rather than trusting the edge's orientation
+				if (startVertex.toTuple() != endVertex.toTuple() and distance(startVertex.toTuple(), nodes[first]) > distance(startVertex.toTuple(), nodes[last])):
+					startVertex, endVertex = endVertex, startVertex
+				start = self.vertexIndex(startVertex, first, added)
+				if faceEdge.degenerated:
+					#every node of a degenerated edge sits on its vertex
+					numbers = [start]*len(faceEdge.nodes)
+				else:
+					numbers = [start] + [self.newIndex(node, added) for node in faceEdge.nodes[1:-1]] + [self.vertexIndex(endVertex, last, added)]
+				self.edges[faceEdge.edge] = (numbers, nodes[faceEdge.nodes[1]])
+			for node, number in zip(faceEdge.nodes, numbers):
+				indexes[node] = number
+		inner = [node for node, number in enumerate(indexes) if number is None]
+		if (self.face == len(self.faceStarts)):
+			#first pass - the nodes inside the face follow on from every number given so far
+			self.faceStarts.append(self.count)
+			self.count += len(inner)
+			added += inner
+		for number, node in enumerate(inner, self.faceStarts[self.face]):
+			indexes[node] = number
+		self.face += 1
+		return (indexes, added)
+
+def distance(a, b):
+	"""
+	:return: Distance between two (x, y, z) points
+	"""
+	return sum((i-j)**2 for i, j in zip(a, b))**0.5
+
+def triangleCount(shape):
+	"""
+	:return: Number of triangles in the triangulation stored by meshShape()
+	"""
+	from OCP.BRep import BRep_Tool
+	from OCP.TopLoc import TopLoc_Location
+	count = 0
+	for face in shape.Faces():
+		triangulation = BRep_Tool.Triangulation_s(face.wrapped, TopLoc_Location())
+		if triangulation is not None:
+			count += triangulation.NbTriangles()
+	return count
+
+def writeSTL(shape, fileName):
+	"""
+	Stream a meshed shape to a binary STL file. OCCT writes the stored triangulation directly, without meshing again.
+
+	:param shape: The cq.Shape, already meshed by meshShape()
+	:param fileName: File to write
+
+	:return: Number of triangles written
+	"""
+	from OCP.StlAPI import StlAPI_Writer
+	writer = StlAPI_Writer()
+	writer.ASCIIMode = False
+	if not writer.Write(shape.wrapped, fileName):
+		raise IOError("Could not write {}".format(fileName))
+	return triangleCount(shape)
+
+def write3MFObject(shape, model, objectId, name = "part"):
+	"""
+	Stream a meshed shape into a 3MF model as one object.
+	3MF lists every vertex before any triangle, so the faces are read twice rather than holding the mesh.
+	Faces share the nodes along their edges through MeshWelder, as 3MF meshes must be manifold.
+	Triangles left with two corners on one vertex, eg. at the tip of a cone, are dropped.
+
+	:param shape: The cq.Shape, already meshed by meshShape()
+	:param model: Binary stream of the 3D/3dmodel.model part
+	:param objectId: Id for the object
+	:param name: Name for the object
+
+	:return: Number of triangles written
+	"""
+	model.write('<object id="{}" name={} type="model"><mesh><vertices>\n'.format(objectId, quoteattr(name)).encode())
+	welder = MeshWelder()
+	for nodes, _, edges in faceMeshes(shape):
+		_, added = welder.number(nodes, edges)
+		model.write("".join(
+			'<vertex x="{:.6g}" y="{:.6g}" z="{:.6g}"/>\n'.format(*nodes[node])
+			for node in added
+		).encode())
+	model.write(b"</vertices><triangles>\n")
+	welder.rewind()
+	count = 0
+	for nodes, triangles, edges in faceMeshes(shape):
+		indexes, _ = welder.number(nodes, edges)
+		welded = [(indexes[a], indexes[b], indexes[c]) for a, b, c in triangles]
+		welded = [triangle for triangle in welded if len(set(triangle)) == 3]
+		model.write("".join(
+			'<triangle v1="{}" v2="{}" v3="{}"/>\n'.format(*triangle)
+			for triangle in welded
+		).encode())
+		count += len(welded)
+	model.write(b"</triangles></mesh></object>\n")
+	return count
+
+def write3MFPackage(fileName, writeResources):
+	"""
+	Write the 3MF zip around a model, leaving the resources and build items to writeResources
+
+	:param fileName: File to write
+	:param writeResources: Function called with the model stream, which writes <resources> and <build> and returns the triangle count
+
+	:return: Number of triangles written
+	"""
+	with zipfile.ZipFile(fileName, "w", zipfile.ZIP_DEFLATED) as package:
+		package.writestr("[Content_Types].xml", contentTypes3MF)
+		package.writestr("_rels/.rels", relationships3MF)
+		with package.open("3D/3dmodel.model", "w") as model:
+			model.write(modelHeader3MF.encode())
+			count = writeResources(model)
+			model.write(b"</model>\n")
+	return count
+
+def exportMesh(
+		part,
+		fileName,
+		exportType			= None,
+		tolerance			= 0.1,
+		angularTolerance	= 0.1,
+		parallel			= True,
+		):
+	"""
+	Mesh a part in parallel and stream it to a binary STL or 3MF file
+
+	:param part: The cq.Workplane returned by a generator, or a cq.Shape
+	:param fileName: File to write
+	:param exportType: "STL" or "3MF". Defaults to the file extension
+	:param tolerance: Linear deflection, in mm. Larger values give smaller files
+	:param angularTolerance: Angular deflection, in radians. This usually sets the triangle count of magnet holes and fillets
+	:param parallel: Mesh faces in parallel across every core
+
+	:return: An ExportReport
+	"""
+	start = time.perf_counter()
+	if exportType is None:
+		exportType = os.path.splitext(fileName)[1][1:].upper()
+	shape = exportShape(part)
+	meshShape(shape, tolerance, angularTolerance, parallel)
+	match exportType:
+		case "STL":
+			count = writeSTL(shape, fileName)
+		case "3MF":
+			def writeResources(model):
+				model.write(b"<resources>\n")
+				count = write3MFObject(shape, model, 1)
+				model.write(b'</resources>\n<build>\n<item objectid="1"/>\n</build>\n')
+				return count
+			count = write3MFPackage(fileName, writeResources)
+		case _:
+			raise ValueError("Unknown mesh format {!r}".format(exportType))
+	return ExportReport(fileName, count, time.perf_counter()-start)
+
+def assemblyParts(assembly, location = None):
+	"""
+	Walk an assembly, collecting every placed part
+
+	:param assembly: The cq.Assembly to walk
+	:param location: Location of the parent assembly, used while recursing
+
+	:return: A list of (name, part, cq.Location), where the same part object is shared by each of its placements
+	"""
+	import cadquery as cq
+	if location is None:
+		location = cq.Location()
+	location = location*assembly.loc
+	parts = []
+	if assembly.obj is not None:
+		parts.append((assembly.name, assembly.obj, location))
+	for child in assembly.children:
+		parts += assemblyParts(child, location)
+	return parts
+
+def transform3MF(location):
+	"""
+	:return: The 3MF transform attribute for a cq.Location (a 4x3 matrix, row vector convention)
+	"""
+	matrix = location.wrapped.Transformation()
+	values = [
+		matrix.Value(row, column)
+		for column in (1, 2, 3, 4)
+		for row in (1, 2, 3)
+	]
+	return " ".join("{:.6g}".format(value) for value in values)
+
+def exportAssembly(
+		assembly,
+		fileName,
+		exportType			= None,
+		tolerance			= 0.1,
+		angularTolerance	= 0.1,
+		parallel			= True,
+		):
+	"""
+	Export an assembly, keeping parts which are placed several times as shared references
+
+	:param assembly: The cq.Assembly to export, eg. from baseplate(asAssembly=True)
+	:param fileName: File to write
+	:param exportType: "STEP", "3MF", or any other type cq.Assembly.save() accepts. Defaults to the file extension
+	:param tolerance: Linear deflection used to mesh parts for 3MF
+	:param angularTolerance: Angular deflection used to mesh parts for 3MF
+	:param parallel: Mesh faces in parallel across every core
+
+	:return: An ExportReport
+	"""
+	start = time.perf_counter()
+	if exportType is None:
+		exportType = os.path.splitext(fileName)[1][1:].upper()
+	count = None
+	if (exportType == "3MF"):
+		count = exportAssembly3MF(assembly, fileName, tolerance, angularTolerance, parallel)
+	else:
+		assembly.save(fileName, exportType)
+	return ExportReport(fileName, count, time.perf_counter()-start)
+
+def exportAssembly3MF(
+		assembly,
+		fileName,
+		tolerance			= 0.1,
+		angularTolerance	= 0.1,
+		parallel			= True,
+		):
+	"""
+	Write an assembly as 3MF, meshing each distinct part once and placing it with a transform per instance
+
+	:return: Number of triangles written, counting each distinct part once
+	"""
+	def writeResources(model):
+		objectIds	= {}
+		items		= []
+		count		= 0
+		model.write(b"<resources>\n")
+		for name, part, location in assemblyParts(assembly):
+			if id(part) not in objectIds:
+				objectIds[id(part)] = len(objectIds)+1
+				shape = exportShape(part)
+				meshShape(shape, tolerance, angularTolerance, parallel)
+				count += write3MFObject(shape, model, objectIds[id(part)], name)
+			items.append((objectIds[id(part)], location))
+		model.write(b"</resources>\n<build>\n")
+		for objectId, location in items:
+			model.write('<item objectid="{}" transform="{}"/>\n'.format(objectId, transform3MF(location)).encode())
+		model.write(b"</build>\n")
+		return count
+	return write3MFPackage(fileName, writeResources)
+
+def sectionPaths(section, tolerance = 0.01):
+	"""
+	Flatten the outlines of a slice from section() into 2D polylines, in the coordinates of its plane
+
+	:param section: The cq.Workplane returned by section()
+	:param tolerance: Largest distance between a curve and its polyline, in mm
+
+	:return: A list of closed polylines, each a list of (x, y) points
+	"""
+	import cadquery as cq
+	from OCP.BRepAdaptor import BRepAdaptor_Curve
+	from OCP.BRepTools import BRepTools_WireExplorer
+	from OCP.GCPnts import GCPnts_QuasiUniformDeflection
+	from OCP.TopAbs import TopAbs_REVERSED
+	plane = section.plane
+	wires = []
+	for item in section.vals():
+		wires += item.Wires()
+	paths = []
+	for wire in wires:
+		points = []
+		explorer = BRepTools_WireExplorer(wire.wrapped)
+		while explorer.More():
+			edge = explorer.Current()
+			sampled = GCPnts_QuasiUniformDeflection(BRepAdaptor_Curve(edge), tolerance)
+			edgePoints = [sampled.Value(index) for index in range(1, sampled.NbPoints()+1)]
+			if (edge.Orientation() == TopAbs_REVERSED):
+				edgePoints.reverse()
+			#the first point of each edge is the last point of the one before
+			points += [plane.toLocalCoords(cq.Vector(point.XYZ())) for point in edgePoints[1 if points else 0:]]
+			explorer.Next()
+		paths.append([(point.x, point.y) for point in points])
+	return paths
+
+def writeSVG(paths, fileName, strokeWidth = 0.1):
+	"""
+	Write 2D polylines as an SVG drawing, in mm with Y pointing up
+
+	:param paths: List of closed polylines from sectionPaths()
+	:param fileName: File to write
+	:param strokeWidth: Width of the outlines, in mm
+	"""
+	points = [point for path in paths for point in path] or [(0, 0)]
+	xMin = min(x for x, _ in points)-strokeWidth
+	yMin = min(y for _, y in points)-strokeWidth
+	width = max(x for x, _ in points)+strokeWidth-xMin
+	height = max(y for _, y in points)+strokeWidth-yMin
+	with open(fileName, "w") as f:
+		f.write(
+			'<?xml version="1.0" encoding="UTF-8"?>\n'
+			'<svg xmlns="http://www.w3.org/2000/svg" width="{0:.6g}mm" height="{1:.6g}mm" viewBox="0 0 {0:.6g} {1:.6g}">\n'
+			'<g fill="none" stroke="black" stroke-width="{2:.6g}">\n'.format(width, height, strokeWidth)
+		)
+		for path in paths:
+			#flip Y, as SVG counts down from the top
+			f.write('<path d="M {} Z"/>\n'.format(" L ".join(
+				"{:.6g} {:.6g}".format(x-xMin, height-(y-yMin))
+				for x, y in path
+			)))
+		f.write("</g>\n</svg>\n")
+
+def exportSection(
+		section,
+		fileName,
+		exportType	= None,
+		tolerance	= 0.01,
+		):
+	"""
+	Export a slice from section() as a 2D drawing, in the coordinates of its plane
+
+	:param section: The cq.Workplane returned by section()
+	:param fileName: File to write
+	:param exportType: "SVG" or "DXF". Defaults to the file extension
+	:param tolerance: Largest distance between a curve and its outline, in mm
+
+	:return: An ExportReport
+	"""
+	import cadquery as cq
+	start = time.perf_counter()
+	if exportType is None:
+		exportType = os.path.splitext(fileName)[1][1:].upper()
+	match exportType:
+		case "SVG":
+			writeSVG(sectionPaths(section, tolerance), fileName)
+		case "DXF":
+			cq.exporters.export(section, fileName, "DXF", tolerance)
+		case _:
+			raise ValueError("Unknown drawing format {!r}".format(exportType))
+	return ExportReport(fileName, None, time.perf_counter()-start)
@@ -1,8 +1,14 @@
 import cadquery as cq
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from math import sin, cos, tan, asin, acos, atan
 from math import floor, ceil
 
 from standards import *
+from cache import unitCache, standardsKey, diskCached, shapeToBytes, shapeFromBytes
+from config import config, useConfig
+from instrument import stage, staged
+from specs import acceptsSpec, plateHeight
 
 def crossSection(
 		item			= None,
@@ -52,6 +58,46 @@ def crossSection(
 		)
 	return item
 
+def section(
+		item			= None,
+		axis			= "Z",
+		offset: float	= 0,
+		asWires			= False,
+	):
+	"""
+	Slice the supplied object with a plane, without cutting it in 3D.
+	Much cheaper than crossSection() when only the profile is needed.
+
+	:param item: The cq.Workplane or cq.Shape to slice
+	:param axis: Axis the plane is perpendicular to - "X", "Y" or "Z"
+	:param offset: Position of the plane along axis, in mm
+	:param asWires: Return the outlines of the slice instead of its faces
+
+	:return: A cq.Workplane on the section plane, holding the faces (or wires) of the slice
+	"""
+	if (item is None):
+		return None
+	match axis:
+		case "X":
+			plane = cq.Plane.named("YZ", (offset, 0, 0))
+		case "Y":
+			plane = cq.Plane.named("XZ", (0, offset, 0))
+		case "Z":
+			plane = cq.Plane.named("XY", (0, 0, offset))
+		case _:
+			raise ValueError("axis must be X, Y or Z")
+	if hasattr(item, "vals"):
+		shapes = [shape for shape in item.vals() if isinstance(shape, cq.Shape)]
+		item = shapes[0] if len(shapes) == 1 else cq.Compound.makeCompound(shapes)
+	box = item.BoundingBox()
+	#project the centre of the item onto the plane, so the face covers it
+	centre = box.center - plane.zDir*(box.center - plane.origin).dot(plane.zDir)
+	size = box.DiagonalLength*2
+	faces = item.intersect(cq.Face.makePlane(size, size, centre, plane.zDir)).Faces()
+	if asWires:
+		return cq.Workplane(plane).newObject([wire for face in faces for wire in face.Wires()])
+	return cq.Workplane(plane).newObject(faces)
+
 def roundedRect(
 		xLength		= 10,
 		yLength		= 10,
@@ -86,6 +132,250 @@ def roundedRect(
 
 	return returnVal
 
+def gridOffsets(
+		plateX		= 3,
+		plateY		= 3,
+		):
+	"""
+	Calculate the centre of every cell in a plateX * plateY grid, centred on the origin
+
+	:param plateX: X dimension of the grid, in gridfinity units. Rounds up to the next int.
+	:param plateY: Y dimension of the grid, in gridfinity units. Rounds up to the next int.
+
+	:return: A list of (x, y, z) offsets
+	"""
+	return [
+		(
+			(x - (plateX/2 - 0.5))*gridUnit,
+			(y - (plateY/2 - 0.5))*gridUnit,
+			0
+		)
+		for x in range(ceil(plateX))
+		for y in range(ceil(plateY))
+	]
+
+def tileFuse(
+		unit,
+		offsets,
+		base		= None,
+		):
+	"""
+	Fuse translated copies of unit in a single multi-argument boolean.
+	Copies share the geometry of unit and only differ by their location, so nothing is copied per tile.
+	Tiles, and base, must only touch on coincident faces, as config.glue is applied to the fuse.
+
+	:param unit: Workplane holding the shape to tile
+	:param offsets: List of (x, y, z) translations, one per tile
+	:param base: Workplane to fuse the tiles into. If this is None (default), the tiles are only fused with each other
+
+	:return: base (or a new XY workplane) holding the fused shape
+	"""
+	from OCP.BRepAlgoAPI import BRepAlgoAPI_Fuse
+	if base is None:
+		base = cq.Workplane("XY")
+	shape = unit.val()
+	shapes = [item for item in base.vals() if isinstance(item, cq.Shape)]
+	shapes += [shape.moved(cq.Location(cq.Vector(*offset))) for offset in offsets]
+	fused = shapes.pop(0)
+	if shapes:
+		operation = BRepAlgoAPI_Fuse()
+		config.configureBoolean(operation, tiled=True)
+		fused = fused._bool_op([fused], shapes, operation)
+	return base.newObject([fused.clean()])
+
+def tileCut(
+		unit,
+		offsets,
+		base,
+		):
+	"""
+	Cut translated copies of unit from base in a single boolean, with all the copies gathered into one compound
+
+	:param unit: Workplane holding the cutter to tile
+	:param offsets: List of (x, y, z) translations, one per cutter
+	:param base: Workplane to cut from
+
+	:return: base, with every cutter removed
+	"""
+	shape = unit.val()
+	cutters = cq.Compound.makeCompound([shape.moved(cq.Location(cq.Vector(*offset))) for offset in offsets])
+	return base.cut(cutters)
+
+def tileAssembly(
+		unit,
+		offsets,
+		name		= "cell",
+		assembly	= None,
+		):
+	"""
+	Place copies of unit in an assembly without fusing them.
+	Every copy refers to the same unit object, so exporters write the cell once and reference it from each location.
+
+	:param unit: Workplane holding the shape to tile
+	:param offsets: List of (x, y, z) translations, one per tile
+	:param name: Prefix for the names of the placed copies
+	:param assembly: cq.Assembly to add the copies to. If this is None (default), a new assembly is created
+
+	:return: The assembly holding the placed copies
+	"""
+	if assembly is None:
+		assembly = cq.Assembly(name=name+"s")
+	for index, offset in enumerate(offsets):
+		assembly.add(unit, name="{}_{}".format(name, index), loc=cq.Location(cq.Vector(*offset)))
+	return assembly
+
+def baseplateUnit(
+		plateZ,
+		plateStyle	= PlateStyle.MAGNET_ONLY,
+		roundTop	= False,
+		roundTopX	= 1,
+		roundTopY	= 1,
+		):
+	"""
+	Generate a single baseplate cell, centred on the origin. Cells are cached in cache.unitCache.
+
+	:param plateZ: Z height of the cell, in mm
+	:param plateStyle: Style of the baseplate - PlateStyle.(BARE|MAGNET_ONLY|SCREW_ONLY|MAGNET_SCREW)
+	:param roundTop: Whether to round the top edges
+	:param roundTopX: X size of the plate, in gridfinity units, capped at 1. Only used if roundTop is set.
+	:param roundTopY: Y size of the plate, in gridfinity units, capped at 1. Only used if roundTop is set.
+
+	:return: A single baseplate cell
+	"""
+	if not roundTop:
+		roundTopX = roundTopY = None
+	key = ("baseplate", plateZ, plateStyle, roundTop, roundTopX, roundTopY, standardsKey(), config.key())
+
+	def build():
+		singleUnit = (
+			cq.Workplane("XY")
+			.rect(gridUnit, gridUnit)
+			.extrude(-plateZ)
+		)
+		surfaceXY	= gridUnit - tolerance*2
+		surfaceRad	= extFilletRadius
+		middleXY	= surfaceXY - outsideTop*2
+		middleRad	= surfaceRad - outsideTop
+		bottomXY	= middleXY - outsideBottom*2-0.1
+		bottomRad	= middleRad - outsideBottom
+
+		if config.preview:
+			#straight sided pocket, no rounding or holes
+			return (
+				singleUnit
+				.faces(">Z")
+				.rect(middleXY, middleXY)
+				.extrude(-outsideTop-outsideMid-outsideBottom, "s")
+				.translate((0,0,-tolerance))
+			)
+
+		surfaceProfile	= roundedRect(surfaceXY, surfaceXY, surfaceRad, singleUnit)
+		midTopProfile	= roundedRect(middleXY, middleXY, middleRad, surfaceProfile.workplane(-outsideTop))
+		midBotProfile	= roundedRect(middleXY, middleXY, middleRad, midTopProfile.workplane(-outsideMid))
+		bottomProfile	= roundedRect(bottomXY, bottomXY, bottomRad, midBotProfile.workplane(-outsideBottom))
+		singleUnit = (
+			bottomProfile
+			.loft(True, "s")
+		)
+		if roundTop:
+			singleUnit = (
+				singleUnit
+				.faces(">Z")
+				.rect(roundTopX*gridUnit*2, roundTopY*gridUnit*2)
+				.extrude(-outsideTop/2, "s")
+				.edges(">Z except (>X or <X or >Y or <Y)")
+				.fillet(outsideTop/4)
+			)
+		match plateStyle:
+			case PlateStyle.MAGNET_ONLY:
+				singleUnit = (
+					singleUnit
+					.faces(">Z")
+					.rect(magnetCCDist, magnetCCDist, forConstruction=True)
+					.vertices()
+					.circle(magnetDiameter/2)
+					.extrude(-magnetDepth-outsideDepth, "s")
+				)
+			case PlateStyle.SCREW_ONLY:
+				singleUnit = (
+					singleUnit
+					.faces(">Z")
+					.rect(magnetCCDist, magnetCCDist, forConstruction=True)
+					.vertices()
+					.circle(screwDiameter/2)
+					.extrude(-screwDepth-outsideDepth, "s")
+				)
+			case PlateStyle.MAGNET_SCREW:
+				singleUnit = (
+					singleUnit
+					.faces(">Z")
+					.rect(magnetCCDist, magnetCCDist, forConstruction=True)
+					.vertices()
+					.circle(magnetDiameter/2)
+					.extrude(-magnetDepth-outsideDepth, "s")
+					.faces(">Z")
+					.rect(magnetCCDist, magnetCCDist, forConstruction=True)
+					.vertices()
+					.circle(screwDiameter/2)
+					.extrude(-screwDepth-outsideDepth, "s")
+				)
+		return singleUnit.translate((0,0,-tolerance))
+
+	return unitCache.get(key, build)
+
+def fuseChunk(
+		offsets,
+		cellArguments,
+		settings,
+		):
+	"""
+	Fuse one strip of baseplate cells. Runs inside the worker processes of baseplate().
+
+	:param offsets: List of (x, y, z) translations, one per cell in the strip
+	:param cellArguments: Arguments for baseplateUnit()
+	:param settings: config.settings() of the parent process
+
+	:return: The fused strip, as binary BREP
+	"""
+	with useConfig(**settings):
+		singleUnit = baseplateUnit(*cellArguments)
+		return shapeToBytes(tileFuse(singleUnit, offsets).val())
+
+def parallelTileFuse(
+		offsets,
+		cellArguments,
+		workers,
+		):
+	"""
+	Fuse a grid of baseplate cells as strips of whole columns across worker processes, then fuse the strips together.
+	The strips are already clean, and the final fuse skips cleaning - running it over the whole plate costs more than building the strips. The only difference is that faces stay split where strips meet.
+
+	:param offsets: List of (x, y, z) translations from gridOffsets(), one per cell
+	:param cellArguments: Arguments for baseplateUnit()
+	:param workers: Number of worker processes, and strips
+
+	:return: An XY workplane holding the fused shape
+	"""
+	columns = sorted(set(offset[0] for offset in offsets))
+	chunks = []
+	start = 0
+	for size in splitGrid(len(columns), ceil(len(columns)/workers)):
+		inChunk = set(columns[start:start+size])
+		chunks.append([offset for offset in offsets if offset[0] in inChunk])
+		start += size
+	with ProcessPoolExecutor(min(workers, len(chunks))) as pool:
+		strips = [
+			shapeFromBytes(data)
+			for data in pool.map(fuseChunk, chunks, [cellArguments]*len(chunks), [config.settings()]*len(chunks))
+		]
+	fused = strips.pop(0)
+	if strips:
+		fused = fused.fuse(*strips)
+	return cq.Workplane("XY").newObject([fused])
+
+@staged
+@acceptsSpec
+@diskCached
 def baseplate (
 		plateX		= 3,
 		plateY		= 3,
@@ -94,6 +384,9 @@ def baseplate (
 		plateStyle	= PlateStyle.MAGNET_ONLY,
 
 		roundTop	= False,
+
+		asAssembly	= False,
+		workers		= None,
 		):
 	"""
 	Generate a gridfinity baseplate of plateX * plateY
@@ -103,6 +396,8 @@ def baseplate (
 	:param plateZ: Z height of the baseplate, in mm. If this is None (default), then it will automatically calculate the minimum for the specified base style
 	:param plateStyle: Style of the baseplate - PlateStyle.(BARE|MAGNET_ONLY|SCREW_ONLY|MAGNET_SCREW)
 	:param roundTop: Whether to round the top edges
+	:param asAssembly: Return a cq.Assembly placing one shared cell at each grid position, instead of fusing the cells into one solid
+	:param workers: Number of worker processes to fuse strips of the plate in. If this is None (default), the plate is fused in this process
 
 	:return: A gridfinity baseplate of the specified size
 	"""
@@ -111,90 +406,87 @@ def baseplate (
 	if (plateY <= 0):
 		raise ValueError("plateY cannot be less than 0")
 	if (plateZ is None):
-		plateZ = outsideDepth
-		if (plateStyle is not PlateStyle.BARE):
-			plateZ += magnetDepth+wallThickness
-	singleUnit = (
-		cq.Workplane("XY")
-		.rect(gridUnit, gridUnit)
-		.extrude(-plateZ)
-	)
-	surfaceXY	= gridUnit - tolerance*2
-	surfaceRad	= extFilletRadius
-	middleXY	= surfaceXY - outsideTop*2
-	middleRad	= surfaceRad - outsideTop
-	bottomXY	= middleXY - outsideBottom*2-0.1
-	bottomRad	= middleRad - outsideBottom
-
-	surfaceProfile	= roundedRect(surfaceXY, surfaceXY, surfaceRad, singleUnit)
-	midTopProfile	= roundedRect(middleXY, middleXY, middleRad, surfaceProfile.workplane(-outsideTop))
-	midBotProfile	= roundedRect(middleXY, middleXY, middleRad, midTopProfile.workplane(-outsideMid))
-	bottomProfile	= roundedRect(bottomXY, bottomXY, bottomRad, midBotProfile.workplane(-outsideBottom))
-	singleUnit = (
-		bottomProfile
-		.loft(True, "s")
-	)
-	if roundTop:
-		singleUnit = (
-			singleUnit
-			.faces(">Z")
-			.rect(plateX*gridUnit*2, plateY*gridUnit*2)
-			.extrude(-outsideTop/2, "s")
-			.edges(">Z except (>X or <X or >Y or <Y)")
-			.fillet(outsideTop/4)
-		)
-	match plateStyle:
-		case PlateStyle.MAGNET_ONLY:
-			singleUnit = (
-				singleUnit
-				.faces(">Z")
-				.rect(magnetCCDist, magnetCCDist, forConstruction=True)
-				.vertices()
-				.circle(magnetDiameter/2)
-				.extrude(-magnetDepth-outsideDepth, "s")
-			)
-		case PlateStyle.SCREW_ONLY:
-			singleUnit = (
-				singleUnit
-				.faces(">Z")
-				.rect(magnetCCDist, magnetCCDist, forConstruction=True)
-				.vertices()
-				.circle(screwDiameter/2)
-				.extrude(-screwDepth-outsideDepth, "s")
-			)
-		case PlateStyle.MAGNET_SCREW:
-			singleUnit = (
-				singleUnit
-				.faces(">Z")
-				.rect(magnetCCDist, magnetCCDist, forConstruction=True)
-				.vertices()
-				.circle(magnetDiameter/2)
-				.extrude(-magnetDepth-outsideDepth, "s")
-				.faces(">Z")
-				.rect(magnetCCDist, magnetCCDist, forConstruction=True)
-				.vertices()
-				.circle(screwDiameter/2)
-				.extrude(-screwDepth-outsideDepth, "s")
-			)
-	singleUnit = singleUnit.translate((0,0,-tolerance))
-
-	returnPlate = cq.Workplane("XY") #blank
-
-	unionList = []
-	for x in range(ceil(plateX)):
-		for y in range(ceil(plateY)):
-			unionList.append(
-				singleUnit.translate((
-					(x - (plateX/2 - 0.5))*gridUnit,
-					(y - (plateY/2 - 0.5))*gridUnit,
-					0
-				))
-			)
-	for item in unionList:
-		returnPlate = (
-			returnPlate
-			.add(item)
-		)
-	returnPlate = returnPlate.combine()
+		plateZ = plateHeight(plateStyle)
+	if (workers is not None and workers < 1):
+		raise ValueError("workers cannot be less than 1")
+	cellArguments = (plateZ, plateStyle, roundTop, min(plateX, 1), min(plateY, 1))
+	with stage("cell"):
+		singleUnit = baseplateUnit(*cellArguments)
+
+	if asAssembly:
+		return tileAssembly(singleUnit, gridOffsets(plateX, plateY))
+
+	with stage("tiling") as tilingStage:
+		if (workers is None or workers == 1 or ceil(plateX) == 1):
+			returnPlate = tileFuse(singleUnit, gridOffsets(plateX, plateY))
+		else:
+			returnPlate = parallelTileFuse(gridOffsets(plateX, plateY), cellArguments, workers)
+		tilingStage.record(returnPlate)
 	
-	return returnPlate
\ No newline at end of file
+	return returnPlate
+
+#column and row count tiles from the -X/-Y corner, offset places the tile in the full drawer layout
+BaseplateTile = namedtuple("BaseplateTile", ["column", "row", "offset", "plate"])
+
+def splitGrid(
+		units		= 1,
+		maxUnits	= 1,
+		):
+	"""
+	Split a row of cells into the fewest pieces of at most maxUnits, keeping the pieces as even as possible
+
+	:param units: Number of cells in the row
+	:param maxUnits: Largest number of cells allowed in one piece
+
+	:return: A list of piece sizes, largest first
+	"""
+	pieces = ceil(units/maxUnits)
+	size, extra = divmod(units, pieces)
+	return [size+1]*extra + [size]*(pieces-extra)
+
+def baseplateTiles(
+		drawerX		= 3,
+		drawerY		= 3,
+		bedX: float	= 220,
+		bedY: float	= 220,
+		plateZ		= None,
+
+		plateStyle	= PlateStyle.MAGNET_ONLY,
+		):
+	"""
+	Generate a drawer sized baseplate as a series of tiles which each fit on the print bed.
+	Tiles are built lazily, one at a time, and share their cells through cache.unitCache.
+	Tiles split on cell boundaries, so neighbouring tiles butt together on the normal grid pitch.
+
+	:param drawerX: X dimension of the drawer, in gridfinity units. Rounds up to the next int.
+	:param drawerY: Y dimension of the drawer, in gridfinity units. Rounds up to the next int.
+	:param bedX: X dimension of the print bed, in mm
+	:param bedY: Y dimension of the print bed, in mm
+	:param plateZ: Z height of the baseplate, in mm. If this is None (default), then it will automatically calculate the minimum for the specified base style
+	:param plateStyle: Style of the baseplate - PlateStyle.(BARE|MAGNET_ONLY|SCREW_ONLY|MAGNET_SCREW)
+
+	:return: A generator of BaseplateTile
+	"""
+	if (drawerX <= 0):
+		raise ValueError("drawerX cannot be less than 0")
+	if (drawerY <= 0):
+		raise ValueError("drawerY cannot be less than 0")
+	maxX = floor(bedX/gridUnit)
+	maxY = floor(bedY/gridUnit)
+	if (maxX < 1 or maxY < 1):
+		raise ValueError("A print bed of {:.0f}x{:.0f}mm cannot fit a single {}mm cell".format(bedX, bedY, gridUnit))
+	cellsX = ceil(drawerX)
+	cellsY = ceil(drawerY)
+
+	startY = 0
+	for row, tileY in enumerate(splitGrid(cellsY, maxY)):
+		startX = 0
+		for column, tileX in enumerate(splitGrid(cellsX, maxX)):
+			offset = (
+				(startX + tileX/2 - cellsX/2)*gridUnit,
+				(startY + tileY/2 - cellsY/2)*gridUnit,
+				0
+			)
+			yield BaseplateTile(column, row, offset, baseplate(tileX, tileY, plateZ, plateStyle))
+			startX += tileX
+		startY += tileY
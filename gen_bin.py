@@ -4,144 +4,106 @@ from math import floor, ceil
 
 from standards import *
 from gen_baseplate import *
+from config import config
+from cache import cachedStage
+from instrument import stage, staged
+from specs import resolveBottomDivisions, acceptsSpec, plateHeight
+from calculator import compartmentSize, windowSize
 
-def binSolid(
-		binX: float	= 1,
-		binY: float	= 1,
-		binZ: float	= 6,
-
-		topStyle	= TopStyle.STACKING,
+def binBottomUnit(
 		bottomStyle	= BottomStyle.MAGNET_ONLY,
 		bottomDivX	= 1,
 		bottomDivY	= 1,
 		):
-	if (binX <= 0):
-		raise Exception("binX cannot be less than 0")
-	if (binY <= 0):
-		raise Exception("binY cannot be less than 0")
-	if (binZ <= 0):
-		raise Exception("binZ cannot be less than 0")
-	if (bottomDivX <=0):
-		raise Exception("bottomDivX cannot be less than 0")
-	if (bottomDivY <=0):
-		raise Exception("bottomDivY cannot be less than 0")
+	"""
+	Generate the interlock for a single (sub)division of the bottom of a bin. Units are cached in cache.unitCache.
 
-	binWidth	= binX*gridUnit-tolerance*2
-	binDepth	= binY*gridUnit-tolerance*2
-	binHeight	= binZ*heightUnit
+	:param bottomStyle: Style of the bin bottom - BottomStyle.(NONE|BLANK|MAGNET_ONLY|SCREW_ONLY|MAGNET_SCREW)
+	:param bottomDivX: Number of divisions per gridfinity unit in X
+	:param bottomDivY: Number of divisions per gridfinity unit in Y
 
-	bin = (cq.Workplane("XY", (0,0,binHeight/2))
-				.box(binWidth, binDepth, binHeight)
-				.edges("|Z")
-				.fillet(extFilletRadius)
-	)
+	:return: A single interlock unit, or None if bottomStyle is BottomStyle.NONE
+	"""
+	if (bottomStyle is BottomStyle.NONE):
+		return None
+	key = ("binBottom", bottomStyle, bottomDivX, bottomDivY, standardsKey(), config.key())
 
-	# bottom of bin
-	interlockWidth = gridUnit-tolerance*2-insideTop*2
-	magnetLocation = magnetCCDist
-	
-	interlockBlank = (
-		bin
-		.faces("<Z")
-		.rect(interlockWidth, interlockWidth)
-		.extrude(-insideDepth, False)
-		.edges("|Z")
-		.fillet(insideFillet)
-		.faces("<Z")
-		.chamfer(insideBottom)
-		.faces(">Z")
-		.rect(gridUnit-tolerance*2, gridUnit-tolerance*2)
-		.extrude(-insideTop)
-		.edges("|Z")
-		.fillet(extFilletRadius)
-		.faces(">Z[1]")
-		.edges(">>X or <<X or >>X[0] or >>X[-1] or >>Y or <<Y")
-		.chamfer(insideTop-0.01)
-	)
+	def build():
+		interlockWidth = gridUnit-tolerance*2-insideTop*2
+		magnetLocation = magnetCCDist
 
-	unionObject = None
-	match bottomStyle:
-		case BottomStyle.BLANK:
-			unionObject = interlockBlank
-		case BottomStyle.MAGNET_ONLY:
-			unionObject = (
-				interlockBlank
-				.faces("<Z")
-				.rect(magnetLocation, magnetLocation, forConstruction=True)
-				.vertices()
-				.circle(magnetDiameter/2)
-				.extrude(magnetDepth, "s")
-			)
-		case BottomStyle.SCREW_ONLY:
-			unionObject = (
-				interlockBlank
-				.faces("<Z")
-				.rect(magnetLocation, magnetLocation, forConstruction=True)
-				.vertices()
-				.circle(screwDiameter/2)
-				.extrude(screwDepth, "s")
-			)
-		case BottomStyle.MAGNET_SCREW:
-			unionObject = (
-				interlockBlank
-				.faces("<Z")
-				.rect(magnetLocation, magnetLocation, forConstruction=True)
-				.vertices()
-				.circle(magnetDiameter/2)
-				.extrude(magnetDepth, "s")
-				.faces("<Z")
-				.rect(magnetLocation, magnetLocation, forConstruction=True)
-				.vertices()
-				.circle(screwDiameter/2)
-				.extrude(screwDepth, "s")
-				.faces("<Z")
-				.rect(magnetLocation, magnetLocation, forConstruction=True)
-				.vertices()
-				.rect(screwDiameter, screwSlitLength)
-				.extrude(magnetDepth+screwSlit, "s")
+		if config.preview:
+			#plain box in place of the interlock, sitting where the subdivided unit would
+			return (
+				cq.Workplane("XY")
+				.box(gridUnit/bottomDivX-tolerance*2-insideTop*2, gridUnit/bottomDivY-tolerance*2-insideTop*2, insideDepth, (True, True, False))
+				.translate((
+					-gridUnit/2*(1-1/bottomDivX),
+					-gridUnit/2*(1-1/bottomDivY),
+					-insideDepth
+				))
 			)
+	
+		interlockBlank = (
+			cq.Workplane("XY")
+			.rect(interlockWidth, interlockWidth)
+			.extrude(-insideDepth)
+			.edges("|Z")
+			.fillet(insideFillet)
+			.faces("<Z")
+			.chamfer(insideBottom)
+			.faces(">Z")
+			.rect(gridUnit-tolerance*2, gridUnit-tolerance*2)
+			.extrude(-insideTop)
+			.edges("|Z")
+			.fillet(extFilletRadius)
+			.faces(">Z[1]")
+			.edges(">>X or <<X or >>X[0] or >>X[-1] or >>Y or <<Y")
+			.chamfer(insideTop-0.01)
+		)
+
+		unionObject = None
+		match bottomStyle:
+			case BottomStyle.BLANK:
+				unionObject = interlockBlank
+			case BottomStyle.MAGNET_ONLY:
+				unionObject = (
+					interlockBlank
+					.faces("<Z")
+					.rect(magnetLocation, magnetLocation, forConstruction=True)
+					.vertices()
+					.circle(magnetDiameter/2)
+					.extrude(magnetDepth, "s")
+				)
+			case BottomStyle.SCREW_ONLY:
+				unionObject = (
+					interlockBlank
+					.faces("<Z")
+					.rect(magnetLocation, magnetLocation, forConstruction=True)
+					.vertices()
+					.circle(screwDiameter/2)
+					.extrude(screwDepth, "s")
+				)
+			case BottomStyle.MAGNET_SCREW:
+				unionObject = (
+					interlockBlank
+					.faces("<Z")
+					.rect(magnetLocation, magnetLocation, forConstruction=True)
+					.vertices()
+					.circle(magnetDiameter/2)
+					.extrude(magnetDepth, "s")
+					.faces("<Z")
+					.rect(magnetLocation, magnetLocation, forConstruction=True)
+					.vertices()
+					.circle(screwDiameter/2)
+					.extrude(screwDepth, "s")
+					.faces("<Z")
+					.rect(magnetLocation, magnetLocation, forConstruction=True)
+					.vertices()
+					.rect(screwDiameter, screwSlitLength)
+					.extrude(magnetDepth+screwSlit, "s")
+				)
 
-	if (unionObject is not None):
-		#check if the requested subdivisions will actually work or not
-		printableThreshold = wallThickness*4
-		if (bottomDivX is not None):
-			bottomDivX_interlockWidth = gridUnit/bottomDivX-insideTop*2 #calculate width of interlock vertical section
-			if (bottomDivX_interlockWidth < printableThreshold):
-				raise Exception("bottomDivX of {:.2f} is too big - would result in hard to print features of {:.2f}mm".format(bottomDivX, bottomDivX_interlockWidth))
-		if (bottomDivY is not None):
-			bottomDivY_interlockWidth = gridUnit/bottomDivY-insideTop*2 #calculate depth of interlock vertical section
-			if (bottomDivY_interlockWidth < printableThreshold):
-				raise Exception("bottomDivY of {:.2f} is too big - would result in hard to print features of {:.2f}mm".format(bottomDivY, bottomDivY_interlockWidth))
-		
-		#if unspecified, automatically calculate subdivisions
-		maxDivisions = floor(gridUnit/(printableThreshold+insideTop*2))
-		if (bottomDivX is None):
-			if (binX%1):
-				autoInverse = 1/(binX%1)
-				bottomDivX = autoInverse
-				#cycle through whole number options, up to the allowable max
-				for i in range(1, maxDivisions+1):
-					#if (round(binX%(1/i), 2) == 0.0):
-					#	bottomDivX = i
-					#	print("method 1")
-					#	break
-					if (round(i/autoInverse, 1)%1 == 0):
-						#if i and autoInverse share a common factor (or nearly share), then accept that
-						#this is necessary to allow "nearly" correct numbers such as 0.66 intead of (2/3)
-						bottomDivX = autoInverse*round(i/autoInverse, 1)
-						break
-			else:
-				bottomDivX = 1
-		if (bottomDivY is None):
-			if (binY%1):
-				bottomDivY = 1/(binY%1)
-				#cycle through whole number options, up to the allowable max
-				for i in range(1, maxDivisions+1):
-					if (round(binY%(1/i), 2) == 0.0):
-						bottomDivY = i
-						break
-			else:
-				bottomDivY = 1
 		if (bottomDivX != 1 or bottomDivY != 1):
 			#break into parts by intersecting
 			#create single unit
@@ -173,31 +135,89 @@ def binSolid(
 				offsetObject
 				.rotate((0,0,0),(0,0,5),180)
 			)
+		return unionObject
 
-		#tile across bottom of bin
-		xOffset = (binX-1 % 2) * -gridUnit/2
-		yOffset = (binY-1 % 2) * -gridUnit/2
-		
-		unionList = []
+	return unitCache.get(key, build)
 
-		for x in range(int(binX*bottomDivX)): #binX
-			for y in range(int(binY*bottomDivY)): #binY
-				unionList.append(
-					unionObject
-					.translate((
-						xOffset+x*gridUnit/bottomDivX,
-						yOffset+y*gridUnit/bottomDivY,
-						0
-					))
-				)
-		for item in unionList:
+def binLip(
+		binX		= 1,
+		binY		= 1,
+		binZ		= 6,
+		plateStyle	= PlateStyle.BARE,
+		body		= None,
+		):
+	"""
+	Generate the stacking lip for an internal divider top, from the cached baseplate cell.
+	Only the cells on the edge of the bin are clipped to its outline, the rest are placed as they are.
+
+	:param binX: X dimension of the bin, in gridfinity units
+	:param binY: Y dimension of the bin, in gridfinity units
+	:param binZ: Z dimension of the bin, in height units
+	:param plateStyle: Style of the lip - PlateStyle.(BARE|MAGNET_ONLY)
+	:param body: Shape of the whole bin, which every cell is clipped to when the bin is shallower than the lip
+
+	:return: A list of shapes to fuse with the bin
+	"""
+	binWidth	= binX*gridUnit-tolerance*2
+	binDepth	= binY*gridUnit-tolerance*2
+	binHeight	= binZ*heightUnit
+	plateZ		= plateHeight(plateStyle)
+	lipBottom	= binHeight-plateZ-tolerance
+
+	cell = baseplateUnit(plateZ, plateStyle, True, min(binX, 1), min(binY, 1)).val()
+	cells = [cell.moved(cq.Location(cq.Vector(x, y, binHeight))) for x, y, _ in gridOffsets(binX, binY)]
+	if (lipBottom < 0):
+		#the lip reaches into the bottom of the bin
+		return [body.intersect(*cells)]
+
+	inner = []
+	edge = []
+	for placed in cells:
+		x, y, _ = placed.location().toTuple()[0]
+		if (abs(x)+gridUnit/2 < binWidth/2 and abs(y)+gridUnit/2 < binDepth/2):
+			inner.append(placed)
+		else:
+			edge.append(placed)
+	#outline of the bin over the height of the lip
+	outline = (
+		cq.Workplane("XY", (0, 0, lipBottom))
+		.rect(binWidth, binDepth)
+		.extrude(plateZ)
+		.edges("|Z")
+		.fillet(extFilletRadius)
+		.val()
+	)
+	return inner + [outline.intersect(*edge)]
+
+def binTop(
+		bin,
+		binX: float	= 1,
+		binY: float	= 1,
+		binZ: float	= 6,
+		topStyle	= TopStyle.STACKING,
+		):
+	"""
+	Shape the top of a bin body for a top style
+
+	:param bin: Workplane holding the bin body, with or without its bottom
+	:param binX: X dimension of the bin, in gridfinity units
+	:param binY: Y dimension of the bin, in gridfinity units
+	:param binZ: Z dimension of the bin, in height units
+	:param topStyle: Style of the bin top - TopStyle.(NONE|NONE_LOW|STACKING|INT_DIV|INT_DIV_MAG)
+
+	:return: The bin, with its top shaped
+	"""
+	binWidth	= binX*gridUnit-tolerance*2
+	binDepth	= binY*gridUnit-tolerance*2
+	match topStyle:
+		case TopStyle.INT_DIV | TopStyle.INT_DIV_MAG if config.preview:
+			#leave the top solid, trimmed to the height of the divider lip
 			bin = (
 				bin
-				.add(item)
+				.faces(">Z")
+				.rect(binWidth, binDepth)
+				.extrude(-outsideTop/2-tolerance, "s")
 			)
-		bin = bin.combine()
-	# top of bin
-	match topStyle:
 		case TopStyle.NONE_LOW:
 			bin = (
 				bin
@@ -211,52 +231,133 @@ def binSolid(
 				.faces(">Z")
 				.rect(binWidth-outsideTop*2, binDepth-outsideTop*2)
 				.extrude(-outsideDepth-tolerance, False)
-				.edges("|Z")
-				.fillet(outsideFillet)
-				.faces("-Z")
-				.chamfer(outsideBottom)
+			)
+			if not config.preview:
+				cutoutObject = (
+					cutoutObject
+					.edges("|Z")
+					.fillet(outsideFillet)
+					.faces("-Z")
+					.chamfer(outsideBottom)
+				)
+			cutoutObject = (
+				cutoutObject
 				.faces(">Z")
 				.rect(binWidth, binDepth)
 				.extrude(-outsideTop/2)
 			)
-			bin = (
-				bin
-				.cut(cutoutObject)
-				.edges(">Z")
-				#eliminate straight edges on outside
-				.edges("not(>X or <X or >Y or <Y)")
-				#eliminate outside curves
-				.edges("not >>X[0] or >>X[-1]")
-				.chamfer(outsideTop/2+tolerance)
-				#fillet outside + transition to chamfer
-				.edges(">Z")
-				.fillet(outsideTop/4)
-			)
-		case TopStyle.INT_DIV:
-			baseForTop = (
-				baseplate(binX, binY, None, PlateStyle.BARE, True)
-				.translate((0, 0, binZ*heightUnit))
-				.intersect(bin)
-			)
+			bin = bin.cut(cutoutObject)
+			if not config.preview:
+				with stage("top fillets"):
+					bin = (
+						bin
+						.edges(">Z")
+						#eliminate straight edges on outside
+						.edges("not(>X or <X or >Y or <Y)")
+						#eliminate outside curves
+						.edges("not >>X[0] or >>X[-1]")
+						.chamfer(outsideTop/2+tolerance)
+						#fillet outside + transition to chamfer
+						.edges(">Z")
+						.fillet(outsideTop/4)
+					)
+		case TopStyle.INT_DIV | TopStyle.INT_DIV_MAG:
+			plateStyle = PlateStyle.BARE
+			cutDepth = outsideDepth+tolerance
+			if (topStyle is TopStyle.INT_DIV_MAG):
+				plateStyle = PlateStyle.MAGNET_ONLY
+				#the body closes the bottom of the magnet holes
+				cutDepth += magnetDepth
+			lip = binLip(binX, binY, binZ, plateStyle, bin.val())
 			bin = (
 				bin
 				.faces(">Z")
 				.rect(binWidth, binDepth)
-				.extrude(-outsideDepth-tolerance, "s")
-			).union(baseForTop)
-		case TopStyle.INT_DIV_MAG:
-			baseForTop = (
-				baseplate(binX, binY, None, PlateStyle.MAGNET_ONLY, True)
-				.translate((0, 0, binZ*heightUnit))
-				.intersect(bin)
+				.extrude(-cutDepth, "s")
 			)
-			bin = (
-				bin
-				.faces(">Z")
-				.rect(binWidth, binDepth)
-				.extrude(-outsideDepth-tolerance-magnetDepth, "s")
-			).union(baseForTop)
+			fused = bin.val().fuse(*lip).clean()
+			bin = bin.newObject([fused])
+	return bin
 
+@staged
+@acceptsSpec
+@diskCached
+def binSolid(
+		binX: float	= 1,
+		binY: float	= 1,
+		binZ: float	= 6,
+
+		topStyle	= TopStyle.STACKING,
+		bottomStyle	= BottomStyle.MAGNET_ONLY,
+		bottomDivX	= 1,
+		bottomDivY	= 1,
+
+		asAssembly	= False,
+		):
+	if (binX <= 0):
+		raise Exception("binX cannot be less than 0")
+	if (binY <= 0):
+		raise Exception("binY cannot be less than 0")
+	if (binZ <= 0):
+		raise Exception("binZ cannot be less than 0")
+	if (bottomDivX is not None and bottomDivX <=0):
+		raise Exception("bottomDivX cannot be less than 0")
+	if (bottomDivY is not None and bottomDivY <=0):
+		raise Exception("bottomDivY cannot be less than 0")
+
+	binWidth	= binX*gridUnit-tolerance*2
+	binDepth	= binY*gridUnit-tolerance*2
+	binHeight	= binZ*heightUnit
+
+	def buildBody():
+		body = (cq.Workplane("XY", (0,0,binHeight/2))
+					.box(binWidth, binDepth, binHeight)
+		)
+		if not config.preview:
+			body = body.edges("|Z").fillet(extFilletRadius)
+		return body
+
+	#each stage is cached on its own inputs and those of the stages before it
+	stageInputs = (binX, binY, binZ)
+	with stage("body") as bodyStage:
+		bin = cachedStage("body", stageInputs, buildBody)
+		bodyStage.record(bin)
+
+	if (bottomStyle is not BottomStyle.NONE):
+		bottomDivX, bottomDivY = resolveBottomDivisions(binX, binY, bottomDivX, bottomDivY)
+		with stage("interlock"):
+			unionObject = binBottomUnit(bottomStyle, bottomDivX, bottomDivY)
+
+		#tile across bottom of bin
+		xOffset = (binX-1 % 2) * -gridUnit/2
+		yOffset = (binY-1 % 2) * -gridUnit/2
+		
+		offsetList = [
+			(
+				xOffset+x*gridUnit/bottomDivX,
+				yOffset+y*gridUnit/bottomDivY,
+				0
+			)
+			for x in range(int(binX*bottomDivX)) #binX
+			for y in range(int(binY*bottomDivY)) #binY
+		]
+		#assemblies place the interlock cells after the top style, without fusing them to the body
+		if not asAssembly:
+			stageInputs += (bottomStyle, bottomDivX, bottomDivY)
+			with stage("bottom tiling") as tilingStage:
+				bin = cachedStage("bottom tiling", stageInputs, lambda: tileFuse(unionObject, offsetList, bin))
+				tilingStage.record(bin)
+	# top of bin
+	stageInputs += (topStyle,)
+	with stage("top style") as topStage:
+		bin = cachedStage("top style", stageInputs, lambda: binTop(bin, binX, binY, binZ, topStyle))
+		topStage.record(bin)
+
+	if asAssembly:
+		assembly = cq.Assembly(bin, name="body")
+		if (bottomStyle is not BottomStyle.NONE):
+			tileAssembly(unionObject, offsetList, "bottom", assembly)
+		return assembly
 	return bin
 
 def tabGenerator(
@@ -300,67 +401,81 @@ def binCutter(
 	binTransition	= outsideBottom
 	binChamfer		= outsideBottom+outsideTop-wallThickness
 
-	returnCutter = (
-		cq.Workplane("XY", (0, 0, -outsideBottom/2))
-		.rect(binWidth, binDepth)
-		.extrude(-binHeight)
-		.edges("|Z or <Z")
-		.fillet(binBodyFillet)
-		.edges(">Z")
-		.chamfer(binChamfer)
-	)
-	returnCutterTop = (
-		returnCutter
-		.faces(">Z")
-		.rect(binWidth-binChamfer*2, binDepth-binChamfer*2)
-		.extrude(binTransition, False)
-		.edges("|Z")
-		.edges(">Z")
-		.fillet(binTopFillet)
-	)
-	returnCutter = (
-		returnCutter
-		.add(returnCutterTop)
-		.combine()
-	)
-
-	tab = tabGenerator(
-			tabStyle=tabStyle,
-			tabAngle=tabAngle,
-			binWidth=binWidth
-		)
-	if tab is not None:
-		tab = (
-			tab
-			.translate((
-				0,
-				binDepth/2,
-				outsideBottom/2
-			))
+	if config.preview:
+		#no fillets, tab or scoop
+		return (
+			cq.Workplane("XY", (0, 0, -outsideBottom/2))
+			.rect(binWidth, binDepth)
+			.extrude(-binHeight)
+			.faces(">Z")
+			.rect(binWidth-binChamfer*2, binDepth-binChamfer*2)
+			.extrude(binTransition)
 		)
+
+	with stage("cutter body"):
 		returnCutter = (
-			returnCutter
-			.cut(tab)
+			cq.Workplane("XY", (0, 0, -outsideBottom/2))
+			.rect(binWidth, binDepth)
+			.extrude(-binHeight)
+			.edges("|Z or <Z")
+			.fillet(binBodyFillet)
+			.edges(">Z")
+			.chamfer(binChamfer)
 		)
-	
-	if scoop > 0:
-		scoopUnit = min(binHeight, binDepth)/4*scoop
-		scoopCutter = (
-			cq.Workplane("YZ", ( 0, -binDepth/2, -binHeight-outsideBottom/2))
-			.moveTo(scoopUnit,0)
-			.radiusArc((0,scoopUnit), scoopUnit)
-			.lineTo(0, 0)
-			.close()
-			.extrude(binWidth/2, both=True)
+		returnCutterTop = (
+			returnCutter
+			.faces(">Z")
+			.rect(binWidth-binChamfer*2, binDepth-binChamfer*2)
+			.extrude(binTransition, False)
+			.edges("|Z")
+			.edges(">Z")
+			.fillet(binTopFillet)
 		)
 		returnCutter = (
 			returnCutter
-			.cut(scoopCutter)
+			.add(returnCutterTop)
+			.combine()
 		)
+
+	with stage("cutter tab"):
+		tab = tabGenerator(
+				tabStyle=tabStyle,
+				tabAngle=tabAngle,
+				binWidth=binWidth
+			)
+		if tab is not None:
+			tab = (
+				tab
+				.translate((
+					0,
+					binDepth/2,
+					outsideBottom/2
+				))
+			)
+			returnCutter = (
+				returnCutter
+				.cut(tab)
+			)
+	
+	with stage("cutter scoop"):
+		if scoop > 0:
+			scoopUnit = min(binHeight, binDepth)/4*scoop
+			scoopCutter = (
+				cq.Workplane("YZ", ( 0, -binDepth/2, -binHeight-outsideBottom/2))
+				.moveTo(scoopUnit,0)
+				.radiusArc((0,scoopUnit), scoopUnit)
+				.lineTo(0, 0)
+				.close()
+				.extrude(binWidth/2, both=True)
+			)
+			returnCutter = (
+				returnCutter
+				.cut(scoopCutter)
+			)
 	
 	return returnCutter
 
-def binCompartments(
+def compartmentCutters(
 		binX: float	= 1,
 		binY: float	= 1,
 		binZ: float	= 6,
@@ -373,35 +488,19 @@ def binCompartments(
 		tabStyle	= TabStyle.FULL,
 		tabAngle	= 60,
 
-		topStyle	= TopStyle.STACKING,
-		bottomStyle	= BottomStyle.MAGNET_ONLY,
-		bottomDivX	= 1,
-		bottomDivY	= 1,
+		addX: float	= 0,
+		addY: float	= 0,
 		):
-	if (divX < 1):
-		raise Exception("divX cannot be less than 1")
-	if (divY < 1):
-		raise Exception("divY cannot be less than 1")
-	returnBin = binSolid(binX, binY, binZ, topStyle, bottomStyle, bottomDivX, bottomDivY)
+	"""
+	Build the cutter for a single compartment, and the offset of every compartment in the bin
 
-	widthAvail	= (
-		binX*gridUnit-tolerance*2	#base bin width
-		-wallThickness*2			#outside walls
-		-wallThickness*(divX-1)		#inside walls
-	)
-	depthAvail	= (
-		binY*gridUnit-tolerance*2	#base bin depth
-		-wallThickness*2			#outside walls
-		-wallThickness*(divY-1)		#inside walls
-	)
-	heightAvail	= (
-		binZ*heightUnit				#base bin height
-		- insideDepth
-		- wallThickness
-	)
+	:param addX: Extra wall thickness taken from the X side of the bin, eg. for a clear window
+	:param addY: Extra wall thickness taken from the Y side of the bin, eg. for a clear window
 
-	eachBinWidth	= widthAvail/divX
-	eachBinDepth	= depthAvail/divY
+	:return: A tuple of (cutter, list of (x, y, z) offsets)
+	"""
+	#sized by the calculator, so evaluateCatalog() checks the compartments which are built
+	widthAvail, depthAvail, heightAvail, eachBinWidth, eachBinDepth = compartmentSize(binX, binY, binZ, divX, divY, addX, addY)
 
 	cutterTemplate = (
 		binCutter(
@@ -419,25 +518,57 @@ def binCompartments(
 		))
 	)
 
-	cutList = []
-	for x in range(divX):
-		for y in range(divY):
-			cutList.append(
-				cutterTemplate
-				.translate((
-					x*(eachBinWidth+wallThickness),
-					y*(eachBinDepth+wallThickness),
-					0
-				))
-			)
-	for item in cutList:
-		returnBin = (
-			returnBin
-			.cut(item)
+	offsetList = [
+		(
+			x*(eachBinWidth+wallThickness)-addX/2,
+			y*(eachBinDepth+wallThickness)+addY/2,
+			0
 		)
+		for x in range(divX)
+		for y in range(divY)
+	]
+	return (cutterTemplate, offsetList)
+
+@staged
+@acceptsSpec
+@diskCached
+def binCompartments(
+		binX: float	= 1,
+		binY: float	= 1,
+		binZ: float	= 6,
+
+		divX: float	= 1,
+		divY: float	= 1,
+
+		scoop: float= 0,
+
+		tabStyle	= TabStyle.FULL,
+		tabAngle	= 60,
+
+		topStyle	= TopStyle.STACKING,
+		bottomStyle	= BottomStyle.MAGNET_ONLY,
+		bottomDivX	= 1,
+		bottomDivY	= 1,
+		):
+	if (divX < 1):
+		raise Exception("divX cannot be less than 1")
+	if (divY < 1):
+		raise Exception("divY cannot be less than 1")
+	returnBin = binSolid(binX, binY, binZ, topStyle, bottomStyle, bottomDivX, bottomDivY)
+
+	cutterInputs = (binX, binY, binZ, divX, divY, scoop, tabStyle, tabAngle)
+	with stage("cutter"):
+		cutterTemplate, offsetList = cachedStage("cutter", cutterInputs, lambda: compartmentCutters(*cutterInputs))
+	with stage("compartments") as compartmentStage:
+		stageInputs = cutterInputs + (topStyle, bottomStyle, bottomDivX, bottomDivY)
+		returnBin = cachedStage("compartments", stageInputs, lambda: tileCut(cutterTemplate, offsetList, returnBin))
+		compartmentStage.record(returnBin)
 
 	return returnBin
 
+@staged
+@acceptsSpec
+@diskCached
 def binClearWindow(
 		binX: float	= 1,
 		binY: float	= 1,
@@ -474,102 +605,53 @@ def binClearWindow(
 		whichBin	= binX
 		rotateAngle	= 90
 
-	#------------------------------------------
-	#  Almost all the same as binCompartments
-	#------------------------------------------
 	returnBin = binSolid(binX, binY, binZ, topStyle, bottomStyle, bottomDivX, bottomDivY)
 
-	widthAvail	= (
-		binX*gridUnit-tolerance*2	#base bin width
-		-wallThickness*2			#outside walls
-		-wallThickness*(divX-1)		#inside walls
-		-addX
-	)
-	depthAvail	= (
-		binY*gridUnit-tolerance*2	#base bin depth
-		-wallThickness*2			#outside walls
-		-wallThickness*(divY-1)		#inside walls
-		-addY
-	)
-	heightAvail	= (
-		binZ*heightUnit				#base bin height
-		- insideDepth
-		- wallThickness
-	)
-
-	eachBinWidth	= widthAvail/divX
-	eachBinDepth	= depthAvail/divY
-
-	cutterTemplate = (
-		binCutter(
-			binWidth	= eachBinWidth,
-			binDepth	= eachBinDepth,
-			binHeight	= heightAvail,
-			tabStyle	= tabStyle,
-			tabAngle	= tabAngle,
-			scoop		= scoop,
-		)
-		.translate((
-			(-widthAvail+eachBinWidth-wallThickness*(divX-1))/2,
-			(-depthAvail+eachBinDepth-wallThickness*(divY-1))/2,
-			heightAvail+wallThickness
-		))
-	)
+	cutterInputs = (binX, binY, binZ, divX, divY, scoop, tabStyle, tabAngle, addX, addY)
+	with stage("cutter"):
+		cutterTemplate, offsetList = cachedStage("cutter", cutterInputs, lambda: compartmentCutters(*cutterInputs))
+	with stage("compartments") as compartmentStage:
+		stageInputs = cutterInputs + (topStyle, bottomStyle, bottomDivX, bottomDivY)
+		compartments = cachedStage("compartments", stageInputs, lambda: tileCut(cutterTemplate, offsetList, returnBin))
+		compartmentStage.record(compartments)
 
-	cutList = []
-	for x in range(divX):
-		for y in range(divY):
-			cutList.append(
-				cutterTemplate
-				.translate((
-					x*(eachBinWidth+wallThickness)-addX/2,
-					y*(eachBinDepth+wallThickness)+addY/2,
-					0
-				))
-			)
-	for item in cutList:
-		returnBin = (
-			returnBin
-			.cut(item)
-		)
-	#------------------------------------------
 	if (clearDepth < 0):
 		raise Exception("binClearWindow only accepts clearDepth >= 0")
-	if clearWidth == 0:
-		if (clearSide.find("X")+1):
-			clearWidth = binX*gridUnit-tolerance*2-wallThickness*2-extFilletRadius*2
-		if (clearSide.find("Y")+1):
-			clearWidth = binY*gridUnit-tolerance*2-wallThickness*2-extFilletRadius*2
-	if clearHeight == 0:
-		clearHeight = binZ*heightUnit-insideDepth-wallThickness+tolerance*2
+	clearWidth, clearHeight = windowSize(binX, binY, binZ, clearSide, clearWidth, clearHeight)
 	print(  "Bin:       {:2d}x{:2d}x{:2d}\n".format(binX, binY, binZ) +
 			"   Window: {:2.0f}x{:2.0f}x{:2.0f}".format(clearWidth, clearHeight, clearDepth)
 			)
-	windowCutter = (
-		cq.Workplane("XY")
-		.box(clearWidth, clearDepth, clearHeight)
-		.faces("<Y")
-		.workplane()
-	)
-	windowCutter = roundedRect(clearWidth-wallThickness*2, clearHeight-wallThickness*2, extFilletRadius-wallThickness, windowCutter)
-	windowCutter = roundedRect(clearWidth, clearHeight, extFilletRadius, windowCutter.workplane(wallThickness))
-	windowCutter = (
-		windowCutter
-		.loft(True)
-		.translate((
-			0,
-			-whichBin/2*gridUnit+clearDepth-tolerance+wallThickness,
-			clearHeight/2+outsideBottom-tolerance*2
-			))
-		.rotate((0,0,0), (0,0,10), rotateAngle)
-	)
-	returnBin = (
-		returnBin
-		.cut(windowCutter)
-	)
+	def buildWindow():
+		windowCutter = (
+			cq.Workplane("XY")
+			.box(clearWidth, clearDepth, clearHeight)
+			.faces("<Y")
+			.workplane()
+		)
+		windowCutter = roundedRect(clearWidth-wallThickness*2, clearHeight-wallThickness*2, extFilletRadius-wallThickness, windowCutter)
+		windowCutter = roundedRect(clearWidth, clearHeight, extFilletRadius, windowCutter.workplane(wallThickness))
+		windowCutter = (
+			windowCutter
+			.loft(True)
+			.translate((
+				0,
+				-whichBin/2*gridUnit+clearDepth-tolerance+wallThickness,
+				clearHeight/2+outsideBottom-tolerance*2
+				))
+			.rotate((0,0,0), (0,0,10), rotateAngle)
+		)
+		return compartments.cut(windowCutter)
+
+	with stage("window") as windowStage:
+		stageInputs += (clearSide, clearDepth, clearWidth, clearHeight)
+		returnBin = cachedStage("window", stageInputs, buildWindow)
+		windowStage.record(returnBin)
 
 	return returnBin
 
+@staged
+@acceptsSpec
+@diskCached
 def trayClearWindow(
 		trayX: float= 1,
 		trayY: float= 1,
@@ -590,40 +672,39 @@ def trayClearWindow(
 	magClearance	= magnetDiameter/2 + wallThickness
 	alignmentMagicNumber = -0.45 #as the name implies, this is a magic number. where does it come from?> I haven't a goddamn clue.
 	windowHeight = alignmentMagicNumber-heightUnit-insideBottom+magnetDepth
-	clearCutter = (
-		returnTray
-		.transformed(offset=(0,0,windowHeight))
-		.rect(insertX+tolerance*4, insertY+tolerance*4)
-		.extrude(insertZ+tolerance*2, False)
-	)
-	windowCutter = (
-		clearCutter
-		.transformed(offset=(0,0,0))
-		.moveTo(-clearSectionX/2, 0)
-		.lineTo(-clearSectionX/2, -clearSectionY/2+magClearance)
-		.radiusArc((-clearSectionX/2+magClearance, -clearSectionY/2), magClearance)
-		.lineTo(0, -clearSectionY/2)
-		.mirrorX()
-		.mirrorY()
-		.extrude(trayZ*heightUnit*2, "a", both=True)
-	)
-	
-	cutList = []
-	for x in range(trayX):
-		for y in range(trayY):
-			cutList.append(
-				windowCutter
-				.translate((
-					(x - (trayX/2 - 0.5))*gridUnit,
-					(y - (trayY/2 - 0.5))*gridUnit,
-					0
-				))
-			)
+	with stage("window cutter"):
+		clearCutter = (
+			returnTray
+			.transformed(offset=(0,0,windowHeight))
+			.rect(insertX+tolerance*4, insertY+tolerance*4)
+			.extrude(insertZ+tolerance*2, False)
+		)
+		windowCutter = (
+			clearCutter
+			.transformed(offset=(0,0,0))
+			.moveTo(-clearSectionX/2, 0)
+			.lineTo(-clearSectionX/2, -clearSectionY/2+magClearance)
+			.radiusArc((-clearSectionX/2+magClearance, -clearSectionY/2), magClearance)
+			.lineTo(0, -clearSectionY/2)
+			.mirrorX()
+			.mirrorY()
+			.extrude(trayZ*heightUnit*2, "a", both=True)
+		)
 	
-	for item in cutList:
-		returnTray = returnTray.cut(item)
+	with stage("windows") as windowStage:
+		#one window per whole cell - a fractional tray has no room for an insert in its part cell
+		offsetList = [
+			offset
+			for offset in gridOffsets(trayX, trayY)
+			if (abs(offset[0])+gridUnit/2 <= trayX*gridUnit/2+tolerance and abs(offset[1])+gridUnit/2 <= trayY*gridUnit/2+tolerance)
+		]
+		returnTray = tileCut(windowCutter, offsetList, returnTray)
+		windowStage.record(returnTray)
 	return returnTray
 
+@staged
+@acceptsSpec
+@diskCached
 def trayAngleAdaptor(
 		topX: float	= 1,
 		trayY: float= 1,
@@ -657,120 +738,97 @@ def trayAngleAdaptor(
 	if (((gridUnit*bottomX)%trayXGrid) < topFaceX):
 		bottomX = bottomX + 1/bottomDivX
 		roundEdgeFlag = False
-	bottomTray	= binSolid(bottomX, trayY, 1, TopStyle.NONE_LOW, bottomStyle, bottomDivX, bottomDivY)
-
-	topPlate	= binSolid(1, trayY, 1, topStyle, BottomStyle.NONE)
-	topPlateRotationEdge = heightUnit-(insideTop+tolerance)/2
-	topPlateX	= gridUnit*(bottomX/2-0.5)
-	topPlateZ	= -outsideDepth+outsideTop/2+tolerance
-	#cutter for deleting sections below 0Z
-	negZBox		= (
-		cq.Workplane("XY")
-		.box(gridUnit*30, gridUnit*30, gridUnit*3)
-		.translate((0,0,-gridUnit*1.5))
-	)
-	#extrude below topplate to meet XY plane
-	topPlate	= (
-		roundedRect(
-			gridUnit-tolerance*2,
-			trayY*gridUnit-tolerance*2,
-			extFilletRadius,
-			topPlate
-			.faces("<Z")
-			.workplane()
-		)
-		.extrude(sin(angleRad)*trayXGrid)
-	)
-	#cutter for trimming to size of tray
-	traySizeCutter = (
-		cq.Workplane("XY", (0,0,0))
-		.rect(bottomX*gridUnit-tolerance*2, trayY*gridUnit-tolerance*2)
-		.extrude(50)
-		.edges("|Z")
-		.fillet(extFilletRadius)
-	)
-	#create topPlateCutter to clean up geometry on bottom faces
-	topPlateCutter = (
-		binSolid(1, trayY, 1, TopStyle.NONE, BottomStyle.NONE)
-		.cut(
-			topPlate
-		)
-		.faces("<Z[1]")
-		.workplane(0, True)
-		.rect(gridUnit, gridUnit*trayY)
-		.extrude(bottomTray.largestDimension())
-	)
-	topPlateCutter = (
-		topPlateCutter
-		.edges(">X or <X or >Y or <Y")
-		.edges("<Z")
-		.chamfer(tolerance*1)
-	)
-	#rotate and translate topPlate and topPlateCutter
-	topPlate			= (
-		topPlate
-		.rotate((gridUnit/2-tolerance, -5, topPlateRotationEdge), (gridUnit/2-tolerance, 5, topPlateRotationEdge), angleDeg)
-	)
-	topPlate			= (
-		roundedRect(gridUnit-tolerance*2, trayY*gridUnit-tolerance*2, extFilletRadius, topPlate)
-		.extrude(-extFilletRadius*3)
-		.translate((topPlateX,0,topPlateZ))
-		.cut(negZBox)
-		.intersect(traySizeCutter)
-	)
-	topPlateCutter		= (
-		topPlateCutter
-		.rotate((gridUnit/2-tolerance, -5, topPlateRotationEdge), (gridUnit/2-tolerance, 5, topPlateRotationEdge), angleDeg)
-		.translate((topPlateX,0,topPlateZ))
-	)
-	#tile in X
-	topConsol = cq.Workplane("XY")
-	for x in range(topX):
-		topPlateCutter = (
-			topPlateCutter
-			.add(
-				topPlateCutter
-				.translate((
-					-x*trayXGrid,
-					0,
-					0
-				))
-			)
+	with stage("angle plates"):
+		bottomTray	= binSolid(bottomX, trayY, 1, TopStyle.NONE_LOW, bottomStyle, bottomDivX, bottomDivY)
+
+		topPlate	= binSolid(1, trayY, 1, topStyle, BottomStyle.NONE)
+		topPlateRotationEdge = heightUnit-(insideTop+tolerance)/2
+		topPlateX	= gridUnit*(bottomX/2-0.5)
+		topPlateZ	= -outsideDepth+outsideTop/2+tolerance
+		#cutter for deleting sections below 0Z
+		negZBox		= (
+			cq.Workplane("XY")
+			.box(gridUnit*30, gridUnit*30, gridUnit*3)
+			.translate((0,0,-gridUnit*1.5))
 		)
-		topConsol = (
-			topConsol
-			.add(
+		#extrude below topplate to meet XY plane
+		topPlate	= (
+			roundedRect(
+				gridUnit-tolerance*2,
+				trayY*gridUnit-tolerance*2,
+				extFilletRadius,
 				topPlate
-				.translate((
-					-x*trayXGrid,
-					0,
-					0
-				))
+				.faces("<Z")
+				.workplane()
 			)
+			.extrude(sin(angleRad)*trayXGrid)
 		)
-	topPlateCutter	= topPlateCutter.combine()
-	topPlate		= (
-		topConsol
-		.combine()
-		.intersect(traySizeCutter)
-	)
-	roundEdgeFlag = True
-	if roundEdgeFlag:
-		try:
-			topPlate = (
-				topPlate
-				.edges("<X")
-				.edges(">Z")
-				.fillet(extFilletRadius)
-			)
-		except:
-			topPlate = (
+		#cutter for trimming to size of tray
+		traySizeCutter = (
+			cq.Workplane("XY", (0,0,0))
+			.rect(bottomX*gridUnit-tolerance*2, trayY*gridUnit-tolerance*2)
+			.extrude(50)
+			.edges("|Z")
+			.fillet(extFilletRadius)
+		)
+		#create topPlateCutter to clean up geometry on bottom faces
+		topPlateCutter = (
+			binSolid(1, trayY, 1, TopStyle.NONE, BottomStyle.NONE)
+			.cut(
 				topPlate
 			)
-	#smoosh it all together
-	bottomTray = (
-		bottomTray
-		.union(topPlate)
-		.cut(topPlateCutter)
-	)
+			.faces("<Z[1]")
+			.workplane(0, True)
+			.rect(gridUnit, gridUnit*trayY)
+			.extrude(bottomTray.largestDimension())
+		)
+		topPlateCutter = (
+			topPlateCutter
+			.edges(">X or <X or >Y or <Y")
+			.edges("<Z")
+			.chamfer(tolerance*1)
+		)
+		#rotate and translate topPlate and topPlateCutter
+		topPlate			= (
+			topPlate
+			.rotate((gridUnit/2-tolerance, -5, topPlateRotationEdge), (gridUnit/2-tolerance, 5, topPlateRotationEdge), angleDeg)
+		)
+		topPlate			= (
+			roundedRect(gridUnit-tolerance*2, trayY*gridUnit-tolerance*2, extFilletRadius, topPlate)
+			.extrude(-extFilletRadius*3)
+			.translate((topPlateX,0,topPlateZ))
+			.cut(negZBox)
+			.intersect(traySizeCutter)
+		)
+		topPlateCutter		= (
+			topPlateCutter
+			.rotate((gridUnit/2-tolerance, -5, topPlateRotationEdge), (gridUnit/2-tolerance, 5, topPlateRotationEdge), angleDeg)
+			.translate((topPlateX,0,topPlateZ))
+		)
+	with stage("angle tiling"):
+		#one copy of the plate and cutter per step, all sharing the geometry built above
+		offsetList = [(-x*trayXGrid, 0, 0) for x in range(topX)]
+		topPlate		= (
+			cq.Workplane("XY")
+			.newObject([topPlate.val().moved(cq.Location(cq.Vector(*offset))) for offset in offsetList])
+			.combine()
+			.intersect(traySizeCutter)
+		)
+	with stage("merge") as mergeStage:
+		roundEdgeFlag = True
+		if roundEdgeFlag:
+			try:
+				topPlate = (
+					topPlate
+					.edges("<X")
+					.edges(">Z")
+					.fillet(extFilletRadius)
+				)
+			except:
+				topPlate = (
+					topPlate
+				)
+		#smoosh it all together
+		bottomTray = tileCut(topPlateCutter, offsetList, bottomTray.union(topPlate))
+		mergeStage.record(bottomTray)
 	return bottomTray
\ No newline at end of file
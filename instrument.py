@@ -0,0 +1,229 @@
+from contextlib import contextmanager
+from functools import wraps
+import json
+import os
+import time
+
+from config import booleanOptions
+
+class Stage:
+	"""
+	Timing and boolean count for one named stage of a build
+	"""
+	def __init__(self, name, depth=0):
+		self.name		= name
+		self.depth		= depth
+		self.start		= time.perf_counter()
+		self.end		= None
+		self.booleans	= 0
+		self.faces		= None
+		self.edges		= None
+
+	@property
+	def duration(self):
+		"""
+		:return: Seconds the stage took, or None if it is still running
+		"""
+		if self.end is None:
+			return None
+		return self.end - self.start
+
+	def record(self, result):
+		"""
+		Record the complexity of the shape a stage produced
+
+		:param result: The cq.Workplane or cq.Shape built by the stage
+		"""
+		shape = result.val() if hasattr(result, "val") else result
+		if hasattr(shape, "Faces"):
+			self.faces = len(shape.Faces())
+			self.edges = len(shape.Edges())
+
+	def toDict(self):
+		"""
+		:return: The stage as a dict, for JSON export
+		"""
+		return {
+			"name":		self.name,
+			"depth":	self.depth,
+			"start":	self.start,
+			"duration":	self.duration,
+			"booleans":	self.booleans,
+			"faces":	self.faces,
+			"edges":	self.edges,
+		}
+
+class NullStage:
+	"""
+	Stand-in yielded by stage() when nothing is listening, so recording costs nothing
+	"""
+	def record(self, result):
+		pass
+
+class Trace:
+	"""
+	Every stage run while the trace was active
+	"""
+	def __init__(self, name = "part"):
+		self.name		= name
+		self.start		= time.perf_counter()
+		self.stages		= []
+		self.booleans	= 0
+
+	def toDict(self):
+		"""
+		:return: The trace as a dict, for JSON export
+		"""
+		return {
+			"name":		self.name,
+			"booleans":	self.booleans,
+			"stages":	[stage.toDict() for stage in self.stages],
+		}
+
+	def toChromeTrace(self):
+		"""
+		:return: The trace in Chrome trace event format, as viewed in chrome://tracing or Perfetto
+		"""
+		events = []
+		for stage in self.stages:
+			if stage.end is None:
+				continue
+			events.append({
+				"name":	stage.name,
+				"cat":	self.name,
+				"ph":	"X",
+				"ts":	(stage.start-self.start)*1e6,
+				"dur":	stage.duration*1e6,
+				"pid":	os.getpid(),
+				"tid":	0,
+				"args":	{
+					"booleans":	stage.booleans,
+					"faces":	stage.faces,
+					"edges":	stage.edges,
+				},
+			})
+		return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+	def save(self, path, format = "chrome"):
+		"""
+		Write the trace to a file
+
+		:param path: File to write
+		:param format: "chrome" for Chrome trace event format, or "json" for toDict()
+		"""
+		match format:
+			case "chrome":
+				data = self.toChromeTrace()
+			case "json":
+				data = self.toDict()
+			case _:
+				raise ValueError("Unknown trace format {!r}".format(format))
+		with open(path, "w") as f:
+			json.dump(data, f, indent=1)
+
+activeTraces	= []
+openStages		= []
+stageListeners	= []
+patchedBooleans	= {}
+
+def addStageListener(callback):
+	"""
+	Register a function to be called as callback(event, stage) whenever a stage starts ("start") or ends ("end")
+	"""
+	stageListeners.append(callback)
+
+def removeStageListener(callback):
+	"""
+	Stop calling a function registered with addStageListener()
+	"""
+	stageListeners.remove(callback)
+
+def countBoolean():
+	"""
+	Count one OCCT boolean against the active traces and every open stage, so stages include their nested stages
+	"""
+	for activeTrace in activeTraces:
+		activeTrace.booleans += 1
+	for openStage in openStages:
+		openStage.booleans += 1
+
+def patchBooleans():
+	"""
+	Wrap the cadquery boolean helper so each OCCT boolean is counted.
+	Every fuse, cut and intersect - including the ones inside extrude() and combine() - goes through it.
+	"""
+	import cadquery as cq
+	original = cq.Shape._bool_op
+	patchedBooleans["_bool_op"] = original
+
+	def counted(*args, **kwargs):
+		countBoolean()
+		return original(*args, **kwargs)
+	cq.Shape._bool_op = counted
+
+def unpatchBooleans():
+	"""
+	Undo patchBooleans()
+	"""
+	import cadquery as cq
+	for name, original in patchedBooleans.items():
+		setattr(cq.Shape, name, original)
+	patchedBooleans.clear()
+
+@contextmanager
+def trace(name = "part"):
+	"""
+	Record every stage and boolean run inside the with block
+
+	:param name: Name for the trace, eg. the part being built
+
+	:return: The Trace, which fills in as the block runs
+	"""
+	newTrace = Trace(name)
+	if not activeTraces:
+		patchBooleans()
+	activeTraces.append(newTrace)
+	try:
+		yield newTrace
+	finally:
+		activeTraces.remove(newTrace)
+		if not activeTraces:
+			unpatchBooleans()
+
+@contextmanager
+def stage(name):
+	"""
+	Mark a named stage of a build. Does nothing unless a trace or stage listener is active.
+
+	:param name: Name of the stage
+
+	:return: The Stage, or a NullStage if nothing is listening
+	"""
+	if not activeTraces and not stageListeners:
+		yield NullStage()
+		return
+	newStage = Stage(name, len(openStages))
+	for activeTrace in activeTraces:
+		activeTrace.stages.append(newStage)
+	openStages.append(newStage)
+	for callback in stageListeners:
+		callback("start", newStage)
+	try:
+		yield newStage
+	finally:
+		newStage.end = time.perf_counter()
+		openStages.remove(newStage)
+		for callback in stageListeners:
+			callback("end", newStage)
+
+def staged(generator):
+	"""
+	Decorator which runs the whole generator as a stage named after it, with config applied to its booleans
+	"""
+	@wraps(generator)
+	def wrapper(*args, **kwargs):
+		with booleanOptions(), stage(generator.__name__) as generatorStage:
+			result = generator(*args, **kwargs)
+			generatorStage.record(result)
+			return result
+	return wrapper
@@ -0,0 +1,119 @@
+from collections import namedtuple
+
+from standards import *
+from specs import Spec, PlateSpec, makeSpec, uniqueSpecs
+
+#x and y place the -X/-Y corner of the bin, in gridfinity units from the -X/-Y corner of the drawer
+#rotate turns the bin 90 degrees, swapping its footprint
+BinPlacement = namedtuple("BinPlacement", ["spec", "x", "y", "rotate"], defaults=[False])
+
+#quantity counts every placement of spec, dimensions is spec.dimensions()
+BillItem = namedtuple("BillItem", ["spec", "quantity", "dimensions"])
+
+DrawerLayout = namedtuple("DrawerLayout", ["assembly", "bom"])
+
+def footprint(spec, rotate = False):
+	"""
+	:param spec: A BinSpec or TraySpec
+	:param rotate: Whether the part is turned 90 degrees
+
+	:return: The (x, y) size of the part, in gridfinity units
+	"""
+	dimensions = spec.dimensions()
+	size = (
+		(dimensions["width"]+tolerance*2)/gridUnit,
+		(dimensions["depth"]+tolerance*2)/gridUnit,
+	)
+	if rotate:
+		return size[::-1]
+	return size
+
+def checkPlacements(drawerX, drawerY, placements):
+	"""
+	Make sure every bin fits in the drawer, and none of them overlap
+
+	:param drawerX: X dimension of the drawer, in gridfinity units
+	:param drawerY: Y dimension of the drawer, in gridfinity units
+	:param placements: List of BinPlacement
+
+	:return: A list of (xMin, yMin, xMax, yMax) per placement, in gridfinity units
+	"""
+	#tolerance for sizes worked out in mm
+	epsilon = 1e-6
+	boxes = []
+	for index, placement in enumerate(placements):
+		sizeX, sizeY = footprint(placement.spec, placement.rotate)
+		box = (placement.x, placement.y, placement.x+sizeX, placement.y+sizeY)
+		if (box[0] < -epsilon or box[1] < -epsilon or box[2] > drawerX+epsilon or box[3] > drawerY+epsilon):
+			raise ValueError("Bin {} at ({}, {}) does not fit in a {}x{} drawer".format(index, placement.x, placement.y, drawerX, drawerY))
+		for other, otherBox in enumerate(boxes):
+			if (box[0] < otherBox[2]-epsilon and otherBox[0] < box[2]-epsilon
+			and box[1] < otherBox[3]-epsilon and otherBox[1] < box[3]-epsilon):
+				raise ValueError("Bin {} at ({}, {}) overlaps bin {}".format(index, placement.x, placement.y, other))
+		boxes.append(box)
+	return boxes
+
+def drawerLayout(
+		drawerX		= 3,
+		drawerY		= 3,
+		placements	= (),
+		plateZ		= None,
+		plateStyle	= PlateStyle.MAGNET_ONLY,
+		maxWorkers	= None,
+		):
+	"""
+	Generate a drawer full of bins as an assembly.
+	The baseplate and each distinct bin are built exactly once, across a pool of worker processes, then every placement refers to the same part.
+
+	:param drawerX: X dimension of the drawer, in gridfinity units. The baseplate rounds up to the next int.
+	:param drawerY: Y dimension of the drawer, in gridfinity units. The baseplate rounds up to the next int.
+	:param placements: List of BinPlacement, or (spec, x, y[, rotate]) tuples where spec is a BinSpec/TraySpec or a dict for makeSpec()
+	:param plateZ: Z height of the baseplate, in mm. If this is None (default), then it will automatically calculate the minimum for the specified base style
+	:param plateStyle: Style of the baseplate - PlateStyle.(BARE|MAGNET_ONLY|SCREW_ONLY|MAGNET_SCREW)
+	:param maxWorkers: Number of worker processes. Defaults to the number of CPUs
+
+	:return: A DrawerLayout of the cq.Assembly and its bill of materials - the baseplate first, then each distinct bin in order of first placement
+	"""
+	import cadquery as cq
+	from batch import generateBatch
+	from cache import shapeFromBytes
+	if (drawerX <= 0):
+		raise ValueError("drawerX cannot be less than 0")
+	if (drawerY <= 0):
+		raise ValueError("drawerY cannot be less than 0")
+	placements = [BinPlacement(*placement) for placement in placements]
+	placements = [
+		placement if isinstance(placement.spec, Spec) else placement._replace(spec=makeSpec(**placement.spec))
+		for placement in placements
+	]
+	boxes = checkPlacements(drawerX, drawerY, placements)
+
+	plate = PlateSpec(plateX=drawerX, plateY=drawerY, plateZ=plateZ, plateStyle=plateStyle)
+	distinctSpecs, positions = uniqueSpecs([plate] + [placement.spec for placement in placements])
+	parts = [None]*len(distinctSpecs)
+	errors = []
+	for result in generateBatch(distinctSpecs, maxWorkers=maxWorkers):
+		if result.error:
+			errors.append("{}: {}".format(result.spec, result.error))
+		else:
+			parts[result.index] = cq.Workplane("XY").newObject([shapeFromBytes(result.data)])
+	if errors:
+		raise ValueError("Could not build the drawer\n" + "\n".join(errors))
+
+	assembly = cq.Assembly(parts[0], name="baseplate")
+	#baseplate() centres the drawer on the origin
+	cornerX = -drawerX/2*gridUnit
+	cornerY = -drawerY/2*gridUnit
+	for index, (placement, box, position) in enumerate(zip(placements, boxes, positions[1:])):
+		location = cq.Location(
+			cq.Vector(cornerX+(box[0]+box[2])/2*gridUnit, cornerY+(box[1]+box[3])/2*gridUnit, 0),
+			cq.Vector(0, 0, 1),
+			90 if placement.rotate else 0,
+		)
+		assembly.add(parts[position], name="bin_{}".format(index), loc=location)
+
+	bom = [
+		BillItem(spec, positions.count(position), spec.dimensions())
+		for position, spec in enumerate(distinctSpecs)
+	]
+	return DrawerLayout(assembly, bom)
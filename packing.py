@@ -0,0 +1,163 @@
+from collections import namedtuple
+
+from specs import Spec, BinSpec, uniqueSpecs
+
+#x and y are the -X/-Y corner of the footprint on the bed, in mm. width and depth are after rotation
+PackedPart = namedtuple("PackedPart", ["index", "x", "y", "width", "depth", "rotated"])
+
+#parts lists the PackedPart on the bed
+Bed = namedtuple("Bed", ["index", "parts"])
+
+def partFootprint(part):
+	"""
+	:param part: A spec, a cq.Workplane or cq.Shape, or a (width, depth) tuple in mm
+
+	:return: The (width, depth) of the part on the print bed, in mm
+	"""
+	if isinstance(part, Spec):
+		dimensions = part.dimensions()
+		return (dimensions["width"], dimensions["depth"])
+	if isinstance(part, tuple):
+		return part
+	from export import exportShape
+	box = exportShape(part).BoundingBox()
+	return (box.xlen, box.ylen)
+
+def partFootprints(parts):
+	"""
+	Find the footprint of every part, working out all the bins together in one calculator.evaluateCatalog() call
+
+	:param parts: List of specs, cq.Workplane/cq.Shape, or (width, depth) tuples in mm
+
+	:return: A list of (width, depth) in mm
+	"""
+	from calculator import evaluateCatalog
+	footprints = [None]*len(parts)
+	binPositions = [position for position, part in enumerate(parts) if isinstance(part, BinSpec)]
+	if binPositions:
+		checked = evaluateCatalog([parts[position] for position in binPositions])
+		for position, width, depth in zip(binPositions, checked["width"], checked["depth"]):
+			footprints[position] = (float(width), float(depth))
+	for position, part in enumerate(parts):
+		if footprints[position] is None:
+			footprints[position] = partFootprint(part)
+	return footprints
+
+def packBeds(
+		parts,
+		bedX: float		= 220,
+		bedY: float		= 220,
+		spacing: float	= 2,
+		):
+	"""
+	Arrange parts on as few print beds as possible, with first fit decreasing height shelf packing.
+	Only footprints are used, so nothing is built.
+
+	Parts are laid along shelves the width of the bed, tallest first, each
+	turned so its long side runs along X where it fits. A part goes on the
+	first shelf of any bed with room for it, otherwise a new shelf is
+	started, on a new bed if needed.
+
+	:param parts: List of specs, cq.Workplane/cq.Shape, or (width, depth) tuples in mm
+	:param bedX: X dimension of the print bed, in mm
+	:param bedY: Y dimension of the print bed, in mm
+	:param spacing: Gap left between parts, in mm
+
+	:return: A list of Bed
+	"""
+	#each part carries the spacing on its +X/+Y sides, which the bed gets too so parts can touch its far edges
+	roomX = bedX+spacing
+	roomY = bedY+spacing
+	sizes = []
+	for index, (width, depth) in enumerate(partFootprints(parts)):
+		rotated = depth > width
+		if rotated:
+			width, depth = depth, width
+		if (width+spacing > roomX):
+			#too long to lie along X, so stand it along Y
+			width, depth, rotated = depth, width, not rotated
+		if (width+spacing > roomX or depth+spacing > roomY):
+			raise ValueError("Part {} of {:.1f}x{:.1f}mm does not fit on a {:.0f}x{:.0f}mm bed".format(index, width, depth, bedX, bedY))
+		sizes.append((depth, width, index, rotated))
+	sizes.sort(key=lambda size: (-size[0], -size[1], size[2]))
+
+	#shelves are [bed, y, height, used width]
+	shelves = []
+	bedHeights = []
+	beds = []
+	for depth, width, index, rotated in sizes:
+		for shelf in shelves:
+			if (shelf[3]+width+spacing <= roomX and depth+spacing <= shelf[2]):
+				break
+		else:
+			for bed, used in enumerate(bedHeights):
+				if (used+depth+spacing <= roomY):
+					break
+			else:
+				bed = len(bedHeights)
+				bedHeights.append(0)
+				beds.append(Bed(bed, []))
+			shelf = [bed, bedHeights[bed], depth+spacing, 0]
+			bedHeights[bed] += depth+spacing
+			shelves.append(shelf)
+		beds[shelf[0]].parts.append(PackedPart(index, shelf[3], shelf[1], width, depth, rotated))
+		shelf[3] += width+spacing
+	return beds
+
+def bedShape(parts, bed):
+	"""
+	Place the parts packed onto one bed
+
+	:param parts: The list of parts given to packBeds(), as cq.Workplane or cq.Shape
+	:param bed: One Bed from packBeds()
+
+	:return: A cq.Compound of the placed parts, with every part resting on Z = 0
+	"""
+	import cadquery as cq
+	from export import exportShape
+	placed = []
+	for packed in bed.parts:
+		#locations rather than transformed copies, so repeated parts keep sharing their geometry
+		shape = exportShape(parts[packed.index])
+		box = shape.BoundingBox()
+		xMin, yMin = box.xmin, box.ymin
+		rotation = cq.Location()
+		if packed.rotated:
+			#turning 90 degrees about Z takes (x, y) to (-y, x)
+			xMin, yMin = -box.ymax, box.xmin
+			rotation = cq.Location(cq.Vector(), cq.Vector(0, 0, 1), 90)
+		translation = cq.Location(cq.Vector(packed.x-xMin, packed.y-yMin, -box.zmin))
+		placed.append(shape.moved(translation*rotation))
+	return cq.Compound.makeCompound(placed)
+
+def exportBeds(
+		parts,
+		beds,
+		fileName,
+		exportType			= None,
+		tolerance			= 0.1,
+		angularTolerance	= 0.1,
+		):
+	"""
+	Write one combined mesh per print bed
+
+	:param parts: The list of parts given to packBeds(). Specs are built, each distinct one once
+	:param beds: The list of Bed from packBeds()
+	:param fileName: Name for the files, with {} standing for the bed number, eg. "bed{}.3mf"
+	:param exportType: "STL" or "3MF". Defaults to the file extension
+	:param tolerance: Linear deflection, in mm
+	:param angularTolerance: Angular deflection, in radians
+
+	:return: A list of ExportReport, one per bed
+	"""
+	from export import exportMesh
+	parts = list(parts)
+	specPositions = [position for position, part in enumerate(parts) if isinstance(part, Spec)]
+	distinctSpecs, positions = uniqueSpecs([parts[position] for position in specPositions])
+	built = [spec.build() for spec in distinctSpecs]
+	for position, distinct in zip(specPositions, positions):
+		parts[position] = built[distinct]
+	return [
+		exportMesh(bedShape(parts, bed), fileName.format(bed.index), exportType, tolerance, angularTolerance)
+		for bed in beds
+	]
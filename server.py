@@ -0,0 +1,249 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+import tempfile
+import threading
+import traceback
+
+from cache import LRUCache
+from specs import makeSpec
+
+#media type of each output format
+contentTypes = {
+	"stl":	"model/stl",
+	"step":	"model/step",
+	"3mf":	"model/3mf",
+}
+
+def warmWorker():
+	"""
+	Import the generators once per worker process, so no request pays for loading cadquery
+	"""
+	import gen_bin
+
+def renderPart(
+		spec,
+		format				= "stl",
+		tolerance			= 0.1,
+		angularTolerance	= 0.1,
+		):
+	"""
+	Build a part and export it. Runs inside the worker processes of PartService.
+
+	:param spec: A BinSpec, TraySpec or PlateSpec
+	:param format: "stl", "step" or "3mf"
+	:param tolerance: Linear deflection for meshed formats, in mm
+	:param angularTolerance: Angular deflection for meshed formats, in radians
+
+	:return: The exported file, as bytes
+	"""
+	import cadquery as cq
+	from export import exportMesh
+	part = spec.build()
+	handle, path = tempfile.mkstemp(suffix="."+format)
+	os.close(handle)
+	try:
+		if (format == "step"):
+			cq.exporters.export(part, path, "STEP")
+		else:
+			exportMesh(part, path, format.upper(), tolerance, angularTolerance)
+		with open(path, "rb") as f:
+			return f.read()
+	finally:
+		os.remove(path)
+
+class PartService:
+	"""
+	Builds parts on a pool of warm worker processes, keeping the exported files in an LRU cache.
+	Identical requests which arrive while the part is being built wait for that build instead of starting their own.
+	"""
+	def __init__(
+			self,
+			maxWorkers	= None,
+			cacheSize	= 256,
+			):
+		"""
+		:param maxWorkers: Number of worker processes. Defaults to the number of CPUs
+		:param cacheSize: Number of exported files kept in memory
+		"""
+		self.maxWorkers	= maxWorkers
+		self.pool		= ProcessPoolExecutor(maxWorkers, initializer=warmWorker)
+		self.results	= LRUCache(cacheSize)
+		self.inFlight	= {}
+		self.coalesced	= 0
+		#reentrant, as a build which is already done runs finished() inside add_done_callback()
+		self.lock		= threading.RLock()
+
+	def render(
+			self,
+			spec,
+			format				= "stl",
+			tolerance			= 0.1,
+			angularTolerance	= 0.1,
+			):
+		"""
+		Return an exported part, from the cache, from a build already running, or from a new build
+
+		:param spec: A BinSpec, TraySpec or PlateSpec
+		:param format: "stl", "step" or "3mf"
+		:param tolerance: Linear deflection for meshed formats, in mm
+		:param angularTolerance: Angular deflection for meshed formats, in radians
+
+		A worker crashing breaks the pool, failing every build running on it. Those builds are tried once more
+		on a fresh pool, so only a request whose own build crashes it again fails.
+
+		:return: A tuple of (file bytes, "hit", "coalesced" or "miss")
+		"""
+		if format not in contentTypes:
+			raise ValueError("format must be one of {}".format(", ".join(contentTypes)))
+		key = (spec, format, float(tolerance), float(angularTolerance))
+		for attempt in range(2):
+			with self.lock:
+				if key in self.results.entries:
+					return (self.results.get(key, None), "hit")
+				future = self.inFlight.get(key)
+				#a build on a broken pool may not have run finished() yet
+				if future is not None and not future.done():
+					self.coalesced += 1
+					source = "coalesced"
+				else:
+					future = self.submit(renderPart, spec, format, tolerance, angularTolerance)
+					self.inFlight[key] = future
+					future.add_done_callback(lambda done: self.finished(key, done))
+					source = "miss"
+			try:
+				return (future.result(), source)
+			except BrokenProcessPool:
+				if attempt:
+					raise
+
+	def submit(self, *args):
+		"""
+		Submit a call to the pool, replacing the pool first if a crashed worker has broken it. Call with the lock held.
+
+		:return: The future for the call
+		"""
+		try:
+			return self.pool.submit(*args)
+		except BrokenProcessPool:
+			self.pool.shutdown(wait=False)
+			self.pool = ProcessPoolExecutor(self.maxWorkers, initializer=warmWorker)
+			return self.pool.submit(*args)
+
+	def finished(self, key, future):
+		"""
+		Move a finished build from inFlight into the cache. Failed builds are not cached, so they are retried.
+		"""
+		with self.lock:
+			if self.inFlight.get(key) is future:
+				del self.inFlight[key]
+			if future.exception() is None:
+				self.results.get(key, future.result)
+
+	def info(self):
+		"""
+		:return: A dict of the cache info, plus the number of builds running and requests coalesced
+		"""
+		with self.lock:
+			return dict(self.results.info(), building=len(self.inFlight), coalesced=self.coalesced)
+
+	def close(self):
+		"""
+		Stop the worker processes
+		"""
+		self.pool.shutdown(cancel_futures=True)
+
+class PartRequestHandler(BaseHTTPRequestHandler):
+	"""
+	POST /part with a JSON object of the generator name under "generator" and its keyword arguments, plus optional
+	"format", "tolerance" and "angularTolerance". GET /stats returns PartService.info().
+	"""
+	def do_GET(self):
+		if (self.path == "/stats"):
+			self.reply(200, json.dumps(self.server.service.info()).encode(), "application/json")
+		else:
+			self.reply(404, b"Not found\n")
+
+	def do_POST(self):
+		if (self.path != "/part"):
+			self.reply(404, b"Not found\n")
+			return
+		try:
+			arguments = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+			format				= arguments.pop("format", "stl").lower()
+			tolerance			= arguments.pop("tolerance", 0.1)
+			angularTolerance	= arguments.pop("angularTolerance", 0.1)
+			spec = makeSpec(**arguments)
+		except Exception as e:
+			self.reply(400, "{}\n".format(e).encode())
+			return
+		try:
+			data, source = self.server.service.render(spec, format, tolerance, angularTolerance)
+		except ValueError as e:
+			self.reply(400, "{}\n".format(e).encode())
+			return
+		except Exception:
+			self.reply(500, traceback.format_exc().encode())
+			return
+		self.reply(200, data, contentTypes[format], {"X-Cache": source})
+
+	def reply(self, status, body, contentType = "text/plain", headers = {}):
+		"""
+		Send a complete response
+		"""
+		self.send_response(status)
+		self.send_header("Content-Type", contentType)
+		self.send_header("Content-Length", str(len(body)))
+		for name, value in headers.items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		#keep quiet unless asked, every build already reports its own progress
+		if self.server.verbose:
+			super().log_message(format, *args)
+
+def makeServer(
+		host		= "127.0.0.1",
+		port		= 8321,
+		maxWorkers	= None,
+		cacheSize	= 256,
+		verbose		= False,
+		):
+	"""
+	Create the HTTP server, with its PartService. Call serve_forever() on the result to run it.
+
+	:param host: Address to listen on
+	:param port: Port to listen on, 0 for any free port
+	:param maxWorkers: Number of worker processes. Defaults to the number of CPUs
+	:param cacheSize: Number of exported files kept in memory
+	:param verbose: Log every request to stderr
+
+	:return: The ThreadingHTTPServer
+	"""
+	server = ThreadingHTTPServer((host, port), PartRequestHandler)
+	server.service = PartService(maxWorkers, cacheSize)
+	server.verbose = verbose
+	return server
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Serve gridfinity parts over HTTP")
+	parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+	parser.add_argument("--port", type=int, default=8321, help="port to listen on")
+	parser.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+	parser.add_argument("--cache-size", type=int, default=256, help="number of exported parts kept in memory")
+	parser.add_argument("--verbose", action="store_true", help="log every request")
+	args = parser.parse_args()
+	server = makeServer(args.host, args.port, args.workers, args.cache_size, args.verbose)
+	print("Serving on http://{}:{}".format(*server.server_address))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.service.close()
+		server.server_close()
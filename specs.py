@@ -0,0 +1,362 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, fields, KW_ONLY
+from functools import wraps
+from math import floor, ceil, cos, atan
+import inspect
+
+from standards import *
+
+def resolveBottomDivisions(
+		binX: float	= 1,
+		binY: float	= 1,
+		bottomDivX	= 1,
+		bottomDivY	= 1,
+		):
+	"""
+	Check the requested bottom subdivisions are printable, and calculate any left as None
+
+	:param binX: X dimension of the bin, in gridfinity units
+	:param binY: Y dimension of the bin, in gridfinity units
+	:param bottomDivX: Divisions per gridfinity unit in X, or None to calculate from binX
+	:param bottomDivY: Divisions per gridfinity unit in Y, or None to calculate from binY
+
+	:return: A tuple of (bottomDivX, bottomDivY)
+	"""
+	#exact arithmetic shared with calculator.evaluateCatalog(), so validated catalogs build the same bottoms
+	from calculator import RationalArray, resolveDivisions
+	resolved = []
+	for axis, size, divisions in (("X", binX, bottomDivX), ("Y", binY, bottomDivY)):
+		if (divisions is not None and divisions <= 0):
+			raise Exception("bottomDiv{} cannot be less than 0".format(axis))
+		divisions, widths, tooBig, indivisible = resolveDivisions(RationalArray.fromValues([size]), [divisions], axis)
+		if tooBig[0]:
+			raise Exception("bottomDiv{} of {:.2f} is too big - would result in hard to print features of {:.2f}mm".format(axis, divisions.toFloat()[0], widths.toFloat()[0]))
+		if indivisible[0]:
+			raise Exception("bin{} of {:.2f} is too close to a whole number to divide the bottom".format(axis, size))
+		resolved.append(canonicalNumber(float(divisions.toFloat()[0])))
+	return tuple(resolved)
+
+def binTopHeight(
+		binZ: float	= 6,
+		topStyle	= TopStyle.STACKING,
+		):
+	"""
+	:return: Height of the top of a bin above the XY plane, in mm, matching what binSolid() builds
+	"""
+	binHeight = binZ*heightUnit
+	match topStyle:
+		case TopStyle.STACKING:
+			return binHeight-outsideTop/2
+		case TopStyle.NONE_LOW:
+			return binHeight-outsideDepth
+		case TopStyle.INT_DIV | TopStyle.INT_DIV_MAG:
+			return binHeight-outsideTop/2-tolerance
+	return binHeight
+
+def binBottomDepth(bottomStyle = BottomStyle.MAGNET_ONLY):
+	"""
+	:return: How far the interlock of a bin reaches below the XY plane, in mm
+	"""
+	if (bottomStyle is BottomStyle.NONE):
+		return 0
+	return insideDepth
+
+def plateHeight(plateStyle = PlateStyle.MAGNET_ONLY):
+	"""
+	:return: The default height of a baseplate in mm - the minimum for its style
+	"""
+	plateZ = outsideDepth
+	if (plateStyle is not PlateStyle.BARE):
+		plateZ += magnetDepth+wallThickness
+	return plateZ
+
+def canonicalNumber(value):
+	"""
+	:return: value as an int if it is a whole number, so 1 and 1.0 are spelled the same
+	"""
+	if isinstance(value, float) and value.is_integer():
+		return int(value)
+	return value
+
+class Spec(ABC):
+	"""
+	Shared behaviour of the spec types. Subclasses are frozen, slotted dataclasses whose fields are generator arguments.
+	Only the generator name can be passed positionally, so a misplaced argument is a TypeError rather than a different part.
+	"""
+	__slots__ = ()
+
+	def normalize(self, **defaults):
+		"""
+		Store canonical values, resetting any fields in defaults which the generator would ignore
+		"""
+		for field in fields(self):
+			value = defaults.get(field.name, getattr(self, field.name))
+			object.__setattr__(self, field.name, canonicalNumber(value))
+
+	def arguments(self, generator = None):
+		"""
+		:param generator: Generator to collect arguments for. Defaults to the spec's own generator
+
+		:return: A dict of the keyword arguments the generator accepts
+		"""
+		if generator is None:
+			generator = generatorFunction(self.generator)
+		accepted = inspect.signature(generator).parameters
+		return {
+			field.name: getattr(self, field.name)
+			for field in fields(self)
+			if field.name in accepted
+		}
+
+	@abstractmethod
+	def dimensions(self):
+		"""
+		Work out the size of the part without building it, or importing cadquery
+
+		:return: A dict of sizes in mm
+		"""
+
+	def build(self):
+		"""
+		:return: The part, built by the spec's generator
+		"""
+		generator = generatorFunction(self.generator)
+		return generator(**self.arguments(generator))
+
+@dataclass(frozen=True, slots=True)
+class BinSpec(Spec):
+	"""
+	Arguments for binSolid(), binCompartments() or binClearWindow()
+	"""
+	generator: str		= "binCompartments"
+	_: KW_ONLY
+
+	binX: float			= 1
+	binY: float			= 1
+	binZ: float			= 6
+
+	divX: int			= 1
+	divY: int			= 1
+
+	scoop: float		= 0
+
+	tabStyle: TabStyle	= TabStyle.FULL
+	tabAngle: float		= 60
+
+	topStyle: TopStyle	= TopStyle.STACKING
+	bottomStyle: BottomStyle = BottomStyle.MAGNET_ONLY
+	bottomDivX: float	= 1
+	bottomDivY: float	= 1
+
+	clearSide: str		= "X"
+	clearDepth: float	= 1
+	clearWidth: float	= 0
+	clearHeight: float	= 0
+
+	def __post_init__(self):
+		if self.generator not in ("binSolid", "binCompartments", "binClearWindow"):
+			raise ValueError("BinSpec cannot build {!r}".format(self.generator))
+		defaults = {}
+		if (self.bottomStyle is BottomStyle.NONE):
+			defaults.update(bottomDivX=1, bottomDivY=1)
+		else:
+			bottomDivX, bottomDivY = resolveBottomDivisions(self.binX, self.binY, self.bottomDivX, self.bottomDivY)
+			defaults.update(bottomDivX=bottomDivX, bottomDivY=bottomDivY)
+		if (self.tabStyle is TabStyle.NONE):
+			defaults.update(tabAngle=60)
+		if (self.generator == "binSolid"):
+			defaults.update(divX=1, divY=1, scoop=0, tabStyle=TabStyle.FULL, tabAngle=60)
+		if (self.generator != "binClearWindow"):
+			defaults.update(clearSide="X", clearDepth=1, clearWidth=0, clearHeight=0)
+		self.normalize(**defaults)
+
+	def dimensions(self):
+		"""
+		:return: A dict of the outer width, depth and height, plus the size of each compartment and the window where the generator makes them
+
+		:raises ValueError: If the calculator rejects the bin, eg. compartments too small to build
+		"""
+		from calculator import evaluateCatalog
+		names = ["width", "depth", "height"]
+		if (self.generator != "binSolid"):
+			names += ["compartmentWidth", "compartmentDepth", "compartmentHeight"]
+		if (self.generator == "binClearWindow"):
+			names += ["windowWidth", "windowHeight", "windowDepth"]
+		checked = evaluateCatalog([self])
+		if not checked["valid"][0]:
+			raise ValueError("; ".join(checked["errors"][0]))
+		return {name: float(checked[name][0]) for name in names}
+
+@dataclass(frozen=True, slots=True)
+class TraySpec(Spec):
+	"""
+	Arguments for trayClearWindow() or trayAngleAdaptor()
+	"""
+	generator: str		= "trayClearWindow"
+	_: KW_ONLY
+
+	trayX: float		= 1
+	trayY: float		= 1
+	trayZ: float		= 1
+
+	insertX: float		= gridUnit-magnetOffset
+	insertY: float		= gridUnit-magnetOffset
+	insertZ: float		= 1
+
+	topX: float			= 1
+	angleDeg: float		= None
+	binHeight: float	= 3
+
+	topStyle: TopStyle	= TopStyle.INT_DIV_MAG
+	bottomStyle: BottomStyle = BottomStyle.MAGNET_ONLY
+	bottomDivX: float	= 1
+	bottomDivY: float	= 1
+
+	def __post_init__(self):
+		defaults = {}
+		match self.generator:
+			case "trayClearWindow":
+				defaults.update(topX=1, angleDeg=None, binHeight=3)
+			case "trayAngleAdaptor":
+				defaults.update(trayX=1, trayZ=1, insertX=gridUnit-magnetOffset, insertY=gridUnit-magnetOffset, insertZ=1)
+			case _:
+				raise ValueError("TraySpec cannot build {!r}".format(self.generator))
+		self.normalize(**defaults)
+
+	def dimensions(self):
+		"""
+		:return: A dict of the outer width, depth and height. The angle adaptor reports its footprint, angle and bottomX instead of a height
+		"""
+		if (self.generator == "trayClearWindow"):
+			return {
+				"width":	self.trayX*gridUnit-tolerance*2,
+				"depth":	self.trayY*gridUnit-tolerance*2,
+				"height":	binTopHeight(self.trayZ, self.topStyle)+binBottomDepth(self.bottomStyle),
+			}
+		#same arithmetic as trayAngleAdaptor()
+		if (self.angleDeg is None):
+			angleRad = atan(self.binHeight*heightUnit/gridUnit)
+			angleDeg = angleRad*180/3.14
+		else:
+			angleDeg = self.angleDeg
+			angleRad = angleDeg*3.14/180
+		trayXGrid	= gridUnit/cos(angleRad)
+		topFaceX	= cos(angleRad)*gridUnit
+		bottomX = floor((trayXGrid*self.topX)/(gridUnit))
+		if (((gridUnit*bottomX)%trayXGrid) < topFaceX):
+			bottomX = bottomX + 1/self.bottomDivX
+		return {
+			"width":	bottomX*gridUnit-tolerance*2,
+			"depth":	self.trayY*gridUnit-tolerance*2,
+			"angleDeg":	angleDeg,
+			"bottomX":	bottomX,
+		}
+
+@dataclass(frozen=True, slots=True)
+class PlateSpec(Spec):
+	"""
+	Arguments for baseplate()
+	"""
+	generator: str		= "baseplate"
+	_: KW_ONLY
+
+	plateX: float		= 3
+	plateY: float		= 3
+	plateZ: float		= None
+
+	plateStyle: PlateStyle = PlateStyle.MAGNET_ONLY
+
+	roundTop: bool		= False
+
+	def __post_init__(self):
+		if (self.generator != "baseplate"):
+			raise ValueError("PlateSpec cannot build {!r}".format(self.generator))
+		defaults = {}
+		if (self.plateZ is None):
+			defaults.update(plateZ=plateHeight(self.plateStyle))
+		self.normalize(**defaults)
+
+	def dimensions(self):
+		"""
+		:return: A dict of the outer width, depth and height
+		"""
+		return {
+			"width":	ceil(self.plateX)*gridUnit,
+			"depth":	ceil(self.plateY)*gridUnit,
+			"height":	self.plateZ,
+		}
+
+specTypes = {
+	"binSolid":			BinSpec,
+	"binCompartments":	BinSpec,
+	"binClearWindow":	BinSpec,
+	"trayClearWindow":	TraySpec,
+	"trayAngleAdaptor":	TraySpec,
+	"baseplate":		PlateSpec,
+}
+
+#parameters of each generator in order, so positional arguments are bound without importing cadquery.
+#Build options with no spec field, eg. asAssembly and workers, are left out.
+generatorParameters = {
+	"binSolid":			("binX", "binY", "binZ", "topStyle", "bottomStyle", "bottomDivX", "bottomDivY"),
+	"binCompartments":	("binX", "binY", "binZ", "divX", "divY", "scoop", "tabStyle", "tabAngle", "topStyle", "bottomStyle", "bottomDivX", "bottomDivY"),
+	"binClearWindow":	("binX", "binY", "binZ", "divX", "divY", "scoop", "tabStyle", "tabAngle", "topStyle", "bottomStyle", "bottomDivX", "bottomDivY", "clearSide", "clearDepth", "clearWidth", "clearHeight"),
+	"trayClearWindow":	("trayX", "trayY", "trayZ", "insertX", "insertY", "insertZ", "topStyle", "bottomStyle", "bottomDivX", "bottomDivY"),
+	"trayAngleAdaptor":	("topX", "trayY", "angleDeg", "binHeight", "topStyle", "bottomStyle", "bottomDivX", "bottomDivY"),
+	"baseplate":		("plateX", "plateY", "plateZ", "plateStyle", "roundTop"),
+}
+
+def makeSpec(generator, *args, **kwargs):
+	"""
+	Build the spec type matching a generator
+
+	:param generator: Name of the generator, eg. "binCompartments"
+	:param args: Positional arguments for the generator, in the order of its parameters
+	:param kwargs: Keyword arguments for the generator
+
+	:return: A BinSpec, TraySpec or PlateSpec
+	"""
+	if generator not in specTypes:
+		raise ValueError("Unknown generator {!r}".format(generator))
+	names = generatorParameters[generator]
+	if (len(args) > len(names)):
+		raise TypeError("a {} spec takes {} positional arguments ({}) but {} were given".format(generator, len(names), ", ".join(names), len(args)))
+	for name, value in zip(names, args):
+		if name in kwargs:
+			raise TypeError("{}() got multiple values for argument {!r}".format(generator, name))
+		kwargs[name] = value
+	return specTypes[generator](generator, **kwargs)
+
+def generatorFunction(name):
+	"""
+	:return: The generator function called name. Imports the geometry modules on first use.
+	"""
+	import gen_bin
+	if name not in specTypes:
+		raise ValueError("Unknown generator {!r}".format(name))
+	return getattr(gen_bin, name)
+
+def uniqueSpecs(specs):
+	"""
+	Deduplicate a batch of specs, so each distinct part is only built once
+
+	:param specs: List of specs
+
+	:return: A tuple of (list of distinct specs, list giving the position in it of each input spec)
+	"""
+	unique		= {}
+	positions	= []
+	for spec in specs:
+		positions.append(unique.setdefault(spec, len(unique)))
+	return (list(unique), positions)
+
+def acceptsSpec(generator):
+	"""
+	Decorator letting a generator be called with a single spec in place of its arguments
+	"""
+	@wraps(generator)
+	def wrapper(*args, **kwargs):
+		if (len(args) == 1 and not kwargs and isinstance(args[0], Spec)):
+			return generator(**args[0].arguments(generator))
+		return generator(*args, **kwargs)
+	return wrapper
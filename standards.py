@@ -63,4 +63,13 @@ class CrossSection(Enum):
 	QUADRANT	= 0
 	HALF		= 1
 	HALFY		= 1
-	HALFX		= 2
\ No newline at end of file
+	HALFX		= 2
+
+class Fidelity(Enum):
+	PREVIEW		= 0
+	FULL		= 1
+
+class Glue(Enum):
+	OFF			= 0
+	SHIFT		= 1
+	FULL		= 2
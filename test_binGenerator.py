@@ -1,4 +1,33 @@
+import asyncio
+import collections
+import inspect
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.request
+import zipfile
+from concurrent.futures.process import BrokenProcessPool
+
 from gen_bin import *
+from cache import diskCache, stageCache, shapeFromBytes
+from batch import generateBatch
+from layout import drawerLayout
+from packing import packBeds, exportBeds
+from server import makeServer, PartService, renderPart
+from aio import AsyncBuilder
+import aio
+from instrument import trace
+from config import config, useConfig, useFidelity
+from calculator import evaluateCatalog
+from export import exportAssembly, exportMesh, exportSection
+from specs import BinSpec, PlateSpec, uniqueSpecs, makeSpec, generatorParameters, generatorFunction
+
+#build every shape for real, testDiskCache() switches the cache on for itself
+diskCache.enabled = False
 
 def testBinSolid():
 	test_1x2x3		= binSolid(1,2,3,	TopStyle.INT_DIV_MAG, 	BottomStyle.MAGNET_SCREW).translate((gridUnit, gridUnit*0.5, 0))
@@ -22,12 +51,321 @@ def testClearWindow():
 	test_2x1x1_ClrT	= trayClearWindow(2, 1, 1).translate((gridUnit/2, gridUnit, 0))
 	test_1x2x3_ClrY = binClearWindow(1, 2, 3, 1, 2, clearSide="Y").translate((-gridUnit, gridUnit/2, 0))
 	test_2x1x3_ClrX = binClearWindow(2, 1, 3, 3, 1, 1).translate((-gridUnit*0.5, -gridUnit, 0))
+def testFractionalTray():
+	fractional = trayClearWindow(1.5, 1).val()
+	assert fractional.isValid() and len(fractional.Solids()) == 1
+	assert fractional.Volume() > trayClearWindow(1, 1).val().Volume()
+
 def testAngleTray():
 	test_1x1x3_Angle= trayAngleAdaptor().translate((gridUnit,-gridUnit,0))
 	test_1x1x9_Angle= trayAngleAdaptor(1, 1, binHeight=9).translate((-gridUnit, -gridUnit, 0))
 	test_1x1x6_Angle= trayAngleAdaptor(1, 1, binHeight=6).translate((0, -gridUnit, 0))
 	test_2x2x6_Angle= trayAngleAdaptor(2, 2, binHeight=6, bottomDivX=2, bottomDivY=2).translate((gridUnit*0.25, gridUnit*0.5, 0))
 
+def testUnitCache():
+	unitCache.clear()
+	stageCache.clear()
+	test_2x2x3		= binSolid(2,2,3,	TopStyle.STACKING,		BottomStyle.MAGNET_ONLY)
+	test_3x1x3		= binSolid(3,1,3,	TopStyle.STACKING,		BottomStyle.MAGNET_ONLY)
+	assert unitCache.info()["misses"] == 1
+	assert unitCache.info()["hits"] == 1
+
+def testStageCache():
+	binCompartments(2, 1, 3, 2, bottomDivX=2)
+	with trace("divX") as partTrace:
+		binCompartments(2, 1, 3, 3, bottomDivX=2)
+	rebuilt = [stage.name for stage in partTrace.stages if stage.booleans]
+	assert "compartments" in rebuilt and "bottom tiling" not in rebuilt
+
+def testStageCacheCopies():
+	#cached stages hand out new workplanes, so one part can't change the next
+	stageCache.clear()
+	expected = trayAngleAdaptor().val().Volume()
+	stageCache.clear()
+	trayClearWindow(1, 1, 1)
+	assert abs(trayAngleAdaptor().val().Volume() - expected) < 1e-3
+	binSolid(1, 1, 3).add(cq.Workplane("XY").box(1, 1, 1))
+	assert len(binSolid(1, 1, 3).vals()) == 1
+
+def testDiskCache():
+	previous = (diskCache.directory, diskCache.enabled)
+	with tempfile.TemporaryDirectory() as directory:
+		diskCache.directory	= directory
+		diskCache.enabled	= True
+		try:
+			test_1x1x3_2D	= binCompartments(1, 1, 3, 2)
+			test_cached		= binCompartments(1.0, 1, 3, 2)
+			assert diskCache.info()["files"] == 1 #only binCompartments, not the binSolid inside it
+			assert abs(test_cached.val().Volume() - test_1x1x3_2D.val().Volume()) < 1e-6
+			diskCache.invalidate()
+			assert diskCache.info()["files"] == 0
+		finally:
+			diskCache.directory, diskCache.enabled = previous
+
+def testBatch():
+	specs = [
+		{"generator": "binSolid",			"binX": 1,	"binY": 1,	"binZ": 2},
+		{"generator": "binCompartments",	"binX": 2,	"binY": 1,	"binZ": 3,	"divX": 2},
+		{"generator": "binSolid",			"binX": -1},
+	]
+	results = sorted(generateBatch(specs, maxWorkers=2))
+	assert [result.index for result in results] == [0, 1, 2]
+	assert shapeFromBytes(results[1].data).Volume() > 0
+	assert results[2].data is None and "binX cannot be less than 0" in results[2].error
+
+def testBatchCrash():
+	#forked workers inherit the patched buildPart, which dies like a crash inside OCCT
+	import batch
+	original = batch.buildPart
+	def crashing(spec, *args):
+		if (spec.binZ == 4):
+			os._exit(1)
+		return original(spec, *args)
+	batch.buildPart = crashing
+	try:
+		specs = [BinSpec("binSolid", binX=1, binY=1, binZ=binZ) for binZ in (2, 4, 3)]
+		results = sorted(generateBatch(specs, maxWorkers=2))
+	finally:
+		batch.buildPart = original
+	assert [result.error is None for result in results] == [True, False, True]
+	assert "died" in results[1].error
+
+def testDrawerLayout():
+	smallBin = BinSpec("binSolid", binX=1, binY=1, binZ=2)
+	drawer = drawerLayout(3, 1, [(smallBin, 0, 0), (smallBin, 1, 0), ({"generator": "binSolid", "binX": 1, "binZ": 3}, 2, 0)], maxWorkers=2)
+	assert [item.quantity for item in drawer.bom] == [1, 2, 1]
+	assert drawer.assembly.children[0].obj is drawer.assembly.children[1].obj
+	assert drawer.assembly.children[1].loc.toTuple()[0] == (0, 0, 0)
+	try:
+		drawerLayout(2, 1, [(smallBin, 0, 0), (smallBin, 0.5, 0)])
+		assert False
+	except ValueError as e:
+		assert "overlaps" in str(e)
+
+def testPacking():
+	beds = packBeds([(100, 40), (40, 100), (120, 50), BinSpec("binSolid", binX=2, binY=1, binZ=2)], 150, 150)
+	assert len(beds) == 2
+	assert sorted(part.index for bed in beds for part in bed.parts) == [0, 1, 2, 3]
+	assert all(part.width >= part.depth for bed in beds for part in bed.parts)
+	with tempfile.TemporaryDirectory() as folder:
+		smallBins = [BinSpec("binSolid", binX=1, binY=1, binZ=2)]*3
+		reports = exportBeds(smallBins, packBeds(smallBins, 90, 50), os.path.join(folder, "bed{}.stl"))
+		assert len(reports) == 2 and all(report.triangles > 0 for report in reports)
+
+def testServer():
+	server = makeServer(port=0, maxWorkers=1)
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	try:
+		address = "http://{}:{}".format(*server.server_address)
+		request = json.dumps({"generator": "binSolid", "binX": 1, "binY": 1, "binZ": 2}).encode()
+		sources = []
+		bodies = []
+		for _ in range(2):
+			with urllib.request.urlopen(urllib.request.Request(address+"/part", request)) as response:
+				sources.append(response.headers["X-Cache"])
+				bodies.append(response.read())
+		assert sources == ["miss", "hit"]
+		assert bodies[0] == bodies[1] and len(bodies[0]) > 84
+		with urllib.request.urlopen(address+"/stats") as response:
+			assert json.load(response)["size"] == 1
+		try:
+			urllib.request.urlopen(urllib.request.Request(address+"/part", b'{"generator": "nothing"}'))
+			assert False
+		except urllib.error.HTTPError as e:
+			assert e.code == 400
+	finally:
+		server.shutdown()
+		server.service.close()
+		server.server_close()
+
+#dies like a crash inside OCCT - at module level, so the pool can pickle it in place of renderPart
+def crashingRender(spec, *args):
+	if (spec.binZ == 4):
+		os._exit(1)
+	return renderPart(spec, *args)
+
+def testServerCrash():
+	import server
+	server.renderPart = crashingRender
+	service = PartService(1)
+	try:
+		try:
+			service.render(BinSpec("binSolid", binX=1, binY=1, binZ=4))
+			assert False
+		except BrokenProcessPool:
+			pass
+		data, source = service.render(BinSpec("binSolid", binX=1, binY=1, binZ=2))
+		assert source == "miss" and len(data) > 84
+	finally:
+		server.renderPart = renderPart
+		service.close()
+
+def testAsync():
+	builder = AsyncBuilder(1)
+	events = []
+	async def run():
+		part = await aio.binSolid(1, 1, 2, TopStyle.NONE, BottomStyle.BLANK, builder=builder, timeout=120, onProgress=events.append)
+		assert part.val().isValid()
+		#positional arguments follow the generator, not the spec
+		assert abs(part.val().BoundingBox().zmax - 2*heightUnit) < 0.05
+		#the worker builds with the caller's config
+		with useFidelity(Fidelity.PREVIEW):
+			preview = await aio.binSolid(2, 1, 3, builder=builder, timeout=120)
+			local = binSolid(2, 1, 3)
+		assert len(preview.val().Faces()) == len(local.val().Faces())
+		try:
+			await aio.baseplate(17, 13, builder=builder, timeout=0.5)
+			assert False
+		except asyncio.TimeoutError:
+			pass
+	try:
+		asyncio.run(run())
+	finally:
+		builder.close()
+	assert events[0].event == "start" and events[-1] == ("end", "binSolid", 0, events[-1].duration)
+	assert builder.idle == []
+
+def testBaseplateTiles():
+	tileList = list(baseplateTiles(5, 2, gridUnit*2, gridUnit*2))
+	assert [round(tile.plate.val().BoundingBox().xlen, 3) for tile in tileList] == [gridUnit*2, gridUnit*2, gridUnit*1]
+	tileVolume = sum(tile.plate.val().Volume() for tile in tileList)
+	assert abs(tileVolume - baseplate(5, 2).val().Volume()) < 1e-3
+	assert tileList[0].offset == (-gridUnit*1.5, 0, 0)
+
+def testParallelBaseplate():
+	serial		= baseplate(3, 2).val()
+	parallel	= baseplate(3, 2, workers=2).val()
+	assert parallel.isValid() and len(parallel.Solids()) == 1
+	assert abs(serial.Volume() - parallel.Volume()) < 1e-3
+
+def testBooleanOptions():
+	original = cq.Shape._bool_op
+	exact = binSolid(2, 1, 3, bottomDivX=2).val()
+	#only the generators' own booleans are configured
+	assert cq.Shape._bool_op is original
+	with useConfig(glue=Glue.SHIFT, parallel=False) as glued:
+		assert ("glue", "SHIFT") in glued.key()
+		shifted = binSolid(2, 1, 3, bottomDivX=2).val()
+	assert config.glue is Glue.OFF and config.parallel
+	assert shifted.isValid() and abs(exact.Volume() - shifted.Volume()) < 1e-3
+
+def testAssembly():
+	plate = baseplate(3, 2, asAssembly=True)
+	assert len({id(child.obj) for child in plate.children}) == 1
+	assert abs(plate.toCompound().Volume() - baseplate(3, 2).val().Volume()) < 1e-3
+	bin = binSolid(2, 1, 3, asAssembly=True)
+	assert abs(bin.toCompound().Volume() - binSolid(2, 1, 3).val().Volume()) < 1e-3
+	with tempfile.TemporaryDirectory() as folder:
+		exportAssembly(plate, folder+"/plate.step")
+		exportAssembly(bin, folder+"/bin.3mf")
+
+def testExport():
+	bin = binCompartments(1, 1, 3, 2, 1)
+	with tempfile.TemporaryDirectory() as folder:
+		fine = exportMesh(bin, folder+"/fine.stl", tolerance=0.05, angularTolerance=0.1)
+		coarse = exportMesh(bin, folder+"/coarse.3mf", tolerance=0.5, angularTolerance=0.5)
+		assert os.path.getsize(folder+"/fine.stl") == 84+50*fine.triangles
+		#every edge of a manifold mesh is shared by exactly two triangles
+		with zipfile.ZipFile(folder+"/coarse.3mf") as package:
+			model = package.read("3D/3dmodel.model").decode()
+		edges = collections.Counter()
+		for triangle in re.findall(r'v1="(\d+)" v2="(\d+)" v3="(\d+)"', model):
+			a, b, c = map(int, triangle)
+			edges.update(frozenset(edge) for edge in ((a, b), (b, c), (c, a)))
+		assert set(edges.values()) == {2}
+	assert 0 < coarse.triangles < fine.triangles
+
+def testPreview():
+	full = binCompartments(2, 1, 3, 2, 1, scoop=1).val().BoundingBox()
+	with useFidelity(Fidelity.PREVIEW):
+		preview = binCompartments(2, 1, 3, 2, 1, scoop=1).val().BoundingBox()
+	for side in ("xmin", "xmax", "ymin", "ymax", "zmin", "zmax"):
+		#bounding boxes of curved faces are loose by a few hundredths
+		assert abs(getattr(full, side) - getattr(preview, side)) < 0.05
+
+def testCliDryRun():
+	#a dry run must not pay for importing cadquery
+	check = "import sys, cli; cli.main(['bin', '2', '1', '6', '--div', '2', '1', '--dry-run']); assert 'cadquery' not in sys.modules"
+	subprocess.run([sys.executable, "-c", check], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+	#bins the calculator rejects never reach OCCT
+	import cli
+	try:
+		cli.main(['bin', '1', '1', '3', '--div', '30', '1', '--dry-run'])
+		assert False
+	except SystemExit as e:
+		assert e.code == 2
+	spec = BinSpec("binSolid", binX=2, binY=1, binZ=3)
+	assert abs(spec.dimensions()["height"] - binSolid(2, 1, 3).val().BoundingBox().zlen) < 0.05
+
+def testCalculator():
+	catalog = [
+		BinSpec("binCompartments", binX=2, binY=1, binZ=3, divX=2),
+		BinSpec("binClearWindow", binX=1, binY=2, binZ=6, clearSide="Y"),
+		{"generator": "binCompartments", "binX": 1, "divX": 8},
+		{"generator": "binSolid", "binX": 1, "bottomDivX": 5},
+	]
+	checked = evaluateCatalog(catalog)
+	assert list(checked["valid"]) == [True, True, False, False]
+	assert "compartmentWidth" in checked["errors"][2][0]
+	assert "too big" in checked["errors"][3][0]
+	assert checked["compartmentWidth"][0] == catalog[0].dimensions()["compartmentWidth"] == (83.5-1.2*3)/2
+	try:
+		BinSpec(binX=1, divX=8).dimensions()
+		assert False
+	except ValueError as e:
+		assert "compartmentWidth" in str(e)
+
+def testIntDivLip():
+	#the lip of a half height bin reaches down into the bottom interlock
+	for binZ in (0.5, 3):
+		lipTop = binSolid(3, 2, binZ, TopStyle.INT_DIV_MAG).val()
+		assert lipTop.isValid() and len(lipTop.Solids()) == 1
+	assert abs(lipTop.BoundingBox().zmax - (3*heightUnit-outsideTop/2-tolerance)) < 0.05
+
+def testSection():
+	profile = section(binSolid(2, 1, 3), "Y", 0)
+	box = profile.val().BoundingBox()
+	assert abs(box.xlen - (2*gridUnit-tolerance*2)) < 0.05
+	assert abs(box.zmin + insideDepth) < 0.05
+	with tempfile.TemporaryDirectory() as folder:
+		for exportType in ("SVG", "DXF"):
+			exported = exportSection(profile, os.path.join(folder, "section."+exportType.lower()))
+			assert os.path.getsize(exported.fileName) > 0
+
+def testTrace():
+	with trace("test_2x1x3_2D") as partTrace:
+		test_2x1x3_2D	= binCompartments(2, 1, 3, 2)
+	stageNames = [stage.name for stage in partTrace.stages]
+	assert stageNames[:2] == ["binCompartments", "binSolid"]
+	assert "bottom tiling" in stageNames and "compartments" in stageNames
+	assert partTrace.booleans == partTrace.stages[0].booleans > 0
+	assert len(partTrace.toChromeTrace()["traceEvents"]) == len(stageNames)
+
+def testSpecs():
+	assert BinSpec("binSolid", binX=1, binZ=3, bottomDivX=None) == BinSpec("binSolid", binX=1.0, binZ=3, divX=4)
+	assert BinSpec("binCompartments", binZ=3, divX=2) != BinSpec("binCompartments", binZ=3, divX=3)
+	assert PlateSpec(plateZ=None) == PlateSpec(plateZ=outsideDepth+magnetDepth+wallThickness)
+	distinctSpecs, positions = uniqueSpecs([BinSpec(binX=2), PlateSpec(), BinSpec(binX=2.0, bottomDivY=None)])
+	assert len(distinctSpecs) == 2 and positions == [0, 1, 0]
+	test_1x1x3_Spec	= binSolid(BinSpec("binSolid", binX=1, binY=1, binZ=3, topStyle=TopStyle.NONE))
+	assert abs(test_1x1x3_Spec.val().BoundingBox().zmax - 3*heightUnit) < 0.05
+	try:
+		BinSpec("binSolid", 1, 1, 3, TopStyle.NONE)
+		assert False
+	except TypeError:
+		pass
+	test_2x2_Spec	= baseplate(PlateSpec(plateX=2, plateY=2))
+	assert makeSpec("trayAngleAdaptor", 2, 2).topX == 2
+	assert makeSpec("binSolid", 1, 1, 2, TopStyle.INT_DIV).topStyle is TopStyle.INT_DIV
+	for name, parameters in generatorParameters.items():
+		assert tuple(inspect.signature(generatorFunction(name)).parameters)[:len(parameters)] == parameters
+	try:
+		makeSpec("binSolid", 1, 1, 2, TopStyle.INT_DIV, BottomStyle.NONE, 1, 1, True)
+		assert False
+	except TypeError:
+		pass
+
 testBinSolid()
 testSubDivisions()
 testBinCompartments()